@@ -0,0 +1,117 @@
+#!/usr/bin/env python2.6
+# Authors: Brad McRae and Darren Kavanagh
+
+"""Core area adjacency from allocation arrays.
+
+Two core areas are adjacent when their allocation zones touch: a cell
+allocated to one has a right, lower or diagonal neighbor allocated to the
+other.  This is the grid shift method, done by comparing array slices
+instead of shifting and combining rasters.
+
+"""
+
+import numpy as npy
+
+# (row, col) offsets of the neighbors each cell is compared with: right,
+# down, down-right and down-left.  With the cell itself these cover all
+# eight neighbor directions.
+SHIFTS = [(0, 1), (1, 0), (1, 1), (1, -1)]
+
+
+def _shifted(alloc, dr, dc):
+    """Returns slices of alloc and of its neighbors at (dr, dc)"""
+    nrows, ncols = alloc.shape
+    if dc >= 0:
+        cols, shiftedCols = slice(0, ncols - dc), slice(dc, ncols)
+    else:
+        cols, shiftedCols = slice(-dc, ncols), slice(0, ncols + dc)
+    return (alloc[0:nrows - dr, cols], alloc[dr:nrows, shiftedCols])
+
+
+def pair_keys(zones1, zones2):
+    """Packs zone ID pairs into sorted (low, high) 64-bit keys"""
+    zones1 = zones1.astype('int64')
+    zones2 = zones2.astype('int64')
+    low = npy.minimum(zones1, zones2)
+    high = npy.maximum(zones1, zones2)
+    return (low << 32) | high
+
+
+def keys_in(keys, sortedKeys):
+    """Returns boolean array, True where keys are in sortedKeys.
+
+    sortedKeys must be sorted.  Works like numpy's in1d, which older numpy
+    releases lack.
+
+    """
+    if len(sortedKeys) == 0:
+        return npy.zeros(len(keys), dtype='bool')
+    ind = npy.searchsorted(sortedKeys, keys)
+    ind[ind == len(sortedKeys)] = 0
+    return sortedKeys[ind] == keys
+
+
+def min_by_key(keys, values):
+    """Returns indices of the smallest value for each unique key, in key
+    order.
+
+    """
+    order = npy.lexsort((values, keys))
+    sortedKeys = keys[order]
+    first = npy.ones(len(order), dtype='bool')
+    first[1:] = sortedKeys[1:] != sortedKeys[:-1]
+    return order[first]
+
+
+def keys_to_table(keys):
+    """Returns (n, 2) int32 table of zone ID pairs from pair keys"""
+    adjTable = npy.zeros((len(keys), 2), dtype='int32')
+    adjTable[:, 0] = keys >> 32
+    adjTable[:, 1] = keys & 0xFFFFFFFF
+    return adjTable
+
+
+def get_adjacent_keys(alloc):
+    """Returns sorted unique pair keys of adjacent zones in alloc.
+
+    alloc is an integer array with 0 (or less) for NoData.
+
+    """
+    keys = [npy.zeros(0, dtype='int64')]
+    for dr, dc in SHIFTS:
+        zones1, zones2 = _shifted(alloc, dr, dc)
+        differ = (zones1 != zones2) & (zones1 > 0) & (zones2 > 0)
+        keys.append(npy.unique(pair_keys(zones1[differ], zones2[differ])))
+    return npy.unique(npy.concatenate(keys))
+
+
+def get_adjacent_pairs(alloc):
+    """Returns (n, 2) table of adjacent zone pairs in alloc.
+
+    Pairs are (lower ID, higher ID), sorted by first then second ID, as
+    from combine_adjacency_tables.
+
+    """
+    return keys_to_table(get_adjacent_keys(alloc))
+
+
+def get_adjacent_keys_in_strips(readStrip, nrows, stripRows):
+    """Returns sorted unique pair keys of adjacent zones, reading the
+    allocation array in strips of rows.
+
+    readStrip(row0, row1) returns rows row0 to row1 - 1 of the allocation
+    array.  Each strip after the first starts with the last row of the one
+    before, so zones touching across strip edges are found, and results
+    match get_adjacent_keys on the whole array.  Peak memory is one strip
+    plus the pairs found so far.
+
+    """
+    keys = npy.zeros(0, dtype='int64')
+    row0 = 0
+    while True:
+        row1 = min(row0 + max(stripRows, 1) + 1, nrows)
+        keys = npy.union1d(keys, get_adjacent_keys(readStrip(row0, row1)))
+        if row1 >= nrows:
+            break
+        row0 = row1 - 1  # One-row halo
+    return keys
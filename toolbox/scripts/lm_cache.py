@@ -0,0 +1,174 @@
+#!/usr/bin/env python2.6
+# Authors: Brad McRae and Darren Kavanagh
+
+"""Cache of parsed text inputs.
+
+Distance, adjacency and link table files are parsed with npy.loadtxt once
+per version of the file.  The parsed array is saved as a .npy file in a
+cache folder in the datapass directory, so nothing is written beside the
+inputs, with a small index recording the text file's size, modification
+time and MD5 hash and the loadtxt arguments used.  A file with the same
+size and modification time is taken as unchanged, unless it was modified
+so soon before the cache was written that a later change could share its
+time stamp.  Otherwise the file is hashed, which is still far quicker
+than parsing.  Failing to write the cache just means parsing each time.
+
+"""
+
+import os
+import os.path as path
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+import numpy as npy
+
+from lm_config import tool_env as cfg
+
+CACHE_DIR = "cache"  # Folder in datapass directory
+DATA_SUFFIX = ".lmcache.npy"
+INDEX_SUFFIX = ".lmcache.dat"
+MTIME_SLACK = 2  # Seconds; coarsest file time resolution (FAT)
+
+
+def _file_hash(fileName):
+    digest = md5()
+    inFile = open(fileName, 'rb')
+    try:
+        while True:
+            data = inFile.read(1048576)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        inFile.close()
+    return digest.hexdigest()
+
+
+def _cache_name(fileName):
+    """Returns path of a text file's cache files, less suffix, or None if
+    there is no datapass directory.
+
+    Files are named by the text file's name and a hash of its full path,
+    so inputs with the same name in different folders don't collide.
+
+    """
+    dataPassDir = getattr(cfg, 'DATAPASSDIR', None)
+    if dataPassDir is None:
+        return None
+    fullName = path.normcase(path.abspath(fileName))
+    try:
+        digest = md5(fullName)
+    except (TypeError, UnicodeError):  # Unicode path
+        digest = md5(fullName.encode('utf-8'))
+    return path.join(dataPassDir, CACHE_DIR, path.basename(fileName) + '_' +
+                     digest.hexdigest()[:12])
+
+
+def _read_index(cacheName):
+    try:
+        inFile = open(cacheName + INDEX_SUFFIX, 'rb')
+        try:
+            return pickle.load(inFile)
+        finally:
+            inFile.close()
+    except Exception:
+        return None
+
+
+def _write_index(cacheName, index):
+    outFile = open(cacheName + INDEX_SUFFIX, 'wb')
+    try:
+        pickle.dump(index, outFile, 2)
+    finally:
+        outFile.close()
+
+
+def _write_cache(cacheName, array, index):
+    try:
+        if not path.exists(path.dirname(cacheName)):
+            os.makedirs(path.dirname(cacheName))
+        outFile = open(cacheName + DATA_SUFFIX, 'wb')
+        try:
+            npy.save(outFile, array)
+        finally:
+            outFile.close()
+        # Index goes last, so it never describes an unfinished array
+        _write_index(cacheName, index)
+    except Exception:
+        _delete_files(cacheName)
+
+
+def _delete_files(cacheName):
+    for suffix in (INDEX_SUFFIX, DATA_SUFFIX):
+        try:
+            if path.exists(cacheName + suffix):
+                os.remove(cacheName + suffix)
+        except Exception:
+            pass
+
+
+def delete_cache(fileName):
+    """Deletes a text file's cache, if there is one"""
+    cacheName = _cache_name(fileName)
+    if cacheName is not None:
+        _delete_files(cacheName)
+
+
+def loadtxt(fileName, **kwargs):
+    """Returns npy.loadtxt(fileName, **kwargs), parsing the text only if
+    the cache doesn't hold this version of it.
+
+    """
+    # Tools other than Linkage Mapper don't read lm_settings
+    cacheName = None
+    if getattr(cfg, 'CACHEINPUTS', True):
+        cacheName = _cache_name(fileName)
+    if cacheName is None:
+        return npy.loadtxt(fileName, **kwargs)
+    args = sorted([(key, str(value)) for key, value in kwargs.items()])
+    size = path.getsize(fileName)
+    mtime = path.getmtime(fileName)
+
+    index = _read_index(cacheName)
+    fileHash = None
+    if (index is not None and index['args'] == args and
+        index['size'] == size):
+        if (index['mtime'] == mtime and
+            mtime < index['cacheTime'] - MTIME_SLACK):
+            current = True
+        else:
+            fileHash = _file_hash(fileName)
+            current = index['hash'] == fileHash
+        if current:
+            try:
+                array = npy.load(cacheName + DATA_SUFFIX)
+            except Exception:
+                pass
+            else:
+                if index['mtime'] != mtime or fileHash is not None:
+                    # Same contents, so skip the hash next time
+                    index.update(mtime=mtime, cacheTime=time.time())
+                    try:
+                        _write_index(cacheName, index)
+                    except Exception:
+                        pass
+                return array
+
+    # Hash before parsing, so a change made while parsing shows next time
+    cacheTime = time.time()
+    if fileHash is None:
+        fileHash = _file_hash(fileName)
+    array = npy.loadtxt(fileName, **kwargs)
+    _write_cache(cacheName, array, {'args': args, 'size': size,
+                                    'mtime': mtime, 'hash': fileHash,
+                                    'cacheTime': cacheTime})
+    return array
@@ -0,0 +1,635 @@
+#!/usr/bin/env python2.6
+# Authors: Brad McRae and Darren Kavanagh
+
+"""Native cost-distance engine.
+
+Calculates cost-weighted distance and back-link arrays over an 8-connected
+resistance grid, following the same conventions as the ArcGIS CostDistance
+tool, plus Euclidean allocation by feature transform.  Small grids are
+searched with a priority queue (Dijkstra); large ones are swept line by
+line with array operations.  Only needs numpy, so it runs without arcpy or
+geoprocessor calls.
+
+"""
+
+import heapq
+import math
+
+import numpy as npy
+
+SQRT2 = math.sqrt(2)
+
+# Back-link direction codes used by ArcGIS CostDistance: 0 is a source cell,
+# 1 points east and codes continue clockwise to 8 (northeast).  Offsets are
+# (row, col), with rows increasing southward as in RasterToNumPyArray.
+BACK_OFFSETS = [(0, 0), (0, 1), (1, 1), (1, 0), (1, -1),
+                (0, -1), (-1, -1), (-1, 0), (-1, 1)]
+BACK_NODATA = -1
+BACK_CODES = dict([(BACK_OFFSETS[code], code) for code in range(9)])
+
+HEAPCELLS = 1000000  # Largest grid searched with a priority queue
+
+
+def cost_distance(resistance, sources, cellSize=1.0, maxDist=None,
+                  targets=None, cutoff=0):
+    """Returns cost-weighted distance and back-link arrays.
+
+    resistance -- 2D array of cell resistances.  NaN or negative cells are
+                  NoData and act as barriers.
+    sources -- boolean array, True for source cells
+    cellSize -- cell size in map units
+    maxDist -- optional maximum cost-weighted distance (cells beyond it are
+               NoData, as with the CostDistance maximum distance)
+    targets -- optional integer array with positive core IDs on target
+               cells.  Once every target ID has been reached, the search
+               stops at the largest target distance plus cutoff.
+    cutoff -- distance to keep spreading past the farthest target
+
+    CWD is returned as float64 with npy.inf for NoData, back-links as int8
+    with BACK_NODATA for NoData.
+
+    """
+    seeds = npy.where(sources, 1, 0)
+    cwd, back, alloc = spread(resistance, seeds, cellSize, maxDist, targets,
+                              cutoff)
+    return cwd, back
+
+
+def zonal_minimum(values, zones):
+    """Returns {zone ID: minimum value} for positive zone IDs.
+
+    Non-finite values are NoData and zones without data are left out.
+
+    """
+    cells = (zones > 0) & npy.isfinite(values)
+    zoneIds = zones[cells].astype('int64')
+    zoneValues = values[cells].astype('float64')
+    if len(zoneIds) == 0:
+        return {}
+    if hasattr(npy.minimum, 'at'):
+        mins = npy.empty(zoneIds.max() + 1, dtype='float64')
+        mins.fill(npy.inf)
+        npy.minimum.at(mins, zoneIds, zoneValues)
+        found = npy.where(npy.isfinite(mins))[0]
+        return dict(zip(found.tolist(), mins[found].tolist()))
+    # Older numpy: sort by zone then value and take first of each zone
+    order = npy.lexsort((zoneValues, zoneIds))
+    zoneIds = zoneIds[order]
+    zoneValues = zoneValues[order]
+    first = npy.ones(len(zoneIds), dtype='bool')
+    first[1:] = zoneIds[1:] != zoneIds[:-1]
+    return dict(zip(zoneIds[first].tolist(), zoneValues[first].tolist()))
+
+
+def euclidean_allocation(seeds, stripCells=10000000):
+    """Returns the label of the nearest seed cell for every cell.
+
+    seeds is an integer array with positive labels on seed cells.  Uses an
+    exact Euclidean feature transform (Meijster et al. 2000): a pass down
+    each column finds the nearest seed row, then a lower envelope along
+    each row picks the nearest of those.  Both passes are linear in the
+    number of cells and run vectorized across columns or rows.  The row
+    pass works on strips of about stripCells cells, so only the column
+    pass result and the labels are held for the whole grid.  Cells are
+    returned 0 if there are no seeds.
+
+    """
+    nrows, ncols = seeds.shape
+    isSeed = seeds > 0
+    if not isSeed.any():
+        return npy.zeros(seeds.shape, dtype='int32')
+
+    # Column pass: nearest seed row in each column, above or below
+    rowIds = npy.arange(nrows, dtype='int32')[:, npy.newaxis]
+    far = nrows + ncols  # Beyond any distance on the grid
+    above = npy.where(isSeed, rowIds, npy.int32(-far))
+    above = npy.maximum.accumulate(above, axis=0)
+    below = npy.where(isSeed, rowIds, npy.int32(nrows + far))
+    below = npy.minimum.accumulate(below[::-1], axis=0)[::-1]
+    nearestRow = npy.where(rowIds - above <= below - rowIds, above, below)
+    del above, below
+
+    labels = npy.zeros(seeds.shape, dtype='int32')
+    stripRows = max(1, int(stripCells // ncols))
+    for row0 in range(0, nrows, stripRows):
+        row1 = min(nrows, row0 + stripRows)
+        stripNearestRow = nearestRow[row0:row1]
+        g = npy.abs(rowIds[row0:row1] - stripNearestRow).astype('int64')
+        g[g > far] = far  # Columns with no seeds
+        nearestCol = _envelope_columns(g * g)
+        rows = npy.arange(row1 - row0)[:, npy.newaxis]
+        labels[row0:row1] = seeds[stripNearestRow[rows, nearestCol],
+                                  nearestCol]
+    return labels
+
+
+def _envelope_columns(g2):
+    """Returns the column minimizing (column - u) ** 2 + g2[row, column]
+    for every cell (row, u).
+
+    Lower envelope of parabolas for all rows at once.  s holds the columns
+    whose parabolas form the envelope and t where each one starts; q is the
+    index of the last one in each row.
+
+    """
+    nrows, ncols = g2.shape
+    rows = npy.arange(nrows)
+    s = npy.zeros((nrows, ncols), dtype='int32')
+    t = npy.zeros((nrows, ncols), dtype='int32')
+    q = npy.zeros(nrows, dtype='int32')
+    for u in range(1, ncols):
+        gu = g2[:, u]
+        while True:
+            active = npy.nonzero(q >= 0)[0]
+            sq = s[active, q[active]].astype('int64')
+            tq = t[active, q[active]].astype('int64')
+            pop = ((tq - sq) ** 2 + g2[active, sq] >
+                   (tq - u) ** 2 + gu[active])
+            if not pop.any():
+                break
+            q[active[pop]] -= 1
+        empty = q < 0
+        q[empty] = 0
+        s[empty, 0] = u
+        rest = npy.nonzero(~empty)[0]
+        sq = s[rest, q[rest]].astype('int64')
+        w = 1 + ((u * u - sq * sq + gu[rest] - g2[rest, sq]) //
+                 (2 * (u - sq)))
+        push = rest[w < ncols]
+        q[push] += 1
+        s[push, q[push]] = u
+        t[push, q[push]] = w[w < ncols]
+
+    # Read the envelope back from the right
+    nearestCol = npy.zeros((nrows, ncols), dtype='int32')
+    for u in range(ncols - 1, -1, -1):
+        nearestCol[:, u] = s[rows, q]
+        q[t[rows, q] == u] -= 1
+    return nearestCol
+
+
+def spread(resistance, seeds, cellSize=1.0, maxDist=None, targets=None,
+           cutoff=0, heapCells=HEAPCELLS, stripCells=10000000):
+    """Multi-source spread over an 8-connected resistance grid.
+
+    seeds is an integer array with positive labels on source cells.  Each
+    reached cell inherits the label of the source it is nearest to.
+    targets and cutoff work as in cost_distance.
+
+    Returns cwd, back-link and allocation arrays.
+
+    Moving between neighboring cells costs the mean of their resistances
+    times the cell size, times sqrt(2) on diagonals.
+
+    Grids of up to heapCells cells are searched with a priority queue,
+    which stops spreading as soon as the targets are reached.  Larger
+    grids are swept with array operations (see _sweep_spread), working on
+    strips of about stripCells cells when sweeping across columns.  Both
+    give the same distances, give or take rounding; where two sources or
+    neighbors tie, they may pick different ones.
+
+    """
+    if resistance.size > heapCells:
+        return _sweep_spread(resistance, seeds, cellSize, maxDist, targets,
+                             cutoff, stripCells)
+    return _heap_spread(resistance, seeds, cellSize, maxDist, targets,
+                        cutoff)
+
+
+def _heap_spread(resistance, seeds, cellSize, maxDist, targets, cutoff):
+    """Dijkstra spread with a priority queue.
+
+    Ties are broken by cell order so results are repeatable.  The queue
+    and per-cell state are plain Python, which is quick for the windows
+    used in step 3 but too slow and memory hungry for whole rasters.
+
+    """
+    nrows, ncols = resistance.shape
+    width = ncols + 2
+    size = (nrows + 2) * width
+
+    # Pad with a one-cell NoData border so neighbors never need bounds checks
+    padded = npy.empty((nrows + 2, width), dtype='float64')
+    padded.fill(npy.nan)
+    padded[1:-1, 1:-1] = resistance
+    valid = npy.isfinite(padded)
+    valid[valid] = padded[valid] >= 0
+    halfCost = npy.where(valid, padded * (0.5 * float(cellSize)), -1.0)
+    halfCost = halfCost.ravel().tolist()
+
+    labels = npy.zeros((nrows + 2, width), dtype='int64')
+    labels[1:-1, 1:-1] = seeds
+    labels = npy.where(valid, labels, 0).ravel()
+    seedCells = npy.where(labels > 0)[0]
+
+    inf = float('inf')
+    dist = [inf] * size
+    back = [BACK_NODATA] * size
+    alloc = [0] * size
+
+    steps = []
+    for code in range(1, 9):
+        dr, dc = BACK_OFFSETS[code]
+        if dr != 0 and dc != 0:
+            factor = SQRT2
+        else:
+            factor = 1.0
+        # Moving by (dr, dc) means the back-link points the opposite way
+        backCode = (code + 3) % 8 + 1
+        steps.append((dr * width + dc, backCode, factor))
+
+    # Target IDs not reached yet, and the label of each target cell
+    toReach = {}
+    if targets is not None:
+        targetLabels = npy.zeros((nrows + 2, width), dtype='int64')
+        targetLabels[1:-1, 1:-1] = targets
+        targetLabels = npy.where(valid, targetLabels, 0).ravel()
+        targetCells = npy.where(targetLabels > 0)[0].tolist()
+        for cell in targetCells:
+            toReach[cell] = int(targetLabels[cell])
+        remaining = set(toReach.values())
+
+    heap = []
+    for cell in seedCells.tolist():
+        dist[cell] = 0.0
+        back[cell] = 0
+        alloc[cell] = int(labels[cell])
+        heap.append((0.0, cell))
+    heapq.heapify(heap)
+
+    heappop = heapq.heappop
+    heappush = heapq.heappush
+    while heap:
+        d, u = heappop(heap)
+        if d > dist[u]:
+            continue  # Stale queue entry
+        if maxDist is not None and d > maxDist:
+            break
+        if toReach and u in toReach:
+            # Cells are settled in distance order, so the first cell reached
+            # in a target core gives that core's minimum distance
+            remaining.discard(toReach.pop(u))
+            if not remaining:
+                toReach = {}
+                if maxDist is None or d + cutoff < maxDist:
+                    maxDist = d + cutoff
+        hu = halfCost[u]
+        label = alloc[u]
+        for offset, backCode, factor in steps:
+            v = u + offset
+            hv = halfCost[v]
+            if hv < 0:
+                continue
+            nd = d + (hu + hv) * factor
+            if nd < dist[v]:
+                dist[v] = nd
+                back[v] = backCode
+                alloc[v] = label
+                heappush(heap, (nd, v))
+
+    cwd = npy.array(dist, dtype='float64').reshape(nrows + 2, width)
+    back = npy.array(back, dtype='int8').reshape(nrows + 2, width)
+    alloc = npy.array(alloc, dtype='int32').reshape(nrows + 2, width)
+    cwd = cwd[1:-1, 1:-1]
+    back = back[1:-1, 1:-1]
+    alloc = alloc[1:-1, 1:-1]
+
+    if maxDist is not None:
+        beyond = cwd > maxDist
+        cwd[beyond] = npy.inf
+        back[beyond] = BACK_NODATA
+        alloc[beyond] = 0
+    return cwd, back, alloc
+
+
+def _sweep_spread(resistance, seeds, cellSize, maxDist, targets, cutoff,
+                  stripCells):
+    """Spread by sweeping the grid with array operations.
+
+    Each sweep goes through the lines of cells in turn, relaxing each line
+    from the line before it and then along itself in both directions.
+    Sweeps go down, up, right and left, and repeat until they improve no
+    cell.  Each sweep finds every path that keeps heading the
+    same way, so only paths that wind back and forth take more than a few
+    rounds, and the work is a few numpy operations per row or column.
+    Sweeps across columns work on transposed strips of rows.
+
+    Only distances up to maxDist are kept as the sweeps go.  Targets can't
+    stop the sweeps early, so the target cutoff is applied at the end.
+    Holds cwd as float64, allocation as int32 and back-links as int8 for
+    the whole grid.
+
+    """
+    nrows, ncols = resistance.shape
+    halfSize = 0.5 * float(cellSize)
+    cwd = npy.empty((nrows, ncols), dtype='float64')
+    cwd.fill(npy.inf)
+    back = npy.empty((nrows, ncols), dtype='int8')
+    back.fill(BACK_NODATA)
+    alloc = npy.zeros((nrows, ncols), dtype='int32')
+
+    seedRows, seedCols = npy.nonzero(seeds > 0)
+    validSeeds = npy.isfinite(_half_costs(resistance[seedRows, seedCols],
+                                          halfSize))
+    seedRows = seedRows[validSeeds]
+    seedCols = seedCols[validSeeds]
+    cwd[seedRows, seedCols] = 0
+    back[seedRows, seedCols] = 0
+    alloc[seedRows, seedCols] = seeds[seedRows, seedCols]
+
+    # Back-link codes for moves from the previous line's cell at the same,
+    # lower and higher position, then from the lower and higher position
+    # on the same line, in rows and in columns
+    rowCodes = {}
+    colCodes = {}
+    for step in (1, -1):
+        rowCodes[step] = [BACK_CODES[(-step, 0)], BACK_CODES[(-step, -1)],
+                          BACK_CODES[(-step, 1)], BACK_CODES[(0, -1)],
+                          BACK_CODES[(0, 1)]]
+        colCodes[step] = [BACK_CODES[(0, -step)], BACK_CODES[(-1, -step)],
+                          BACK_CODES[(1, -step)], BACK_CODES[(-1, 0)],
+                          BACK_CODES[(1, 0)]]
+    stripRows = max(1, int(stripCells // ncols))
+
+    # Lines changed since each sweep last went through them.  Sweeps only
+    # revisit lines that changed or follow a line that changed.
+    rowsToDo = {}
+    colsToDo = {}
+    for step in (1, -1):
+        rowsToDo[step] = npy.ones(nrows, dtype=bool)
+        colsToDo[step] = npy.ones(ncols, dtype=bool)
+    while (rowsToDo[1].any() or rowsToDo[-1].any() or
+           colsToDo[1].any() or colsToDo[-1].any()):
+        for step in (1, -1):
+            rowsChanged, colsChanged = _sweep_lines(
+                resistance, cwd, back, alloc, halfSize, maxDist, step,
+                rowCodes[step], rowsToDo[step])
+            rowsToDo[step][:] = False
+            rowsToDo[-step] |= rowsChanged
+            colsToDo[1] |= colsChanged
+            colsToDo[-1] |= colsChanged
+
+            colsNow = colsToDo[step].copy()
+            colsToDo[step][:] = False
+            for row0 in range(0, nrows, stripRows):
+                rows = slice(row0, min(nrows, row0 + stripRows))
+                stripCwd = npy.ascontiguousarray(cwd[rows].T)
+                stripBack = npy.ascontiguousarray(back[rows].T)
+                stripAlloc = npy.ascontiguousarray(alloc[rows].T)
+                colsChanged, rowsChanged = _sweep_lines(
+                    npy.ascontiguousarray(resistance[rows].T), stripCwd,
+                    stripBack, stripAlloc, halfSize, maxDist, step,
+                    colCodes[step], colsNow)
+                if rowsChanged.any():
+                    cwd[rows] = stripCwd.T
+                    back[rows] = stripBack.T
+                    alloc[rows] = stripAlloc.T
+                    colsToDo[-step] |= colsChanged
+                    rowsToDo[1][rows] |= rowsChanged
+                    rowsToDo[-1][rows] |= rowsChanged
+
+    if targets is not None:
+        valid = npy.isfinite(resistance)
+        valid[valid] = resistance[valid] >= 0
+        targetZones = npy.where(valid, targets, 0)
+        targetMins = zonal_minimum(cwd, targetZones)
+        numTargets = len(npy.unique(targetZones[targetZones > 0]))
+        if numTargets > 0 and len(targetMins) == numTargets:
+            limit = max(targetMins.values()) + cutoff
+            if maxDist is None or limit < maxDist:
+                maxDist = limit
+    if maxDist is not None:
+        beyond = cwd > maxDist
+        cwd[beyond] = npy.inf
+        back[beyond] = BACK_NODATA
+        alloc[beyond] = 0
+    return cwd, back, alloc
+
+
+def _half_costs(resistance, halfSize):
+    """Returns half the cost of crossing cells, inf for NoData"""
+    halfCost = resistance.astype('float64') * halfSize
+    valid = npy.isfinite(halfCost)
+    valid[valid] = halfCost[valid] >= 0
+    halfCost[~valid] = npy.inf
+    return halfCost
+
+
+def _sweep_lines(resistance, cwd, back, alloc, halfSize, maxDist, step,
+                 codes, toDo):
+    """Relaxes each line of cells from the line before it, in order.
+
+    Arrays are indexed by line then position.  step is 1 to go forward
+    through the lines and -1 to go back.  codes are the back-links for
+    moves from the previous line's cell at the same, lower and higher
+    position, then from the lower and higher position on the line itself.
+    Lines are skipped unless they, or the line before them, are flagged
+    in toDo or have just changed.  Returns flags for the lines and the
+    positions where cells improved.
+
+    """
+    numLines, numPositions = cwd.shape
+    linesChanged = npy.zeros(numLines, dtype=bool)
+    positionsChanged = npy.zeros(numPositions, dtype=bool)
+    if step == 1:
+        lines = range(numLines)
+    else:
+        lines = range(numLines - 1, -1, -1)
+    prevHalf = None
+    prevCwd = None
+    prevToDo = False
+    for line in lines:
+        lineToDo = toDo[line]
+        if not (lineToDo or prevToDo):
+            prevToDo = False
+            prevCwd = None
+            continue
+        prevToDo = lineToDo
+        lineCwd = cwd[line]
+        if prevCwd is None:
+            if npy.isinf(lineCwd).all():
+                continue
+            if line != lines[0]:
+                prevCwd = cwd[line - step]
+                prevHalf = _half_costs(resistance[line - step], halfSize)
+        lineBack = back[line]
+        lineAlloc = alloc[line]
+        lineHalf = _half_costs(resistance[line], halfSize)
+        numImproved = 0
+        if prevCwd is not None:
+            prevAlloc = alloc[line - step]
+            numImproved += _relax(
+                lineCwd, lineBack, lineAlloc,
+                prevCwd + (prevHalf + lineHalf), prevAlloc, codes[0],
+                maxDist, positionsChanged)
+            numImproved += _relax(
+                lineCwd[1:], lineBack[1:], lineAlloc[1:],
+                prevCwd[:-1] + (prevHalf[:-1] + lineHalf[1:]) * SQRT2,
+                prevAlloc[:-1], codes[1], maxDist, positionsChanged[1:])
+            numImproved += _relax(
+                lineCwd[:-1], lineBack[:-1], lineAlloc[:-1],
+                prevCwd[1:] + (prevHalf[1:] + lineHalf[:-1]) * SQRT2,
+                prevAlloc[1:], codes[2], maxDist, positionsChanged[:-1])
+        numImproved += _scan_line(lineCwd, lineBack, lineAlloc, lineHalf,
+                                  maxDist, codes[3], positionsChanged)
+        numImproved += _scan_line(lineCwd[::-1], lineBack[::-1],
+                                  lineAlloc[::-1], lineHalf[::-1], maxDist,
+                                  codes[4], positionsChanged[::-1])
+        if numImproved > 0:
+            linesChanged[line] = True
+            prevToDo = True
+        if npy.isinf(lineCwd).all():
+            prevCwd = None
+        else:
+            prevCwd = lineCwd
+            prevHalf = lineHalf
+    return linesChanged, positionsChanged
+
+
+def _relax(cwd, back, alloc, newCwd, newAlloc, code, maxDist, changed):
+    """Takes new distances where they are lower, and returns how many"""
+    better = newCwd < cwd
+    if maxDist is not None:
+        better &= newCwd <= maxDist
+    numBetter = int(better.sum())
+    if numBetter > 0:
+        cwd[better] = newCwd[better]
+        back[better] = code
+        alloc[better] = newAlloc[better]
+        changed |= better
+    return numBetter
+
+
+def _scan_line(cwd, back, alloc, halfCost, maxDist, code, changed):
+    """Relaxes a line of cells from lower positions, as one array scan.
+
+    With P the cumulative cost of moving along the line, a cell's best
+    distance from lower positions on its run of valid cells is
+    P + min(cwd - P) over the run so far.  Runs are kept apart by adding
+    an offset to each run that is larger than the spread of cwd - P, so
+    that a plain running minimum never reaches back past the start of a
+    run.  The offsets cost some precision, so this only finds which cells
+    improve by more than rounding; their distances are then recomputed
+    from the cell each run of improved cells starts from.  Returns the
+    number of cells improved.
+
+    """
+    reached = npy.isfinite(cwd)
+    if not reached.any():
+        return 0
+    valid = npy.isfinite(halfCost)
+    steps = halfCost[:-1] + halfCost[1:]
+    steps[~npy.isfinite(steps)] = 0
+    along = npy.zeros(len(cwd), dtype='float64')
+    npy.cumsum(steps, out=along[1:])
+
+    rel = cwd[reached] - along[reached]
+    relMin = rel.min()
+    relMax = rel.max()
+    spread = relMax - relMin + 1.0
+    runs = npy.cumsum(~valid)
+    offsets = (runs[-1] - runs) * (3.0 * spread)
+    best = npy.where(reached, cwd - along, relMax + 2.0 * spread) + offsets
+    npy.minimum.accumulate(best, out=best)
+    best -= offsets
+    newCwd = best + along
+    tolerance = 1e-9 * (abs(relMin) + spread + along[-1])
+    better = valid & (best < relMax + spread) & (newCwd < cwd - tolerance)
+    if maxDist is not None:
+        better &= newCwd <= maxDist
+    if not better.any():
+        return 0
+
+    # Each improved cell is reached along the line from the last cell
+    # before it that wasn't improved
+    positions = npy.arange(len(cwd))
+    sources = npy.where(better, 0, positions)
+    npy.maximum.accumulate(sources, out=sources)
+    sources = sources[better]
+    cells = positions[better]
+    cwd[cells] = cwd[sources] + (along[cells] - along[sources])
+    back[cells] = code
+    alloc[cells] = alloc[sources]
+    changed |= better
+    return len(cells)
+
+
+def best_start_cell(cwd, targets):
+    """Returns (row, col) of the lowest cwd cell among targets.
+
+    targets is a boolean array.  Like CostPath with BEST_SINGLE, the path to
+    a target core starts from its cell nearest the source.  Returns None if
+    no target cell was reached.
+
+    """
+    targetCwd = npy.where(targets & npy.isfinite(cwd), cwd, npy.inf)
+    cell = int(npy.argmin(targetCwd))
+    row, col = divmod(cell, cwd.shape[1])
+    if not npy.isfinite(targetCwd[row, col]):
+        return None
+    return row, col
+
+
+def trace_path(back, start, cellSize=1.0):
+    """Follows back-links from start (row, col) to a source cell.
+
+    Returns path cells as an (n, 2) int array of (row, col) ordered from
+    start to source, and the path length: orthogonal steps plus diagonal
+    steps times sqrt(2), in map units.
+
+    """
+    nrows, ncols = back.shape
+    codes = back.ravel().tolist()
+    moves = []
+    for dr, dc in BACK_OFFSETS:
+        moves.append(dr * ncols + dc)
+    cell = start[0] * ncols + start[1]
+    cells = [cell]
+    numDiagonal = 0
+    for step in range(back.size):
+        code = codes[cell]
+        if code == 0:
+            break
+        if code < 0 or code > 8:
+            raise ValueError('Least-cost path reached a cell with no '
+                             'back-link')
+        if code % 2 == 0:  # Even codes are diagonal
+            numDiagonal = numDiagonal + 1
+        cell = cell + moves[code]
+        cells.append(cell)
+    else:
+        raise ValueError('Least-cost path did not reach a source cell')
+    cells = npy.array(cells, dtype='int64')
+    numOrthogonal = len(cells) - 1 - numDiagonal
+    length = (numOrthogonal + numDiagonal * SQRT2) * cellSize
+    return npy.column_stack((cells // ncols, cells % ncols)), length
+
+
+def path_vertices(cells, grid):
+    """Returns map coordinates of path cell centers as an (n, 2) array.
+
+    grid is (xMin, yMin, cellSize, nrows, ncols) of the array the cells
+    index, with row 0 at the top.
+
+    """
+    xMin, yMin, cellSize, nrows, ncols = grid
+    x = xMin + (cells[:, 1] + 0.5) * cellSize
+    y = yMin + (nrows - cells[:, 0] - 0.5) * cellSize
+    return npy.column_stack((x, y))
+
+
+def first_intruding_zone(cells, zones, allowed):
+    """Returns the first zone ID along path cells that is not in allowed.
+
+    cells is an (n, 2) array of (row, col), zones an integer array with 0
+    outside zones.  Returns None if the path only crosses allowed zones.
+
+    """
+    pathZones = zones[cells[:, 0], cells[:, 1]]
+    intruding = pathZones > 0
+    for zone in allowed:
+        intruding = intruding & (pathZones != int(zone))
+    found = npy.nonzero(intruding)[0]
+    if len(found) == 0:
+        return None
+    return int(pathZones[found[0]])
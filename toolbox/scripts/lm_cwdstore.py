@@ -0,0 +1,156 @@
+#!/usr/bin/env python2.6
+# Authors: Brad McRae and Darren Kavanagh
+
+"""Windowed cost-weighted distance store.
+
+Holds each core area's float32 cwd array for just its array window, in
+place of one full-extent grid per core.  Arrays are appended to data files
+in the cwd directory and an index records the file, byte offset and window
+of each.  Reads are memory-mapped, so any sub-window is read without
+copying the rest.  Cells outside a core's window are NoData.
+
+"""
+
+import os.path as path
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import numpy as npy
+
+from lm_config import tool_env as cfg
+import lm_raster
+import lm_util as lu
+
+INDEX_FILE = "cwd_index.dat"
+DATA_FILE = "cwd_data.dat"
+
+
+class CwdStore(object):
+    """Cwd arrays for core areas, each kept within its window of grid"""
+
+    def __init__(self, grid, dirName=None, dataName=DATA_FILE):
+        if dirName is None:
+            dirName = cfg.CWDBASEDIR
+        self.grid = grid
+        self.dirName = dirName
+        self.dataName = dataName  # File this process appends arrays to
+        self.index = {}  # core: (data file name, byte offset, window)
+        self.rasters = {}  # core: raster written by get_cwd_raster
+
+    def has(self, core):
+        return int(core) in self.index
+
+    def cores(self):
+        return sorted(self.index.keys())
+
+    def put(self, core, window, cwd):
+        """Appends a core's cwd array covering window"""
+        data = npy.ascontiguousarray(cwd, dtype='float32')
+        outFile = open(path.join(self.dirName, self.dataName), 'ab')
+        try:
+            outFile.seek(0, 2)
+            offset = outFile.tell()
+            data.tofile(outFile)
+        finally:
+            outFile.close()
+        self.index[int(core)] = (self.dataName, offset,
+                                 tuple([int(w) for w in window]))
+
+    def get_entry(self, core):
+        return self.index.get(int(core))
+
+    def add_entry(self, core, entry):
+        """Adds an index entry made by another process's store"""
+        self.index[int(core)] = entry
+
+    def get(self, core, window=None):
+        """Returns a read-only view of a core's cwd array and its window.
+
+        With window, the view is clipped to it.  Parts of window outside
+        the core's window are left out, so check the window returned; it
+        is None if there is no overlap.
+
+        """
+        dataName, offset, coreWindow = self.index[int(core)]
+        if window is None:
+            window = coreWindow
+        else:
+            window = lm_raster.intersect_windows(coreWindow, window)
+            if window is None:
+                return None, None
+        shape = (coreWindow[1] - coreWindow[0], coreWindow[3] - coreWindow[2])
+        cwd = npy.memmap(path.join(self.dirName, dataName), dtype='float32',
+                         mode='r', offset=offset, shape=shape)
+        slices = lm_raster.window_slices(
+            lm_raster.relative_window(window, coreWindow))
+        return cwd[slices], window
+
+    def read(self, core, window):
+        """Returns a copy of a core's cwd over window, inf outside its
+        stored window.
+
+        """
+        out = npy.empty((window[1] - window[0], window[3] - window[2]),
+                        dtype='float32')
+        out.fill(npy.inf)
+        cwd, overlap = self.get(core, window)
+        if overlap is not None:
+            out[lm_raster.window_slices(
+                lm_raster.relative_window(overlap, window))] = cwd
+        return out
+
+    def save(self):
+        outFile = open(path.join(self.dirName, INDEX_FILE), 'wb')
+        try:
+            pickle.dump((self.grid, self.index), outFile, 2)
+        finally:
+            outFile.close()
+
+    def __getstate__(self):
+        # Rasters written by one process aren't shared with others
+        state = self.__dict__.copy()
+        state['rasters'] = {}
+        return state
+
+
+def load_cwd_store(dirName=None):
+    """Loads cwd store saved by step 3, or returns None if there is none"""
+    if dirName is None:
+        dirName = cfg.CWDBASEDIR
+    fileName = path.join(dirName, INDEX_FILE)
+    if not path.exists(fileName):
+        return None
+    inFile = open(fileName, 'rb')
+    try:
+        grid, index = pickle.load(inFile)
+    finally:
+        inFile.close()
+    store = CwdStore(grid, dirName)
+    store.index = index
+    return store
+
+
+def get_cwd_raster(store, core):
+    """Returns path of a cwd raster for a core area.
+
+    If step 3 kept cwds in store, the core's window is written to a raster
+    in the scratch directory the first time it is asked for.  Otherwise the
+    grid written by step 3 is used.
+
+    """
+    if store is None or not store.has(core):
+        return lu.get_cwd_path(core)
+    core = int(core)
+    if core not in store.rasters:
+        rasterDir = path.join(cfg.SCRATCHDIR, 'cwdstore')
+        lu.create_dir(rasterDir)
+        cwdRaster = path.join(rasterDir, 'cwd_' + str(core))
+        lu.delete_data(cwdRaster)  # From an earlier step
+        cwd, window = store.get(core)
+        lu.array_to_raster(cwd, lm_raster.window_grid(store.grid, window),
+                           cwdRaster)
+        store.rasters[core] = cwdRaster
+    return store.rasters[core]
@@ -0,0 +1,110 @@
+#!/usr/bin/env python2.6
+# Authors: Brad McRae and Darren Kavanagh
+
+"""Step 3 progress journal.
+
+A record is appended to the journal as each core area is finished.  It
+holds the link table rows and pair results for the links the core handled,
+including traced LCP vertices, and the number of lines in the LCP
+shapefile.  Records are only ever added, so finishing a core costs one
+small write, and a restarted run replays the journal to pick up where the
+stopped run left off.
+
+"""
+
+import os
+import os.path as path
+import struct
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from lm_config import tool_env as cfg
+
+JOURNAL_FILE = "journal_s3.dat"
+
+# Each record is its pickled length followed by the pickle, so a record cut
+# short by a crash can be recognized and dropped.
+_LENGTH = struct.Struct('<Q')
+
+
+def get_journal_path():
+    return path.join(cfg.DATAPASSDIR, JOURNAL_FILE)
+
+
+def _append_record(record, fileName):
+    data = pickle.dumps(record, 2)
+    outFile = open(fileName, 'ab')
+    try:
+        outFile.write(_LENGTH.pack(len(data)))
+        outFile.write(data)
+        outFile.flush()
+        os.fsync(outFile.fileno())
+    finally:
+        outFile.close()
+
+
+def start_journal(coresToMap, fileName=None):
+    """Starts a new journal for a run mapping coresToMap"""
+    if fileName is None:
+        fileName = get_journal_path()
+    if path.exists(fileName):
+        os.remove(fileName)
+    _append_record([int(core) for core in coresToMap], fileName)
+
+
+def add_to_journal(x, rows, rowValues, pairResults, numLcpLines,
+                   fileName=None):
+    """Records a finished core.
+
+    x -- index of the core in coresToMap
+    rows, rowValues -- link table rows the core handled and their values
+    pairResults -- pair store results for the core's pairs
+    numLcpLines -- number of lines in the LCP shapefile after the core
+
+    """
+    if fileName is None:
+        fileName = get_journal_path()
+    _append_record((int(x), rows, rowValues, pairResults, int(numLcpLines)),
+                   fileName)
+
+
+def read_journal(fileName=None):
+    """Returns (coresToMap, records) from a saved journal.
+
+    records is a list of (x, rows, rowValues, pairResults, numLcpLines)
+    tuples in the order cores were finished.  A last record cut short by a
+    crash is left out.  Returns None if there is no journal.
+
+    """
+    if fileName is None:
+        fileName = get_journal_path()
+    if not path.exists(fileName):
+        return None
+    inFile = open(fileName, 'rb')
+    try:
+        contents = inFile.read()
+    finally:
+        inFile.close()
+
+    records = []
+    offset = 0
+    while offset + _LENGTH.size <= len(contents):
+        length = _LENGTH.unpack_from(contents, offset)[0]
+        offset = offset + _LENGTH.size
+        if offset + length > len(contents):
+            break
+        records.append(pickle.loads(contents[offset:offset + length]))
+        offset = offset + length
+    if not records:
+        return None
+    return records[0], records[1:]
+
+
+def delete_journal(fileName=None):
+    if fileName is None:
+        fileName = get_journal_path()
+    if path.exists(fileName):
+        os.remove(fileName)
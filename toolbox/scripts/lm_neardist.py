@@ -0,0 +1,309 @@
+#!/usr/bin/env python2.6
+# Authors: Brad McRae and Darren Kavanagh
+
+"""Edge-to-edge Euclidean distances between core area polygons.
+
+Each core's boundary vertices and segments are extracted once.  The
+distance between two cores is the smallest distance from a vertex of one
+to a segment of the other, which is the edge-to-edge distance reported by
+Generate Near Table.  Cores that overlap, cross or lie one inside the
+other are 0 apart, as with Generate Near Table.  Nearest-vertex
+distances, from a KD-tree when scipy is available, bound the search so
+only a few vertex-segment distances are computed per pair.  Candidate
+pairs can be limited to cores whose bounding boxes are close enough to
+matter.
+
+"""
+
+import math
+
+import numpy as npy
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+CHUNK = 1000000  # Max point-to-point distances computed at once
+PAIRCHUNK = 100000  # Number of candidate pairs yielded at once
+
+
+class CoreGeometry(object):
+    """Boundary vertices and segments of one core area"""
+
+    def __init__(self, rings):
+        """rings is a list of (n, 2) vertex arrays, one per polygon ring.
+
+        Polygon rings are closed, with the first vertex repeated at the end,
+        as ArcGIS returns them.
+
+        """
+        starts = []
+        ends = []
+        vertices = []
+        for ring in rings:
+            ring = npy.asarray(ring, dtype='float64').reshape(-1, 2)
+            vertices.append(ring)
+            if len(ring) > 1:
+                starts.append(ring[:-1])
+                ends.append(ring[1:])
+            else:
+                starts.append(ring)  # Zero-length segment for a point
+                ends.append(ring)
+        self.starts = npy.concatenate(starts)
+        self.ends = npy.concatenate(ends)
+        self.vertices = npy.concatenate(vertices)
+        segLengths = npy.sqrt(((self.ends - self.starts) ** 2).sum(axis=1))
+        self.maxSegLength = float(segLengths.max())
+        self.bbox = (self.vertices[:, 0].min(), self.vertices[:, 1].min(),
+                     self.vertices[:, 0].max(), self.vertices[:, 1].max())
+        if cKDTree is not None:
+            self.tree = cKDTree(self.vertices)
+        else:
+            self.tree = None
+
+    def nearest_vertex_dists(self, points):
+        """Returns distance from each point to the nearest vertex"""
+        if self.tree is not None:
+            return self.tree.query(points)[0]
+        dists = npy.empty(len(points), dtype='float64')
+        step = max(1, CHUNK // len(self.vertices))
+        for i in range(0, len(points), step):
+            diff = (points[i:i + step, npy.newaxis, :] -
+                    self.vertices[npy.newaxis, :, :])
+            dists[i:i + step] = npy.sqrt((diff ** 2).sum(axis=2).min(axis=1))
+        return dists
+
+
+def bbox_distance(bbox1, bbox2):
+    """Returns distance between two bounding boxes (0 if they overlap)"""
+    dx = max(bbox1[0] - bbox2[2], bbox2[0] - bbox1[2], 0)
+    dy = max(bbox1[1] - bbox2[3], bbox2[1] - bbox1[3], 0)
+    return math.sqrt(dx * dx + dy * dy)
+
+
+def candidate_pairs(cores, boxes, maxDist=None, chunkSize=PAIRCHUNK):
+    """Yields (n, 2) int32 arrays of core pairs, lower ID first.
+
+    cores is a sequence of unique core IDs and boxes their (xMin, yMin,
+    xMax, yMax) bounding boxes.  With maxDist, only pairs whose boxes are
+    within maxDist of each other are yielded.  Boxes are bucketed on a
+    uniform grid with cells at least maxDist across, so each core is only
+    checked against cores in its own and neighboring cells.  Without
+    maxDist every pair is yielded.  Pairs come in chunks of about
+    chunkSize, so the full list is never held at once.
+
+    """
+    cores = npy.asarray(cores, dtype='int32')
+    boxes = npy.asarray(boxes, dtype='float64').reshape(-1, 4)
+    order = npy.argsort(cores)
+    cores = cores[order]
+    boxes = boxes[order]
+    numCores = len(cores)
+
+    if maxDist is None:
+        chunk = []
+        numPairs = 0
+        for i in range(numCores - 1):
+            pairs = npy.zeros((numCores - i - 1, 2), dtype='int32')
+            pairs[:, 0] = cores[i]
+            pairs[:, 1] = cores[i + 1:]
+            chunk.append(pairs)
+            numPairs = numPairs + len(pairs)
+            if numPairs >= chunkSize:
+                yield npy.concatenate(chunk)
+                chunk = []
+                numPairs = 0
+        if chunk:
+            yield npy.concatenate(chunk)
+        return
+
+    # Cells are at least as wide as a typical box, so boxes span few cells
+    sizes = npy.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+    cellSize = max(float(maxDist), float(npy.median(sizes)))
+    if cellSize <= 0:
+        cellSize = 1.0
+    col0 = npy.floor((boxes[:, 0] - boxes[:, 0].min()) / cellSize)
+    col1 = npy.floor((boxes[:, 2] - boxes[:, 0].min()) / cellSize)
+    row0 = npy.floor((boxes[:, 1] - boxes[:, 1].min()) / cellSize)
+    row1 = npy.floor((boxes[:, 3] - boxes[:, 1].min()) / cellSize)
+    cells = list(zip(row0.astype('int64').tolist(),
+                     row1.astype('int64').tolist(),
+                     col0.astype('int64').tolist(),
+                     col1.astype('int64').tolist()))
+    buckets = {}
+    for i, (r0, r1, c0, c1) in enumerate(cells):
+        for row in range(r0, r1 + 1):
+            for col in range(c0, c1 + 1):
+                buckets.setdefault((row, col), []).append(i)
+
+    chunk = []
+    numPairs = 0
+    for i, (r0, r1, c0, c1) in enumerate(cells):
+        near = set()
+        for row in range(r0 - 1, r1 + 2):
+            for col in range(c0 - 1, c1 + 2):
+                near.update(buckets.get((row, col), ()))
+        near = npy.array(sorted([j for j in near if j > i]), dtype='int64')
+        if len(near) == 0:
+            continue
+        dx = npy.maximum(npy.maximum(boxes[near, 0] - boxes[i, 2],
+                                     boxes[i, 0] - boxes[near, 2]), 0)
+        dy = npy.maximum(npy.maximum(boxes[near, 1] - boxes[i, 3],
+                                     boxes[i, 1] - boxes[near, 3]), 0)
+        near = near[dx * dx + dy * dy <= float(maxDist) ** 2]
+        if len(near) == 0:
+            continue
+        pairs = npy.zeros((len(near), 2), dtype='int32')
+        pairs[:, 0] = cores[i]
+        pairs[:, 1] = cores[near]
+        chunk.append(pairs)
+        numPairs = numPairs + len(pairs)
+        if numPairs >= chunkSize:
+            yield npy.concatenate(chunk)
+            chunk = []
+            numPairs = 0
+    if chunk:
+        yield npy.concatenate(chunk)
+
+
+def point_segment_dists(points, starts, ends):
+    """Returns (points, segments) array of point to segment distances"""
+    seg = ends - starts
+    segLen2 = (seg ** 2).sum(axis=1)
+    segLen2[segLen2 == 0] = 1  # Zero-length segments: t is 0 anyway
+    rel = points[:, npy.newaxis, :] - starts[npy.newaxis, :, :]
+    t = (rel * seg[npy.newaxis, :, :]).sum(axis=2) / segLen2
+    t = npy.clip(t, 0, 1)
+    nearest = t[:, :, npy.newaxis] * seg[npy.newaxis, :, :] - rel
+    return npy.sqrt((nearest ** 2).sum(axis=2))
+
+
+def _vertex_segment_distance(core1, core2, bound):
+    """Returns smallest distance from core1's vertices to core2's segments,
+    or bound if none is closer.
+
+    """
+    # A segment within bound of a vertex has an endpoint within bound plus
+    # half the segment's length of it
+    radius = bound + core2.maxSegLength / 2.0
+    points = core1.vertices[core2.nearest_vertex_dists(core1.vertices) <=
+                            radius]
+    if len(points) == 0:
+        return bound
+    # Only segments whose bounding boxes come within bound of the points
+    xMin = points[:, 0].min() - bound
+    yMin = points[:, 1].min() - bound
+    xMax = points[:, 0].max() + bound
+    yMax = points[:, 1].max() + bound
+    starts = core2.starts
+    ends = core2.ends
+    near = ((npy.maximum(starts[:, 0], ends[:, 0]) >= xMin) &
+            (npy.minimum(starts[:, 0], ends[:, 0]) <= xMax) &
+            (npy.maximum(starts[:, 1], ends[:, 1]) >= yMin) &
+            (npy.minimum(starts[:, 1], ends[:, 1]) <= yMax))
+    starts = starts[near]
+    ends = ends[near]
+    if len(starts) == 0:
+        return bound
+    step = max(1, CHUNK // len(starts))
+    for i in range(0, len(points), step):
+        dist = point_segment_dists(points[i:i + step], starts, ends).min()
+        bound = min(bound, float(dist))
+    return bound
+
+
+def point_in_core(point, core):
+    """Returns True if point is inside a core's polygons.
+
+    Uses the even-odd rule, so points in holes are outside.
+
+    """
+    x, y = point
+    starts = core.starts
+    ends = core.ends
+    spans = (starts[:, 1] > y) != (ends[:, 1] > y)
+    starts = starts[spans]
+    ends = ends[spans]
+    # x where each edge spanning y crosses it
+    crossX = (starts[:, 0] + (y - starts[:, 1]) * (ends[:, 0] - starts[:, 0]) /
+              (ends[:, 1] - starts[:, 1]))
+    return int((crossX > x).sum()) % 2 == 1
+
+
+def _cross(u, v):
+    return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+
+def segments_cross(core1, core2):
+    """Returns True if a segment of core1 properly crosses one of core2's.
+
+    Only segments within the overlap of the two bounding boxes are checked.
+    Segments that just touch aren't counted; a vertex on a segment already
+    gives a vertex-segment distance of 0.
+
+    """
+    xMin = max(core1.bbox[0], core2.bbox[0])
+    yMin = max(core1.bbox[1], core2.bbox[1])
+    xMax = min(core1.bbox[2], core2.bbox[2])
+    yMax = min(core1.bbox[3], core2.bbox[3])
+    segments = []
+    for core in [core1, core2]:
+        starts = core.starts
+        ends = core.ends
+        near = ((npy.maximum(starts[:, 0], ends[:, 0]) >= xMin) &
+                (npy.minimum(starts[:, 0], ends[:, 0]) <= xMax) &
+                (npy.maximum(starts[:, 1], ends[:, 1]) >= yMin) &
+                (npy.minimum(starts[:, 1], ends[:, 1]) <= yMax))
+        segments.append((starts[near], ends[near]))
+    (starts1, ends1), (starts2, ends2) = segments
+    if len(starts1) == 0 or len(starts2) == 0:
+        return False
+    starts2 = starts2[npy.newaxis, :, :]
+    ends2 = ends2[npy.newaxis, :, :]
+    step = max(1, CHUNK // len(starts2[0]))
+    for i in range(0, len(starts1), step):
+        a = starts1[i:i + step, npy.newaxis, :]
+        b = ends1[i:i + step, npy.newaxis, :]
+        side1 = _cross(b - a, starts2 - a) * _cross(b - a, ends2 - a)
+        side2 = _cross(ends2 - starts2, a - starts2) * _cross(ends2 - starts2,
+                                                            b - starts2)
+        if ((side1 < 0) & (side2 < 0)).any():
+            return True
+    return False
+
+
+def cores_overlap(core1, core2):
+    """Returns True if two cores overlap, cross or one contains the other"""
+    if bbox_distance(core1.bbox, core2.bbox) > 0:
+        return False
+    # Without crossing boundaries, a core with one vertex inside the other
+    # lies wholly inside it
+    return (point_in_core(core1.vertices[0], core2) or
+            point_in_core(core2.vertices[0], core1) or
+            segments_cross(core1, core2))
+
+
+def core_distance(core1, core2):
+    """Returns edge-to-edge distance between two cores, 0 if they overlap"""
+    if cores_overlap(core1, core2):
+        return 0.0
+    bound = float(core2.nearest_vertex_dists(core1.vertices).min())
+    bound = _vertex_segment_distance(core1, core2, bound)
+    return _vertex_segment_distance(core2, core1, bound)
+
+
+def get_core_distances(cores, pairs):
+    """Returns distances between pairs of cores.
+
+    cores is a dictionary of CoreGeometry objects by core ID, pairs an
+    (n, 2) array of core IDs.  Pairs with a missing core get None.
+
+    """
+    dists = []
+    for core1, core2 in pairs.tolist():
+        if core1 not in cores or core2 not in cores:
+            dists.append(None)
+            continue
+        dists.append(core_distance(cores[core1], cores[core2]))
+    return dists
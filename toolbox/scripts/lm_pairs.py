@@ -0,0 +1,64 @@
+#!/usr/bin/env python2.6
+# Authors: Brad McRae and Darren Kavanagh
+
+"""Per-pair results store.
+
+Holds step 3 results for each pair of connected core areas that the link
+table has no columns for, keyed by the sorted (core1, core2) pair so
+results for A-B and B-A are the same entry.  Cwds and link types are
+read from the link table.  Step 3 fills a store as it maps cores, and the
+step 3 journal carries it over restarts.  Steps 5 and 6 keep one to skip
+core pairs they have already mosaicked.
+
+"""
+
+# Result fields kept for each pair
+INTCORE = 'intCore'      # First intermediate core on the LCP, or None
+LCPLENGTH = 'lcpLength'  # Length of traced LCP (native engine only)
+LCPVERTS = 'lcpVerts'    # (n, 2) array of LCP vertices (native engine only)
+
+
+def pair_key(core1, core2):
+    """Returns the store key for a core pair"""
+    core1 = int(core1)
+    core2 = int(core2)
+    if core1 < core2:
+        return core1, core2
+    return core2, core1
+
+
+class PairStore(object):
+    """Results for core pairs, keyed by sorted (core1, core2)"""
+
+    def __init__(self):
+        self.pairs = {}
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def has(self, core1, core2):
+        return pair_key(core1, core2) in self.pairs
+
+    def get(self, core1, core2, field=None, default=None):
+        """Returns a pair's result dictionary, or one field of it"""
+        result = self.pairs.get(pair_key(core1, core2))
+        if result is None:
+            return default
+        if field is None:
+            return result
+        return result.get(field, default)
+
+    def put(self, core1, core2, **fields):
+        """Adds or updates result fields for a pair"""
+        key = pair_key(core1, core2)
+        if key not in self.pairs:
+            self.pairs[key] = {}
+        self.pairs[key].update(fields)
+
+    def update(self, other):
+        """Copies all pair results from another store"""
+        for key, result in other.pairs.items():
+            self.put(key[0], key[1], **result)
+
+    def keys(self):
+        return sorted(self.pairs.keys())
@@ -0,0 +1,118 @@
+#!/usr/bin/env python2.6
+# Authors: Brad McRae and Darren Kavanagh
+
+"""Array window functions.
+
+Grids are described as (xMin, yMin, cellSize, nrows, ncols) tuples, as
+returned by lm_util.get_raster_grid, with row 0 at the top.  Windows are
+(row0, row1, col0, col1) slices into a grid's arrays.
+
+"""
+
+import math
+
+import numpy as npy
+
+
+def full_window(grid):
+    """Returns window covering a whole grid"""
+    return 0, grid[3], 0, grid[4]
+
+
+def window_grid(grid, window):
+    """Returns grid description of a window into grid"""
+    xMin, yMin, cellSize, nrows, ncols = grid
+    row0, row1, col0, col1 = window
+    return (xMin + col0 * cellSize, yMin + (nrows - row1) * cellSize,
+            cellSize, row1 - row0, col1 - col0)
+
+
+def window_slices(window):
+    """Returns slices for indexing an array with a window"""
+    return slice(window[0], window[1]), slice(window[2], window[3])
+
+
+def extent_window(xMin, yMin, xMax, yMax, grid):
+    """Returns window of cells overlapping an extent.
+
+    The window is clipped to the grid and is empty (row1 <= row0 or
+    col1 <= col0) if the extent misses the grid.
+
+    """
+    gridXMin, gridYMin, cellSize, nrows, ncols = grid
+    gridYMax = gridYMin + nrows * cellSize
+    col0 = int(math.floor((xMin - gridXMin) / cellSize))
+    col1 = int(math.ceil((xMax - gridXMin) / cellSize))
+    row0 = int(math.floor((gridYMax - yMax) / cellSize))
+    row1 = int(math.ceil((gridYMax - yMin) / cellSize))
+    return (min(max(row0, 0), nrows), min(max(row1, 0), nrows),
+            min(max(col0, 0), ncols), min(max(col1, 0), ncols))
+
+
+def circle_window(centX, centY, radius, grid):
+    """Returns window of cells overlapping a circle's bounding box"""
+    return extent_window(centX - radius, centY - radius, centX + radius,
+                         centY + radius, grid)
+
+
+def disk_mask(circles, grid):
+    """Returns window and mask of cells inside any of a set of circles.
+
+    circles is an array with centX, centY and radius in its first three
+    columns.  Cells are inside when their centers are, as with
+    ExtractByMask.  The window covers all circles; the mask is a boolean
+    array over it.  Returns None, None if no circle touches the grid.
+
+    """
+    windows = []
+    for centX, centY, radius in circles[:, 0:3].tolist():
+        window = circle_window(centX, centY, radius, grid)
+        if window[1] > window[0] and window[3] > window[2]:
+            windows.append(window)
+    if not windows:
+        return None, None
+    windows = npy.array(windows)
+    window = (int(windows[:, 0].min()), int(windows[:, 1].max()),
+              int(windows[:, 2].min()), int(windows[:, 3].max()))
+
+    xMin, yMin, cellSize, nrows, ncols = window_grid(grid, window)
+    yMax = yMin + nrows * cellSize
+    x = xMin + (npy.arange(ncols) + 0.5) * cellSize
+    y = yMax - (npy.arange(nrows) + 0.5) * cellSize
+    mask = npy.zeros((nrows, ncols), dtype='bool')
+    for centX, centY, radius in circles[:, 0:3].tolist():
+        dx2 = (x - centX) ** 2
+        dy2 = (y - centY) ** 2
+        mask |= (dy2[:, npy.newaxis] + dx2[npy.newaxis, :]) <= radius ** 2
+    return window, mask
+
+
+def intersect_windows(window1, window2):
+    """Returns overlap of two windows, or None if they don't overlap"""
+    row0 = max(window1[0], window2[0])
+    row1 = min(window1[1], window2[1])
+    col0 = max(window1[2], window2[2])
+    col1 = min(window1[3], window2[3])
+    if row1 <= row0 or col1 <= col0:
+        return None
+    return row0, row1, col0, col1
+
+
+def relative_window(window, outer):
+    """Returns window shifted to index arrays covering outer window"""
+    return (window[0] - outer[0], window[1] - outer[0],
+            window[2] - outer[2], window[3] - outer[2])
+
+
+def grid_window(grid, outerGrid):
+    """Returns window of outerGrid covered by grid.
+
+    The cells of the two grids must line up.  The window may reach past
+    outerGrid's edges.
+
+    """
+    xMin, yMin, cellSize, nrows, ncols = grid
+    outerXMin, outerYMin, outerCellSize, outerRows, outerCols = outerGrid
+    col0 = int(round((xMin - outerXMin) / cellSize))
+    row0 = outerRows - int(round((yMin - outerYMin) / cellSize)) - nrows
+    return row0, row0 + nrows, col0, col0 + ncols
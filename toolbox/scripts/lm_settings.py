@@ -8,3 +8,11 @@ SAVENORMLCCS = False  # Save inidvidual normalized LCC grids, not just mosaic (B
 SIMPLIFY_CORES = True  # Simplify cores before calculating distances (Boolean- set to True or False)
                        # This speeds up distance calculations in step 2,
                        # but Euclidean distances will be less precise.
+CALCENGINE = 'arcgis'  # Engine for step 1 and 3 cost-weighted distances and step 2 core distances: 'arcgis' (CostAllocation, CostDistance and Generate Near Table tools) or 'native' (numpy engines in lm_cwd.py and lm_neardist.py, no geoprocessor calls)
+NUMWORKERS = 1  # Number of worker processes for step 3 cost-weighted distance calculations and native step 5 corridor mosaicking, and to run step 1 cost-weighted and Euclidean adjacency at the same time (1 runs one thing at a time; try the number of processor cores)
+STRIPCELLS = 10000000  # Number of cells to read at a time when finding step 1 adjacencies in allocation rasters, per strip in native Euclidean allocation and native step 1 cost allocation, and per tile when workers mosaic step 5 corridors (lower to save memory on very large rasters)
+CACHEINPUTS = True  # Keep parsed copies of distance, adjacency and link table text files in the datapass cache folder, so each version of a file is only parsed once (Boolean- set to True or False)
+STOPATTARGETS = False  # Stop native step 3 cwd calcs at the farthest target core plus CWDTHRESH (Boolean- set to True or False)
+                       # Much faster for sparse networks.  Only used with
+                       # WRITETRUNCRASTER, and a bigger step 6 or step 8 cwd
+                       # cutoff is used instead of CWDTHRESH if set.
@@ -14,6 +14,9 @@ import glob
 import ctypes
 import locale
 from lm_retry_decorator import retry
+import lm_adj
+import lm_cache
+import lm_raster
 
 
 import numpy as npy
@@ -414,8 +417,46 @@ def build_stats(raster):
 def get_adj_using_shift_method(alloc):
     """Returns table listing adjacent core areas using a shift method.
 
-    The method involves shifting the allocation grid one pixel and then looking
-    for pixels with different allocations across shifted grids.
+    Each allocation cell is compared with its right, lower and diagonal
+    neighbors, and cells with different allocations give adjacent cores.
+    alloc is an allocation raster, or an integer allocation array with 0
+    for NoData.  Rasters are read in strips of about STRIPCELLS cells, so
+    they needn't fit in memory.
+
+    """
+    if isinstance(alloc, npy.ndarray):
+        gprint('Calculating adjacencies crossing allocation boundaries...')
+        start_time = time.clock()
+        adjTable = lm_adj.get_adjacent_pairs(alloc)
+        start_time = elapsed_time(start_time)
+        return adjTable
+
+    try:
+        import arcpy
+    except ImportError:
+        return get_adj_using_shift_rasters(alloc)
+    grid = get_raster_grid(alloc)
+
+    def read_strip(row0, row1):
+        stripGrid = lm_raster.window_grid(grid, (row0, row1, 0, grid[4]))
+        strip = raster_to_array(alloc, stripGrid)
+        return npy.where(npy.isnan(strip), 0, strip).astype('int32')
+
+    gprint('Calculating adjacencies crossing allocation boundaries...')
+    start_time = time.clock()
+    stripRows = int(cfg.STRIPCELLS / grid[4])
+    keys = lm_adj.get_adjacent_keys_in_strips(read_strip, grid[3],
+                                              stripRows)
+    start_time = elapsed_time(start_time)
+    return lm_adj.keys_to_table(keys)
+
+
+def get_adj_using_shift_rasters(alloc):
+    """Returns table listing adjacent core areas using a shift method.
+
+    Used without arcpy.  The method involves shifting the allocation grid
+    one pixel and then looking for pixels with different allocations
+    across shifted grids.
 
     """
     cellSize = gp.Describe(alloc).MeanCellHeight
@@ -617,6 +658,41 @@ def new_extent(fc, field, value):
     return  str(xMin), str(yMin), str(xMax), str(yMax)
 
 
+def get_core_extents(coreFC, coreFN):
+    """Returns core area IDs and their (xMin, yMin, xMax, yMax) extents.
+
+    Extents of features with the same ID are combined.
+
+    """
+    try:
+        shapeFieldName = gp.describe(coreFC).shapefieldname
+        extents = {}
+        rows = gp.searchcursor(coreFC)
+        row = rows.next()
+        while row:
+            core = int(row.getvalue(coreFN))
+            extentObj = row.getvalue(shapeFieldName).extent
+            extent = [extentObj.xmin, extentObj.ymin, extentObj.xmax,
+                      extentObj.ymax]
+            if core in extents:
+                oldExtent = extents[core]
+                extent = [min(extent[0], oldExtent[0]),
+                          min(extent[1], oldExtent[1]),
+                          max(extent[2], oldExtent[2]),
+                          max(extent[3], oldExtent[3])]
+            extents[core] = extent
+            row = rows.next()
+        del row, rows
+
+        cores = sorted(extents.keys())
+        return cores, [extents[core] for core in cores]
+
+    except arcgisscripting.ExecuteError:
+        exit_with_geoproc_error(_SCRIPT_NAME)
+    except:
+        exit_with_python_error(_SCRIPT_NAME)
+
+
 def get_centroids(shapefile, field):
     """Returns centroids of features"""
     try:
@@ -697,6 +773,41 @@ def get_bounding_circle_data(extentBoxList, corex, corey, distbuff):
     return circlePointData
 
 
+def get_bounding_circles_data(extentBoxList, corePairs, distbuff):
+    """Returns centroids and radii of circles bounding pairs of extent boxes.
+
+    Same rule as get_bounding_circle_data, for an array of (corex, corey)
+    rows at once.  Output rows are x, y, corex, corey, radius.
+
+    """
+    try:
+        boxCores = extentBoxList[:, 0]
+        order = npy.argsort(boxCores)
+        xBoxes = extentBoxList[order[npy.searchsorted(boxCores[order],
+                                                      corePairs[:, 0])]]
+        yBoxes = extentBoxList[order[npy.searchsorted(boxCores[order],
+                                                      corePairs[:, 1])]]
+
+        xmin = npy.minimum(xBoxes[:, 1], yBoxes[:, 1])
+        ymin = npy.minimum(xBoxes[:, 4], yBoxes[:, 4])
+        xmax = npy.maximum(xBoxes[:, 2], yBoxes[:, 2])
+        ymax = npy.maximum(xBoxes[:, 3], yBoxes[:, 3])
+
+        circlePointData = npy.zeros((len(corePairs), 5), dtype='float32')
+        circlePointData[:, 0] = xmin + (xmax - xmin) / 2
+        circlePointData[:, 1] = ymin + (ymax - ymin) / 2
+        circlePointData[:, 2] = corePairs[:, 0]
+        circlePointData[:, 3] = corePairs[:, 1]
+        radius = npy.sqrt(((xmax - xmin) / 2) ** 2 + ((ymax - ymin) / 2) ** 2)
+        if distbuff != 0:
+            radius = radius + int(distbuff)
+        circlePointData[:, 4] = radius
+    except:
+        exit_with_python_error(_SCRIPT_NAME)
+
+    return circlePointData
+
+
 def get_extent_box_coords(fieldValue=None):
     """Get coordinates of bounding box that contains selected features"""
     try:
@@ -785,15 +896,66 @@ def make_points(workspace, pointArray, outFC):
     return
 
 
+############################################################################
+## Raster Array Functions ##################################################
+############################################################################
+def get_raster_grid(raster):
+    """Returns lower-left corner, cell size and dimensions of a raster.
+
+    The tuple (xMin, yMin, cellSize, nrows, ncols) is used to read other
+    rasters onto the same grid of cells.
+
+    """
+    import arcpy
+    desc = arcpy.Describe(raster)
+    extent = desc.extent
+    return (extent.XMin, extent.YMin, desc.meanCellHeight, desc.height,
+            desc.width)
+
+
+def raster_to_array(raster, grid, nodata=-9999, dtype='float64'):
+    """Reads a raster into a float array over grid, with NoData as NaN"""
+    import arcpy
+    xMin, yMin, cellSize, nrows, ncols = grid
+    outData = arcpy.RasterToNumPyArray(raster, arcpy.Point(xMin, yMin),
+                                       ncols, nrows, nodata)
+    outData = outData.astype(dtype)
+    outData[outData == nodata] = npy.nan
+    return outData
+
+
+def array_to_raster(array, grid, outRaster, nodata=-9999):
+    """Saves an array laid out on grid as a raster.
+
+    Non-finite values (and, for integer arrays, negative values) are written
+    as NoData.  The raster gets the resistance raster's spatial reference.
+
+    """
+    import arcpy
+    xMin, yMin, cellSize, nrows, ncols = grid
+    if array.dtype.kind == 'f':
+        outData = npy.where(npy.isfinite(array), array,
+                            nodata).astype('float32')
+    else:
+        outData = npy.where(array >= 0, array, nodata).astype('int32')
+    newRaster = arcpy.NumPyArrayToRaster(outData, arcpy.Point(xMin, yMin),
+                                         cellSize, cellSize, nodata)
+    newRaster.save(outRaster)
+    arcpy.DefineProjection_management(
+        outRaster, arcpy.Describe(cfg.RESRAST).spatialReference)
+
+
 ############################################################################
 ## LCP Shapefile Functions #################################################
 ############################################################################
 
-def create_lcp_shapefile(ws,linktable, sourceCore, targetCore, lcpLoop):
+def create_lcp_shapefile(ws,linktable, sourceCore, targetCore, lcpLoop,
+                         lcpShapefile=None):
     """Creates lcp shapefile.
 
     Shows locations of least-cost path lines attributed with corridor
-    info/status.
+    info/status.  Lines go to lcpLines_s3.shp in the datapass directory
+    unless another lcpShapefile is given.
 
     """
     try:
@@ -877,24 +1039,120 @@ def create_lcp_shapefile(ws,linktable, sourceCore, targetCore, lcpLoop):
         gp.CalculateField_management(lcplineDslv, "cwd2Path_R", distRatio2,
                                      "PYTHON_9.3")
 
+        if lcpShapefile is None:
+            lcpShapefile = os.path.join(cfg.DATAPASSDIR, "lcpLines_s3.shp")
+        return add_to_lcp_shapefile(lcplineDslv, lcpShapefile, lcpLoop)
+
+    except arcgisscripting.ExecuteError:
+        exit_with_geoproc_error(_SCRIPT_NAME)
+    except:
+        exit_with_python_error(_SCRIPT_NAME)
+
+
+def add_to_lcp_shapefile(lcpLines, lcpShapefile, lcpLoop):
+    """Adds lcp lines to lcp shapefile.
+
+    The shapefile is replaced on the first call (lcpLoop = 0) and appended to
+    after that.  Returns incremented lcpLoop.
+
+    """
+    try:
         lcpLoop = lcpLoop + 1
-        lcpShapefile = os.path.join(cfg.DATAPASSDIR, "lcpLines_s3.shp")
-        gp.RefreshCatalog(cfg.DATAPASSDIR)
         if lcpLoop == 1:
-            if gp.Exists(lcpShapefile):
-                try:
-                    gp.Delete(lcpShapefile)
+            remove_lcp_shapefile(lcpShapefile)
+            gp.copy_management(lcpLines, lcpShapefile)
+        else:
+            gp.Append_management(lcpLines, lcpShapefile, "TEST")
 
-                except:
-                    dashline(1)
-                    msg = ('ERROR: Could not remove LCP shapefile ' +
-                           lcpShapefile + '. Was it open in ArcMap?\n You may '
-                           'need to re-start ArcMap to release the file lock.')
-                    raise_error(msg)
+        return lcpLoop
+
+    except arcgisscripting.ExecuteError:
+        exit_with_geoproc_error(_SCRIPT_NAME)
+    except:
+        exit_with_python_error(_SCRIPT_NAME)
+
+
+def remove_lcp_shapefile(lcpShapefile):
+    """Deletes lcp shapefile, with a hint if it is locked"""
+    gp.RefreshCatalog(os.path.dirname(lcpShapefile))
+    if gp.Exists(lcpShapefile):
+        try:
+            gp.Delete(lcpShapefile)
+
+        except:
+            dashline(1)
+            msg = ('ERROR: Could not remove LCP shapefile ' +
+                   lcpShapefile + '. Was it open in ArcMap?\n You may '
+                   'need to re-start ArcMap to release the file lock.')
+            raise_error(msg)
 
-            gp.copy_management(lcplineDslv, lcpShapefile)
-        else:
-            gp.Append_management(lcplineDslv, lcpShapefile, "TEST")
+
+def write_lcp_lines(lcpLines, linktable, lcpShapefile, lcpLoop):
+    """Writes traced least-cost paths to lcp shapefile.
+
+    lcpLines is a list of (link row, source core, target core, vertices,
+    path length), with vertices in map units.  Fields match those written by
+    create_lcp_shapefile.  The shapefile is replaced on the first call
+    (lcpLoop = 0) and added to after that.  Returns incremented lcpLoop.
+
+    """
+    import arcpy
+    try:
+        lcpLoop = lcpLoop + 1
+        if lcpLoop == 1:
+            remove_lcp_shapefile(lcpShapefile)
+            lcpDir, lcpName = os.path.split(lcpShapefile)
+            spatialRef = gp.Describe(cfg.COREFC).SpatialReference
+            gp.CreateFeatureclass_management(lcpDir, lcpName, "POLYLINE", "",
+                                             "", "", spatialRef)
+            gp.AddField_management(lcpShapefile, "Link_ID", "LONG", "5")
+            gp.AddField_management(lcpShapefile, "Active", "SHORT")
+            gp.AddField_management(lcpShapefile, "Link_Info", "TEXT")
+            gp.AddField_management(lcpShapefile, "From_Core", "LONG", "5")
+            gp.AddField_management(lcpShapefile, "To_Core", "LONG", "5")
+            for field in ["Euc_Dist", "CW_Dist", "LCP_Length", "cwd2Euc_R",
+                          "cwd2Path_R"]:
+                gp.AddField_management(lcpShapefile, field, "DOUBLE", "10",
+                                       "2")
+
+        rows = arcpy.InsertCursor(lcpShapefile)
+        for link, sourceCore, targetCore, vertices, lcpLength in lcpLines:
+            points = arcpy.Array()
+            for x, y in vertices:
+                points.add(arcpy.Point(x, y))
+            if len(vertices) == 1:
+                # Path is one cell shared by source and target, so repeat
+                # it to make a (zero-length) line
+                points.add(arcpy.Point(vertices[0][0], vertices[0][1]))
+
+            activelink, linktypedesc = get_link_type_desc(
+                linktable[link, cfg.LTB_LINKTYPE])
+            cwDist = float(linktable[link, cfg.LTB_CWDIST])
+            eucDist = float(linktable[link, cfg.LTB_EUCDIST])
+            try:
+                distRatio1 = cwDist / eucDist
+            except ZeroDivisionError:
+                distRatio1 = -1
+            try:
+                distRatio2 = cwDist / lcpLength
+            except ZeroDivisionError:
+                distRatio2 = -1
+
+            row = rows.newRow()
+            row.shape = arcpy.Polyline(points)
+            row.setValue("Link_ID", int(linktable[link, cfg.LTB_LINKID]))
+            row.setValue("Active", int(activelink))
+            row.setValue("Link_Info", linktypedesc.strip('"'))
+            row.setValue("From_Core", int(sourceCore))
+            row.setValue("To_Core", int(targetCore))
+            row.setValue("Euc_Dist", eucDist)
+            row.setValue("CW_Dist", cwDist)
+            row.setValue("LCP_Length", lcpLength)
+            row.setValue("cwd2Euc_R", distRatio1)
+            row.setValue("cwd2Path_R", distRatio2)
+            rows.insertRow(row)
+            del row
+        del rows
 
         return lcpLoop
 
@@ -1098,7 +1356,39 @@ def components_no_sparse(G):
     """
     try:
         U, V = npy.where(G)
-        n = G.shape[0]
+        return hook_components(G.shape[0], U, V)
+    except:
+        exit_with_python_error(_SCRIPT_NAME)
+
+
+def components_from_edges(numNodes, nodes1, nodes2):
+    """Returns components of a graph given as an edge list.
+
+    Nodes are numbered 0 to numNodes - 1 and edges join nodes1[i] and
+    nodes2[i].  Gives the same labels as components_no_sparse on the
+    matching adjacency matrix, with memory in proportion to the number of
+    edges instead of nodes squared.
+
+    """
+    try:
+        # Both directions of each edge, in the order npy.where(G) gives
+        U = npy.concatenate((nodes1, nodes2)).astype('int64')
+        V = npy.concatenate((nodes2, nodes1)).astype('int64')
+        keys = npy.unique(U * numNodes + V)
+        U = (keys // numNodes).astype('int32')
+        V = (keys % numNodes).astype('int32')
+        return hook_components(numNodes, U, V)
+    except:
+        exit_with_python_error(_SCRIPT_NAME)
+
+
+def hook_components(n, U, V):
+    """Returns components of a graph with n nodes and directed edges U to V.
+
+    From gapdt.py by Viral Shah
+
+    """
+    try:
         D = npy.arange(0, n, dtype='int32')
         star = npy.zeros(n, 'int32')
         all_stars = False
@@ -1120,6 +1410,37 @@ def components_no_sparse(G):
         exit_with_python_error(_SCRIPT_NAME)
 
 
+def find_root(parent, node):
+    """Returns root of node's set in a union-find parent dictionary.
+
+    Nodes on the way are pointed straight at the root.
+
+    """
+    root = node
+    while parent[root] != root:
+        root = parent[root]
+    while parent[node] != root:
+        parent[node], node = root, parent[node]
+    return root
+
+
+def join_sets(parent, node1, node2):
+    """Joins the union-find sets of node1 and node2.
+
+    The lower root becomes the root of both, so each set is labeled by its
+    lowest node.  Returns False if the nodes were already in one set.
+
+    """
+    root1 = find_root(parent, node1)
+    root2 = find_root(parent, node2)
+    if root1 == root2:
+        return False
+    if root2 < root1:
+        root1, root2 = root2, root1
+    parent[root2] = root1
+    return True
+
+
 def relabel(oldlabel, offset=0): # same as gapdt
     """Utility for components code
 
@@ -1201,8 +1522,8 @@ def pointer_jumping(D):
 def load_link_table(linkTableFile):
     """Reads link table created by previous step """
     try:
-        linkTable1 = npy.loadtxt(linkTableFile, dtype='Float64',
-                             comments='#', delimiter=',')
+        linkTable1 = lm_cache.loadtxt(linkTableFile, dtype='Float64',
+                                      comments='#', delimiter=',')
         if len(linkTable1) == linkTable1.size:  # Just one connection
             linktable = npy.zeros((1, len(linkTable1)), dtype='Float64')
             linktable[:, 0:len(linkTable1)] = linkTable1[0:len(linkTable1)]
@@ -2093,6 +2414,46 @@ def copy_log_file():
         shutil.copyfile(cfg.logFilePath,cfg.logFileCopyPath)
     except:
         pass
+
+
+def create_worker_pool(numWorkers, initializer=None, initargs=()):
+    """Returns a multiprocessing pool of worker processes.
+
+    ArcMap runs scripts inside its own executable, so workers have to be
+    started with the python interpreter instead.
+
+    """
+    import multiprocessing
+    exeName = os.path.basename(sys.executable).lower()
+    if sys.platform == 'win32' and not exeName.startswith('python'):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix,
+                                                    'pythonw.exe'))
+    return multiprocessing.Pool(numWorkers, initializer, initargs)
+
+
+def get_worker_settings():
+    """Returns tool settings to copy into worker processes.
+
+    Arrays are left out, since some hold whole rasters.  Workers needing
+    them are passed them or read their own.
+
+    """
+    settings = {}
+    for name, value in vars(cfg).items():
+        if name == 'gp':  # Each process has its own geoprocessor
+            continue
+        if isinstance(value, npy.ndarray):
+            continue
+        settings[name] = value
+    return settings
+
+
+def set_worker_settings(settings):
+    """Copies tool settings from get_worker_settings into this process"""
+    for name, value in settings.items():
+        setattr(cfg, name, value)
+
+
 def print_arcgis_failures(statement, failures):
     """ Reports ArcGIS call that's failing and decides whether to restart
         iteration.
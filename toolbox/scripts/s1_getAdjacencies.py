@@ -8,7 +8,9 @@ cost-weighted distance space
 
 """
 
+import os
 import time
+import traceback
 import os.path as path
 
 import numpy as npy
@@ -17,6 +19,8 @@ import arcgisscripting
 
 from lm_config import tool_env as cfg
 import lm_util as lu
+import lm_cwd
+import lm_raster
 
 try:
     import arcpy
@@ -35,6 +39,8 @@ _SCRIPT_NAME = "s1_getAdjacencies.py"
 gp = cfg.gp
 gprint = lu.gprint
 
+ADJ_NAMES = {'cw': 'Cost-weighted', 'eu': 'Euclidean'}
+
 
 def STEP1_get_adjacencies():
     """Determines adjacencies between core areas in either or both
@@ -95,10 +101,25 @@ def STEP1_get_adjacencies():
         gp.rasterstatistics = "NONE"
         gp.workspace = cfg.SCRATCHDIR
 
+        cfg.S1CORELABELS = None
+        if cfg.CALCENGINE == 'native' and arcpy:
+            save_core_labels()
+
+        methods = []
         if cfg.S1ADJMETH_CW:
-            cwadjacency()
+            methods.append('cw')
         if cfg.S1ADJMETH_EU:
-            euadjacency()
+            methods.append('eu')
+        if len(methods) > 1 and cfg.NUMWORKERS > 1 and arcpy:
+            times = run_adjacency_pool(methods)
+        else:
+            times = []
+            for method in methods:
+                times.append(run_adjacency(method))
+        lu.dashline()
+        for method, seconds in zip(methods, times):
+            gprint(ADJ_NAMES[method] + ' adjacency took ' +
+                   str(round(seconds, 1)) + ' seconds.')
 
     # Return GEOPROCESSING specific errors
     except arcgisscripting.ExecuteError:
@@ -114,6 +135,105 @@ def STEP1_get_adjacencies():
     return
 
 
+def run_adjacency(method):
+    """Runs cost-weighted ('cw') or Euclidean ('eu') adjacency and returns
+    its processing time in seconds.
+
+    """
+    startTime = time.clock()
+    if method == 'cw':
+        cwadjacency()
+    else:
+        euadjacency()
+    return time.clock() - startTime
+
+
+def run_adjacency_pool(methods):
+    """Runs adjacency methods at the same time in worker processes.
+
+    Workers share the core label array saved by save_core_labels.  Returns
+    the processing time of each method.
+
+    """
+    gprint('\nCalculating ' + ' and '.join([ADJ_NAMES[method].lower()
+           for method in methods]) + ' adjacency at the same time in '
+           'separate worker processes.')
+    pool = lu.create_worker_pool(len(methods), init_adjacency_worker,
+                                 (lu.get_worker_settings(),))
+    try:
+        results = pool.map(adjacency_worker, methods)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    times = []
+    for method, seconds, errorText in results:
+        if errorText is not None:
+            msg = ('ERROR: Worker process failed while calculating ' +
+                   ADJ_NAMES[method].lower() + ' adjacency. See the log '
+                   'file for details.\n' + errorText)
+            lu.raise_error(msg)
+        times.append(seconds)
+    return times
+
+
+def init_adjacency_worker(settings):
+    """Sets up a worker process for adjacency calcs"""
+    lu.set_worker_settings(settings)
+
+    # Separate ArcGIS scratch workspace so workers don't collide
+    cfg.ARCSCRATCHDIR = path.join(cfg.ARCSCRATCHDIR,
+                                  'worker' + str(os.getpid()))
+    lu.create_dir(cfg.ARCSCRATCHDIR)
+    gp.scratchWorkspace = cfg.ARCSCRATCHDIR
+    gp.pyramid = "NONE"
+    gp.rasterstatistics = "NONE"
+
+
+def adjacency_worker(method):
+    """Runs an adjacency method in a worker process.
+
+    Returns the method, its processing time and error text (None on
+    success).
+
+    """
+    try:
+        return method, run_adjacency(method), None
+
+    # exit_with_python_error raises SystemExit, so catch everything and
+    # hand the error back to the main process
+    except:
+        return method, None, traceback.format_exc()
+
+
+def save_core_labels():
+    """Saves core area IDs on the resistance grid to an array file.
+
+    The native engines map it read-only, so the core raster is read once
+    and worker processes share the pages.
+
+    """
+    grid = lu.get_raster_grid(cfg.RESRAST)
+    cores = lu.raster_to_array(cfg.CORERAS, grid)
+    cores = npy.where(npy.isnan(cores), 0, cores).astype('int32')
+    cfg.S1COREGRID = grid
+    cfg.S1CORELABELS = path.join(cfg.SCRATCHDIR, 'core_labels.npy')
+    npy.save(cfg.S1CORELABELS, cores)
+
+
+def get_core_labels(grid):
+    """Returns core area IDs on grid, with 0 outside core areas"""
+    if cfg.S1CORELABELS is not None:
+        window = lm_raster.grid_window(grid, cfg.S1COREGRID)
+        if window == lm_raster.intersect_windows(
+                window, lm_raster.full_window(cfg.S1COREGRID)):
+            cores = npy.load(cfg.S1CORELABELS, mmap_mode='r')
+            return npy.array(cores[lm_raster.window_slices(window)])
+    cores = lu.raster_to_array(cfg.CORERAS, grid)
+    return npy.where(npy.isnan(cores), 0, cores).astype('int32')
+
+
 def cwadjacency():
     """Calculate cost-weighted adjacency
 
@@ -173,7 +293,11 @@ def cwadjacency():
         count = 0
 
 
-        if arcpy:
+        alloc = alloc_ras
+        if cfg.CALCENGINE == 'native' and arcpy:
+            statement = ('alloc = calc_cost_alloc_native(bResistance, '
+                         'outDistanceRaster)')
+        elif arcpy:
             statement = ('costAllocOut = CostAllocation(cfg.CORERAS, '
                         'bResistance, cfg.TMAXCWDIST, cfg.CORERAS,"VALUE", '
                         'outDistanceRaster);'
@@ -196,7 +320,7 @@ def cwadjacency():
         gp.scratchworkspace = cfg.ARCSCRATCHDIR
         gprint('Cost-weighted distance allocation done.')
         start_time = lu.elapsed_time(start_time)
-        adjshiftwrite(alloc_ras, outcsvfile, outcsvLogfile)
+        adjshiftwrite(alloc, outcsvfile, outcsvLogfile)
 
     # Return GEOPROCESSING specific errors
     except arcgisscripting.ExecuteError:
@@ -211,6 +335,28 @@ def cwadjacency():
         lu.exit_with_python_error(_SCRIPT_NAME)
 
 
+def calc_cost_alloc_native(bResistance, outDistanceRaster):
+    """Writes cwd raster and returns cost allocation array using the numpy
+    engine.
+
+    One spread from all core areas at once carries each core's ID along
+    with the distance, as CostAllocation does.  The allocation array goes
+    straight to adjacency, with 0 where no core is reached.  Rasters of
+    more than lm_cwd.HEAPCELLS cells are swept with array operations
+    rather than searched with a priority queue, so memory use stays at a
+    few arrays the size of the raster.
+
+    """
+    grid = lu.get_raster_grid(bResistance)
+    resistance = lu.raster_to_array(bResistance, grid)
+    cores = get_core_labels(grid)
+    cwd, back, alloc = lm_cwd.spread(resistance, cores, grid[2],
+                                     cfg.TMAXCWDIST,
+                                     stripCells=cfg.STRIPCELLS)
+    lu.array_to_raster(cwd, grid, outDistanceRaster)
+    return alloc
+
+
 def euadjacency():
     """Calculate Euclidean adjacency
 
@@ -244,8 +390,12 @@ def euadjacency():
         lu.delete_data(outDistanceRaster)
 
         count = 0
-        statement = ('gp.EucAllocation_sa(cfg.CORERAS, alloc_ras, "","", '
-                     'cellSizeEuclidean, "", outDistanceRaster, "")')
+        alloc = alloc_ras
+        if cfg.CALCENGINE == 'native' and arcpy:
+            statement = 'alloc = calc_euc_alloc_native()'
+        else:
+            statement = ('gp.EucAllocation_sa(cfg.CORERAS, alloc_ras, "","", '
+                         'cellSizeEuclidean, "", outDistanceRaster, "")')
         while True:
             try:
                 exec statement
@@ -260,7 +410,7 @@ def euadjacency():
         gprint('\nEuclidean distance allocation done.')
         start_time = lu.elapsed_time(start_time)
         gp.extent = oldextent
-        adjshiftwrite(alloc_ras, outcsvfile, outcsvLogfile)
+        adjshiftwrite(alloc, outcsvfile, outcsvLogfile)
 
         # Clean up
         lu.delete_data(outDistanceRaster)
@@ -280,9 +430,31 @@ def euadjacency():
         lu.exit_with_python_error(_SCRIPT_NAME)
 
 
-def adjshiftwrite(araster, csvfile, logfile):
-    """Get adjacencies using shift method and write to disk"""
+def calc_euc_alloc_native():
+    """Returns Euclidean allocation array using a feature transform.
+
+    Covers the resistance raster, or just the bounding circle's extent
+    when one is used.  Only allocation is needed for adjacency, so no
+    distance or allocation rasters are written.
+
+    """
+    grid = lu.get_raster_grid(cfg.RESRAST)
+    if cfg.BUFFERDIST is not None:
+        extent = arcpy.Describe(cfg.BNDCIR).extent
+        window = lm_raster.extent_window(extent.XMin, extent.YMin,
+                                         extent.XMax, extent.YMax, grid)
+        grid = lm_raster.window_grid(grid, window)
+    return lm_cwd.euclidean_allocation(get_core_labels(grid),
+                                       cfg.STRIPCELLS)
+
+
+def adjshiftwrite(alloc, csvfile, logfile):
+    """Get adjacencies using shift method and write to disk.
+
+    alloc is an allocation raster or array.
+
+    """
     # To be replaced by getLeastCostDistsUsingShiftMethod if implemented
-    adjTable = lu.get_adj_using_shift_method(araster)
+    adjTable = lu.get_adj_using_shift_method(alloc)
     lu.write_adj_file(csvfile, adjTable)
     lu.write_adj_file(logfile, adjTable)
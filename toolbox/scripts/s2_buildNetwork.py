@@ -16,8 +16,16 @@ import time
 
 from lm_config import tool_env as cfg
 import lm_util as lu
+import lm_adj
+import lm_cache
+import lm_neardist
 from lm_retry_decorator import retry
 
+try:
+    import arcpy
+except:
+    arcpy = False
+
 _SCRIPT_NAME = "s2_buildNetwork.py"
 
 gp = cfg.gp
@@ -58,7 +66,8 @@ def STEP2_build_network():
         else:
             eucdist_file = cfg.S2EUCDISTFILE
 
-        eucDists_in = npy.loadtxt(eucdist_file, dtype='Float64', comments='#')
+        eucDists_in = lm_cache.loadtxt(eucdist_file, dtype='Float64',
+                                       comments='#')
 
         if eucDists_in.size == 3:  # If just one line in file
             eucDists = npy.zeros((1, 3), dtype='Float64')
@@ -69,111 +78,47 @@ def STEP2_build_network():
             eucDists = eucDists_in
             numDists = eucDists.shape[0]
         del eucDists_in
-        eucDists[:, 0:2] = npy.sort(eucDists[:, 0:2])
-        ind = npy.lexsort((eucDists[:, 2], eucDists[:, 1], eucDists[:, 0]))
-        eucDists = eucDists[ind]
         gprint('Core area distance list loaded.')
         gprint('number of pairwise distances = ' + str(numDists))
-        # sort eucDists by 1st column then by 2nd then by 3rd
 
         #----------------------------------------------------------------------
-        # Get rid of duplicate pairs of cores, retaining MINIMUM distance
-        # between them
+        # Flag adjacencies using adj files from step 1.
+        gprint('Creating link table')
+        cwdAdjKeys = None
+        eucAdjKeys = None
+        if cfg.S2ADJMETH_CW:
+            cwdAdjKeys = get_adj_keys(cfg.CWDADJFILE)
+            gprint('Cost-weighted adjacency file loaded.')
+        if cfg.S2ADJMETH_EU:
+            eucAdjKeys = get_adj_keys(cfg.EUCADJFILE)
         numDistsOld = numDists
-        for x in range(numDists - 2, -1, -1):
-            if (eucDists[x, 0] == eucDists[x + 1, 0]
-                and (eucDists[x, 1] == eucDists[x + 1, 1])):
-                eucDists[x + 1, 0] = 0
-        delRows = npy.asarray(npy.where(eucDists[:, 0] == 0))
-        delRowsVector = npy.zeros((delRows.shape[1]), dtype="int32")
-        delRowsVector[:] = delRows[0, :]
-        eucDists = lu.delete_row(eucDists, delRowsVector)
-        del delRows
-        del delRowsVector
-        numDists = eucDists.shape[0]
+        linkTable = make_link_table(eucDists, cwdAdjKeys, eucAdjKeys)
+        numDists = len(linkTable)
+        del eucDists, cwdAdjKeys, eucAdjKeys
 
         lu.dashline(1)
         gprint('Removed ' + str(numDistsOld - numDists) +
                           ' duplicate core pairs in Euclidean distance table.'
                           '\n')
-        maxEucDistID = max(eucDists[:, 1])
+        # Second cores are the higher of each pair
+        maxEucDistID = linkTable[:, cfg.LTB_CORE2].max()
         gprint('After removing duplicates and distances that exceed'
                           ' maximum, \nthere are ' + str(numDists) +
                           ' pairwise distances.  Max core ID number is ' +
                           str(int(maxEucDistID)) + '.')
 
-        # Begin creating and manipulating linktables
-        # zeros and many other array functions are imported from numpy
-        linkTable = npy.zeros((len(eucDists), 10), dtype='int32')
-        linkTable[:, 1:3] = eucDists[:, 0:2]
-        linkTable[:, cfg.LTB_EUCDIST] = eucDists[:, 2]
-
-        #----------------------------------------------------------------------
-        # Get adjacencies using adj files from step 1.
-        if cfg.S2ADJMETH_CW or cfg.S2ADJMETH_EU:  # Keep ALL links
-            cwdAdjList = []
-            eucAdjList = []
-            if cfg.S2ADJMETH_CW:
-                cwdAdjTable = get_adj_list(cfg.CWDADJFILE)
-                cwdAdjList = []
-                for i in range(0, len(cwdAdjTable)):
-                    listEntry = (str(cwdAdjTable[i, 0]) + '_' + str(cwdAdjTable[i, 1]))
-                    cwdAdjList.append(listEntry)
-                gprint('Cost-weighted adjacency file loaded.')
-                maxCwdAdjCoreID = max(cwdAdjTable[:, 1])
-                del cwdAdjTable
-
-            if cfg.S2ADJMETH_EU:
-                eucAdjTable = get_adj_list(cfg.EUCADJFILE)
-                eucAdjList = []
-                for i in range(0, len(eucAdjTable)):
-                    listEntry = (str(eucAdjTable[i, 0]) + '_' + str(eucAdjTable[i, 1]))
-                    eucAdjList.append(listEntry)
-                maxEucAdjCoreID = max(eucAdjTable[:, 1])
-                del eucAdjTable
-
-        # maxCoreId = max(maxEucAdjCoreID, maxCwdAdjCoreID, maxEucDistID)
-
-        del eucDists
-
-        gprint('Creating link table')
-        linkTable[:, cfg.LTB_CWDADJ] = -1  # Euc adjacency not evaluated
-        linkTable[:, cfg.LTB_EUCADJ] = -1
-        if cfg.S2ADJMETH_CW or cfg.S2ADJMETH_EU:  
-            for x in range(0, linkTable.shape[0]):
-                listEntry = (str(linkTable[x, cfg.LTB_CORE1]) + '_' +
-                             str(linkTable[x, cfg.LTB_CORE2]))
-                if listEntry in cwdAdjList:
-                    linkTable[x, cfg.LTB_CWDADJ] = 1
-                else:
-                    linkTable[x, cfg.LTB_CWDADJ] = 0
-                if listEntry in eucAdjList:
-                    linkTable[x, cfg.LTB_EUCADJ] = 1
-                else:
-                    linkTable[x, cfg.LTB_EUCADJ] = 0
-
         if cfg.S2ADJMETH_CW and cfg.S2ADJMETH_EU:  # "Keep all adjacent links"
             gprint("\nKeeping all adjacent links\n")
-            rows = []
-            for row in range(0, linkTable.shape[0]):
-                if (linkTable[row, cfg.LTB_EUCADJ] == 0
-                    and linkTable[row, cfg.LTB_CWDADJ] == 0):
-                    rows.append(row)
-            linkTable = lu.delete_row(linkTable, rows)
+            linkTable = linkTable[(linkTable[:, cfg.LTB_EUCADJ] == 1) |
+                                  (linkTable[:, cfg.LTB_CWDADJ] == 1)]
 
         elif cfg.S2ADJMETH_CW:
             gprint("\nKeeping cost-weighted adjacent links\n")
-            delRows = npy.asarray(npy.where(linkTable[:, cfg.LTB_CWDADJ] == 0))
-            delRowsVector = npy.zeros((delRows.shape[1]), dtype="int32")
-            delRowsVector[:] = delRows[0, :]
-            linkTable = lu.delete_row(linkTable, delRowsVector)
+            linkTable = linkTable[linkTable[:, cfg.LTB_CWDADJ] == 1]
 
         elif cfg.S2ADJMETH_EU:
             gprint("\nKeeping Euclidean adjacent links\n")
-            delRows = npy.asarray(npy.where(linkTable[:, cfg.LTB_EUCADJ] == 0))
-            delRowsVector = npy.zeros((delRows.shape[1]), dtype="int32")
-            delRowsVector[:] = delRows[0, :]
-            linkTable = lu.delete_row(linkTable, delRowsVector)
+            linkTable = linkTable[linkTable[:, cfg.LTB_EUCADJ] == 1]
 
         else:  # For Climate Corridor tool
             gprint("\nIgnoring adjacency and keeping all links\n")
@@ -204,9 +149,7 @@ def STEP2_build_network():
 
         # Set cfg.LTB_LINKTYPE to valid corridor code
         linkTable[:, cfg.LTB_LINKTYPE] = cfg.LT_CORR
-        # Make sure linkTable is sorted
-        ind = npy.lexsort((linkTable[:, cfg.LTB_CORE2],
-              linkTable[:, cfg.LTB_CORE1]))
+        # linkTable is already sorted by 1st core then by 2nd
         if len(linkTable) == 0:
             msg = ('\nERROR: There are no valid core area '
                             'pairs. This can happen when core area numbers in '
@@ -214,11 +157,8 @@ def STEP2_build_network():
                             'those in your core area feature class.')
             lu.raise_error(msg)
 
-        linkTable = linkTable[ind]
-
         # Assign link IDs in order
-        for x in range(len(linkTable)):
-            linkTable[x, cfg.LTB_LINKID] = x + 1
+        linkTable[:, cfg.LTB_LINKID] = npy.arange(1, len(linkTable) + 1)
 
         #----------------------------------------------------------------------
 
@@ -272,8 +212,8 @@ def STEP2_build_network():
 # Fixme: routine below could be used for other operations in code above.
 def get_adj_list(adjFile):
     try:
-        inAdjList = npy.loadtxt(adjFile, dtype='int32', comments='#',
-                          delimiter=',')  # creates a numpy array
+        inAdjList = lm_cache.loadtxt(adjFile, dtype='int32', comments='#',
+                                     delimiter=',')  # creates a numpy array
         if len(inAdjList) == inAdjList.size:  # Just one connection
             outAdjList = npy.zeros((1, 3), dtype='int32')
             outAdjList[:, 0:3] = inAdjList[0:3]
@@ -295,6 +235,41 @@ def get_adj_list(adjFile):
         lu.exit_with_python_error(_SCRIPT_NAME)
 
 
+def make_link_table(eucDists, cwdAdjKeys, eucAdjKeys):
+    """Returns link table rows for the core pairs in a distance table.
+
+    Duplicate pairs of cores keep their MINIMUM distance.  Pairs are packed
+    into (low, high) keys, so rows end up sorted by 1st core then by 2nd.
+    Adjacency columns are flagged from sorted pair keys of adjacent cores,
+    or left at -1 (not evaluated) if neither key array is given.
+
+    """
+    distKeys = lm_adj.pair_keys(eucDists[:, 0], eucDists[:, 1])
+    ind = lm_adj.min_by_key(distKeys, eucDists[:, 2])
+    distKeys = distKeys[ind]
+
+    # zeros and many other array functions are imported from numpy
+    linkTable = npy.zeros((len(distKeys), 10), dtype='int32')
+    linkTable[:, cfg.LTB_CORE1] = distKeys >> 32
+    linkTable[:, cfg.LTB_CORE2] = distKeys & 0xFFFFFFFF
+    linkTable[:, cfg.LTB_EUCDIST] = eucDists[ind, 2]
+
+    if cwdAdjKeys is None and eucAdjKeys is None:
+        linkTable[:, cfg.LTB_CWDADJ] = -1  # Adjacency not evaluated
+        linkTable[:, cfg.LTB_EUCADJ] = -1
+    if cwdAdjKeys is not None:
+        linkTable[lm_adj.keys_in(distKeys, cwdAdjKeys), cfg.LTB_CWDADJ] = 1
+    if eucAdjKeys is not None:
+        linkTable[lm_adj.keys_in(distKeys, eucAdjKeys), cfg.LTB_EUCADJ] = 1
+    return linkTable
+
+
+def get_adj_keys(adjFile):
+    """Returns sorted unique pair keys of core pairs in an adjacency file"""
+    adjList = get_adj_list(adjFile)
+    return npy.unique(lm_adj.pair_keys(adjList[:, 0], adjList[:, 1]))
+
+
 def generate_distance_file():
     """Use ArcGIS to create Conefor distance file
 
@@ -311,12 +286,8 @@ def generate_distance_file():
                 COREFC_SIMP = path.join(cfg.SCRATCHDIR, "CoreFC_Simp.shp")
                 tolerance = float(gp.CellSize) / 3
 
-                try:
-                    import arcpy
-                    import arcpy.cartography as CA
-                except:
-                    arcpy = False
                 if arcpy:
+                    import arcpy.cartography as CA
                     CA.SimplifyPolygon(cfg.COREFC, COREFC_SIMP, "POINT_REMOVE",
                                         tolerance, "#", "NO_CHECK")
 
@@ -328,19 +299,144 @@ def generate_distance_file():
             except:
                 pass # In case point geometry is entered for core area FC
 
+        start_time = time.clock()
+        if cfg.CALCENGINE == 'native' and arcpy:
+            gprint('\nFinding distances between cores using core '
+                   'boundaries.')
+            cores = get_core_geometries(S2COREFC)
+            output = []
+            numPairs = 0
+            for adjList in get_candidate_pairs(S2COREFC, cores):
+                numPairs = numPairs + len(adjList)
+                output.extend(get_native_distances(cores, adjList))
+        else:
+            # Near Table runs once over all pairs
+            adjList = [npy.zeros((0, 2), dtype='int32')]
+            adjList.extend(get_candidate_pairs(S2COREFC))
+            adjList = npy.concatenate(adjList)
+            numPairs = len(adjList)
+            output = get_near_table_distances(S2COREFC, adjList)
+        gprint('Processed ' + str(numPairs) + ' candidate core pairs.')
+        start_time = lu.elapsed_time(start_time)
+
+        # In case coreFC is grouped in TOC, get coreFN for non-Arc statement
+        group,coreFN = path.split(cfg.COREFC)
+
+        dist_fname = path.join(cfg.PROJECTDIR, (coreFN + "_dists.txt"))
+        dist_file = open(dist_fname, 'w')
+        dist_file.write('\n'.join(output))
+        dist_file.close()
+        gprint('Distance file ' + dist_fname + ' generated.\n')
 
+        return dist_fname
+
+    except arcgisscripting.ExecuteError:
+        lu.dashline(1)
+        gprint('****Failed in step 2. Details follow.****')
+        lu.exit_with_geoproc_error(_SCRIPT_NAME)
+
+    # Return any PYTHON or system specific errors
+    except:
+        lu.dashline(1)
+        gprint('****Failed in step 2. Details follow.****')
+        lu.exit_with_python_error(_SCRIPT_NAME)
+
+
+def get_candidate_pairs(coreFC, cores=None):
+    """Yields arrays of core pairs to find distances between.
+
+    With an adjacency method these are the adjacent pairs from step 1.
+    Otherwise every pair is a candidate, or with MAXEUCDIST just pairs
+    whose bounding boxes are within it, yielded in chunks.  Boxes come
+    from cores (geometries from get_core_geometries) if given, otherwise
+    from coreFC.
+
+    """
+    if cfg.S2ADJMETH_CW or cfg.S2ADJMETH_EU:
+        yield get_full_adj_list()
+        return
+    if cores is not None:
+        coreIDs = sorted(cores.keys())
+        boxes = [cores[core].bbox for core in coreIDs]
+    else:
+        coreIDs, boxes = lu.get_core_extents(coreFC, cfg.COREFN)
+    if cfg.MAXEUCDIST is not None:
+        gprint('Keeping core pairs with bounding boxes less than ' +
+               str(cfg.MAXEUCDIST) + ' apart.')
+    for pairs in lm_neardist.candidate_pairs(coreIDs, boxes,
+                                             cfg.MAXEUCDIST):
+        yield pairs
+
+
+def get_native_distances(cores, adjList):
+    """Returns distance file lines for core pairs in adjList, computed from
+    core geometries from get_core_geometries.
+
+    """
+    pairs = npy.asarray(adjList[:, 0:2], dtype='int32')
+    dists = lm_neardist.get_core_distances(cores, pairs)
+    output = []
+    csvseparator = "\t"
+    for pair, dist in zip(pairs.tolist(), dists):
+        if dist is None:  # May be running on selected core areas in step 2
+            continue
+        if dist <= 0:  # In case simplified polygons abut one another
+            dist = float(gp.CellSize)
+        output.append(csvseparator.join([str(pair[0]), str(pair[1]),
+                                         str(dist)]))
+    return output
+
+
+def get_core_geometries(coreFC):
+    """Returns dictionary of boundary geometry for each core area"""
+    shapeField = arcpy.Describe(coreFC).shapeFieldName
+    coreRings = {}
+    rows = arcpy.SearchCursor(coreFC)
+    for row in rows:
+        core = int(row.getValue(cfg.COREFN))
+        shape = row.getValue(shapeField)
+        rings = coreRings.setdefault(core, [])
+        if shape.type == 'point':  # In case of point geometry
+            rings.append([(shape.firstPoint.X, shape.firstPoint.Y)])
+            continue
+        for i in range(shape.partCount):
+            part = shape.getPart(i)
+            if shape.type == 'multipoint':
+                rings.append([(part.X, part.Y)])
+                continue
+            ring = []
+            for point in part:
+                if point is None:  # Next point starts an interior ring
+                    if ring:
+                        rings.append(ring)
+                    ring = []
+                else:
+                    ring.append((point.X, point.Y))
+            if ring:
+                rings.append(ring)
+    del rows
+
+    cores = {}
+    for core, rings in coreRings.iteritems():
+        if rings:
+            cores[core] = lm_neardist.CoreGeometry(rings)
+    return cores
+
+
+def get_near_table_distances(coreFC, adjList):
+    """Returns distance file lines for core pairs in adjList using Generate
+    Near Table.
+
+    """
+    try:
         gp.workspace = cfg.SCRATCHDIR
         FS2COREFC = "fcores"
         FS2COREFC2 = "fcores2"
-        gp.MakeFeatureLayer(S2COREFC, FS2COREFC)
-        gp.MakeFeatureLayer(S2COREFC, FS2COREFC2)
+        gp.MakeFeatureLayer(coreFC, FS2COREFC)
+        gp.MakeFeatureLayer(coreFC, FS2COREFC2)
 
         output = []
         csvseparator = "\t"
-        
-
-        adjList = get_full_adj_list()
-        # sourceCores = npy.unique(adjList[:, 0])
 
         gprint('\nFinding distances between cores using Generate Near Table.')
 #        gp.OutputCoordinateSystem = gp.describe(cfg.COREFC).SpatialReference
@@ -351,10 +447,7 @@ def generate_distance_file():
                            # "NO_LOCATION", "NO_ANGLE", "ALL", "0")
         # start_time = lu.elapsed_time(start_time)
 
-        gprint('There are ' + str(len(adjList)) + ' adjacent core pairs to '
-               'process.')
         pctDone = 0
-        start_time = time.clock()
         for x in range(0, len(adjList)):
 
             pctDone = lu.report_pct_done(x, len(adjList), pctDone)
@@ -386,19 +479,8 @@ def generate_distance_file():
                     row = rows.Next()              
             del rows
             output.append(csvseparator.join(outputrow))  
-              
-        start_time = lu.elapsed_time(start_time)
 
-        # In case coreFC is grouped in TOC, get coreFN for non-Arc statement
-        group,coreFN = path.split(cfg.COREFC)
-
-        dist_fname = path.join(cfg.PROJECTDIR, (coreFN + "_dists.txt"))
-        dist_file = open(dist_fname, 'w')
-        dist_file.write('\n'.join(output))
-        dist_file.close()
-        gprint('Distance file ' + dist_fname + ' generated.\n')
-
-        return dist_fname
+        return output
 
     except arcgisscripting.ExecuteError:
         lu.dashline(1)
@@ -427,47 +509,16 @@ def print_conefor_warning():
 
 def get_full_adj_list():
     try:
-        if not cfg.S2ADJMETH_CW and not cfg.S2ADJMETH_EU:  # Keep ALL links
-            coreList = lu.get_core_list(cfg.COREFC, cfg.COREFN)
-            coreList = coreList[:,0]
-            numCores = len(coreList)
-            adjList = npy.zeros((numCores*(numCores-1)/2,2), dtype="int32")
-            pairIndex = 0
-            for sourceIndex in range(0,numCores-1):
-                for targetIndex in range(sourceIndex + 1, numCores):
-                    adjList[pairIndex,0]=coreList[sourceIndex]
-                    adjList[pairIndex,1]=coreList[targetIndex]
-                    pairIndex = pairIndex + 1
-            return adjList
         eucAdjList = get_adj_list(cfg.EUCADJFILE)
         if cfg.S2ADJMETH_CW:
             cwdAdjList = get_adj_list(cfg.CWDADJFILE)
             adjList = npy.append(eucAdjList, cwdAdjList, axis=0)
         else:
             adjList = eucAdjList
-        adjList = npy.sort(adjList)
-
-                # sort by 1st core Id then by 2nd core Id
-        ind = npy.lexsort((adjList[:, 1], adjList[:, 0]))
-        adjList = adjList[ind]
-
-        numDists = len(adjList)
-        x = 1
-        while x < numDists:
-            if (adjList[x, 0] == adjList[x - 1, 0] and
-                adjList[x, 1] == adjList[x - 1, 1]):
-                adjList[x - 1, 0] = 0  # mark for deletion
-            x = x + 1
-
-        if numDists > 0:
-            delRows = npy.asarray(npy.where(adjList[:, 0] == 0))
-            delRowsVector = npy.zeros((delRows.shape[1]), dtype="int32")
-            delRowsVector[:] = delRows[0, :]
-            adjList = lu.delete_row(adjList, delRowsVector)
-            del delRows
-            del delRowsVector
-
-        return adjList
+
+        # Drop duplicates, sorting by 1st core Id then by 2nd core Id
+        adjKeys = npy.unique(lm_adj.pair_keys(adjList[:, 0], adjList[:, 1]))
+        return lm_adj.keys_to_table(adjKeys)
 
     except arcgisscripting.ExecuteError:
         lu.dashline(1)
@@ -480,6 +531,37 @@ def get_full_adj_list():
         gprint('****Failed in step 2. Details follow.****')
         lu.exit_with_python_error(_SCRIPT_NAME)
 
+def get_clusters(linkTable):
+    """Returns the cluster ID of each core, and the number of joins made.
+
+    Fragments closer than MAXEUCDIST are joined in link table order.  A
+    joined cluster keeps the cluster ID of the link's first fragment,
+    which gives the IDs that relabeling the table at each join did.
+
+    """
+    parent = {}
+    clusterIDs = {}  # By union-find root
+    for core in npy.unique(linkTable[:, cfg.LTB_CORE1:cfg.LTB_CORE2 + 1]):
+        parent[int(core)] = int(core)
+        clusterIDs[int(core)] = int(core)
+    numJoins = 0
+    for x in range(linkTable.shape[0]):
+        eucDist = linkTable[x, cfg.LTB_EUCDIST]
+        if eucDist < cfg.MAXEUCDIST:
+            root1 = lu.find_root(parent, int(linkTable[x, cfg.LTB_CORE1]))
+            root2 = lu.find_root(parent, int(linkTable[x, cfg.LTB_CORE2]))
+            if root1 == root2:
+                continue
+            clusterID = clusterIDs[root1]
+            lu.join_sets(parent, root1, root2)
+            clusterIDs[lu.find_root(parent, root1)] = clusterID
+            numJoins = numJoins + 1
+    clusters = {}
+    for core in parent:
+        clusters[core] = clusterIDs[lu.find_root(parent, core)]
+    return clusters, numJoins
+
+
 def connect_clusters(linkTable):
         # CUSTOM Fragment connecting code
     try:
@@ -489,7 +571,6 @@ def connect_clusters(linkTable):
 #        clusterFC = tempShapefile
         
         gprint('Running custom fragment connecting code.')
-        numLinks = linkTable.shape[0]
 
         fieldList = gp.ListFields(clusterFC)
         cluster_ID = 'clus' + str(int(cfg.MAXEUCDIST))
@@ -497,65 +578,25 @@ def connect_clusters(linkTable):
             if str(field.Name) == cluster_ID:
                 gp.DeleteField_management(clusterFC, cluster_ID)
         gp.AddField_management(clusterFC, cluster_ID, "LONG")
-        
+
+        clusters, numJoins = get_clusters(linkTable)
+        gprint('Joined ' + str(numJoins) + ' pairs of fragments separated by '
+               'less than ' + str(cfg.MAXEUCDIST) + '.')
+
+        # update linktable and shapefile to cluster IDs in one pass each
+        linkTable[:, cfg.LTB_CLUST1] = [clusters[core] for core in
+                                        linkTable[:, cfg.LTB_CORE1].tolist()]
+        linkTable[:, cfg.LTB_CLUST2] = [clusters[core] for core in
+                                        linkTable[:, cfg.LTB_CORE2].tolist()]
         rows = gp.UpdateCursor(clusterFC)
         row = rows.Next()
         while row:
-            # linkCoords indices
-            fragID = row.GetValue(cfg.COREFN) 
-            row.SetValue(cluster_ID, fragID)
+            fragID = int(row.GetValue(cfg.COREFN))
+            row.SetValue(cluster_ID, clusters.get(fragID, fragID))
             rows.UpdateRow(row)
             row = rows.Next()
         del row, rows
 
-
-        linkTable[:, cfg.LTB_CLUST1] = linkTable[:, cfg.LTB_CORE1]
-        linkTable[:, cfg.LTB_CLUST2] = linkTable[:, cfg.LTB_CORE2]
-        
-        #if frags less than cutoff set cluster_ID equal.        
-        for x in range(0,numLinks):
-            # if linkTable[x, cfg.LTB_LINKTYPE] == cfg.LT_CORR:            
-                gprint("link #"+str(x+1))
-                # Set newfragmentID of 2nd fragment to that of frag 1
-                frag1ID = linkTable[x, cfg.LTB_CLUST1]
-                frag2ID = linkTable[x, cfg.LTB_CLUST2]
-                if frag1ID == frag2ID:
-                    continue
-                eucDist = linkTable[x, cfg.LTB_EUCDIST]
-
-                # cur = gp.SearchCursor(clusterFC)
-                # row = cur.Next()
-                # while row:
-                    # if row.GetValue(cluster_ID) == frag1ID:
-                        # frag1CoreID =  row.GetValue(cluster_ID)
-                    # elif row.GetValue(cluster_ID) == frag2ID:
-                        # frag2CoreID =  row.GetValue(cluster_ID)
-                    # row = cur.Next()
-                    # i = i + 1
-                # del cur, row
-
-                if eucDist < cfg.MAXEUCDIST:
-#                    gprint("Joining fragments "+str(frag1ID)+" and "+str(frag2ID)+" in Core #"+str(frag2CoreID)+" separated by distance "+str(eucDist))
-                    gprint("Joining fragments "+str(frag1ID)+" and "+str(frag2ID)+" separated by distance "+str(eucDist))
-                    # update linktable to new fragment ID in cluster field
-                    rows = npy.where(linkTable[:,cfg.LTB_CLUST1] == frag2ID)
-                    linkTable[rows, cfg.LTB_CLUST1] = frag1ID
-                    rows = npy.where(linkTable[:,cfg.LTB_CLUST2] == frag2ID)
-                    linkTable[rows, cfg.LTB_CLUST2] = frag1ID
-                    del rows
-
-                    # update shapefile to new fragment ID in cluster_ID field
-                    rows = gp.UpdateCursor(clusterFC)
-                    row = rows.Next()
-                    while row:
-                        if row.GetValue(cluster_ID) == frag2ID:
-                            row.SetValue(cluster_ID, frag1ID)
-                        rows.UpdateRow(row)
-                        row = rows.Next()
-                    del row, rows
-                # else:   
-                    # gprint("Adjacent fragments not close enough ("+str(frag1CoreID)+" and "+str(frag2CoreID)+")")
-        
         gprint('Done Joining.  Creating output shapefiles.')
         
         coreBaseName = path.splitext(path.basename(cfg.COREFC))[0]
@@ -578,25 +619,23 @@ def connect_clusters(linkTable):
         gp.AddField_management(clusterFCFinal, cluster_ID, "LONG")
         gp.AddField_management(clusterFCFinal, "clust_area", "DOUBLE")
 
-        #run through rows- get cluster id, then get area from coreFCwitharea using searchcursor
+        # Read cluster areas once, then write them in one pass
+        clustAreas = {}
+        rows = gp.searchcursor(coreFCWithArea)
+        row = rows.Next()
+        while row:
+            clustAreas[row.GetValue(cluster_ID)] = row.GetValue("F_AREA")
+            row = rows.Next()
+        del row, rows
 
         rows = gp.UpdateCursor(clusterFCFinal)
         row = rows.Next()
         while row:
-            # linkCoords indices
             clustID = row.GetValue(cluster_ID)
-            rows2 = gp.searchcursor(coreFCWithArea)
-            row2 = rows2.Next()
-            while row2:
-                if row2.GetValue(cluster_ID) == clustID:
-                    fArea = "F_AREA"
-                    clustArea = row2.GetValue(fArea)
-                    break
-                row2 = rows2.Next()
-            row.SetValue("clust_area", clustArea)
+            row.SetValue("clust_area", clustAreas[clustID])
             rows.UpdateRow(row)
             row = rows.Next()
-        del row, rows, row2, rows2
+        del row, rows
         gprint('Cores with cluster ID and cluster area written to: ' 
                 + clusterFCFinal)
 
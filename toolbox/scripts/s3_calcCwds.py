@@ -10,12 +10,19 @@ extent of cwd calculations and speed computation.
 """
 
 
+import os
 import os.path as path
 import time
+import traceback
 import numpy as npy
 
 from lm_config import tool_env as cfg
 import lm_util as lu
+import lm_cwd
+import lm_cwdstore
+import lm_journal
+import lm_pairs
+import lm_raster
 
 _SCRIPT_NAME = "s3_calcCwds.py"
 
@@ -34,30 +41,8 @@ except:
 
 gprint = lu.gprint
 
-
-def write_cores_to_map(x, coresToMap):
-    """ Save core list at start of loop to allow a run to be re-started
-        if it fails.
-
-    """
-    try:
-        coreListFile = path.join(cfg.DATAPASSDIR, "temp_cores_to_map.csv")
-        outFile = open(coreListFile, "w")
-        outFile.write("#INDEX of last core being processed:\n")
-        outFile.write(str(int(x)))
-        outFile.write("\n")
-        outFile.write("#Full list of IDs of cores to be processed:\n")
-        for coreToMap in range(len(coresToMap)):
-            outFile.write(str(int(coresToMap[coreToMap])))
-            outFile.write("\n")
-        outFile.close()
-
-    # Return any PYTHON or system specific errors
-    except:
-        lu.dashline(1)
-        # gprint('****Failed in step 3. Details follow.****')
-        lu.exit_with_python_error(_SCRIPT_NAME)
-
+# Windowed cwd store used with the native engine, None for cwd grids
+cwdStore = None
 
 
 def STEP3_calc_cwds():
@@ -66,6 +51,7 @@ def STEP3_calc_cwds():
     extent of cwd calculations and speed computation.
 
     """
+    global cwdStore
     try:
         lu.dashline(1)
         gprint('Running script ' + _SCRIPT_NAME)
@@ -138,33 +124,40 @@ def STEP3_calc_cwds():
                     'previous run left off due to a crash or user\n'
                     'abort.  It assumes you are using the same input\n'
                     'data used in the terminated run.\n\n')
-            lu.warn('IMPORTANT: Your LCP and stick feature classes\n'
-                    'will LOSE LCPs that were already created, but\n'
-                    'your final raster corridor map should be complete.\n')
-                    
             lu.dashline(0)
             lu.snooze(10)
-            savedLinkTableFile = path.join(cfg.DATAPASSDIR,
-                                           "temp_linkTable_s3_partial.csv")
-            coreListFile = path.join(cfg.DATAPASSDIR, "temp_cores_to_map.csv")
-
-            if not path.exists(savedLinkTableFile) or not path.exists(
-                                                          coreListFile):
-
-                gprint('No partial results file found from previous '
+            journal = lm_journal.read_journal()
+            if journal is None:
+                gprint('No journal found from previous '
                        'stopped run. Starting run from beginning.\n')
                 lu.dashline(0)
                 rerun = False
+            elif journal[0] != [int(core) for core in coresToMap]:
+                gprint('Journal from previous stopped run was for '
+                       'different core areas. Starting run from '
+                       'beginning.\n')
+                lu.dashline(0)
+                rerun = False
 
         # If picking up a failed run, use old folders
         if not rerun:
             startIndex = 0
+            lm_journal.start_journal(coresToMap)
             if cfg.TOOL <> cfg.TOOL_CC:
                 lu.make_cwd_paths(max(coresToMap)) # Set up cwd directories
 
         # make a feature layer for input cores to select from
         gp.MakeFeatureLayer(cfg.COREFC, cfg.FCORES)
 
+        if cfg.CALCENGINE == 'native' and (cfg.TOOL == cfg.TOOL_CC or
+                                           not arcpy):
+            if cfg.TOOL <> cfg.TOOL_CC:
+                lu.warn('The native cost distance engine needs arcpy to '
+                        'read rasters.\nUsing ArcGIS CostDistance instead.')
+            cfg.CALCENGINE = 'arcgis'
+        if cfg.CALCENGINE == 'native' and cfg.STOPATTARGETS:
+            check_stop_at_targets()
+
         # Drop links that are too long
         gprint('\nChecking for corridors that are too long to map.')
         DISABLE_LEAST_COST_NO_VAL = False
@@ -195,54 +188,27 @@ def STEP3_calc_cwds():
                           ' corridors.')
 
             # x y corex corey radius- stores data for bounding circle centroids
-            boundingCirclePointArray  = npy.zeros((0,5), dtype='float32')
-
-            circleList = npy.zeros((0,3), dtype='int32')
-
-            numLinks = linkTable.shape[0]
-            for x in range(0, numLinks):
-                if ((linkTable[x,cfg.LTB_LINKTYPE] == cfg.LT_CORR) or
-                    (linkTable[x,cfg.LTB_LINKTYPE] == cfg.LT_KEEP)):
-                    # if it's a valid corridor link
-                    linkId = int(linkTable[x,cfg.LTB_LINKID])
-                    # fixme- this code is clumsy- can trim down
-                    cores = npy.zeros((1,3), dtype='int32')
-                    cores[0,:] = npy.sort([0, linkTable[x,cfg.LTB_CORE1],
-                                      linkTable[x,cfg.LTB_CORE2]])
-                    corex = cores[0,1]
-                    corey = cores[0,2]
-                    cores[0,0] = linkId
-
-                    ###################
-                    foundFlag = False
-                    for y in range(0,len(circleList)):  # clumsy
-                        if (circleList[y,1] == corex and
-                            circleList[y,2] == corey):
-                            foundFlag = True
-                    if not foundFlag:
-                        circlePointData = (
-                            lu.get_bounding_circle_data(extentBoxList,
-                            corex, corey, cfg.BUFFERDIST))
-                        boundingCirclePointArray = (
-                            npy.append(boundingCirclePointArray,
-                            circlePointData, axis=0))
-                        # keep track of which cores we draw bounding circles
-                        # around
-                        circleList = npy.append(circleList, cores, axis=0)
-
-            gprint('\nCreating bounding circles using buffer '
-                              'analysis.')
-
-            dir, BNDCIRCENS = path.split(cfg.BNDCIRCENS)
-            lu.make_points(cfg.SCRATCHDIR, boundingCirclePointArray,
-                           BNDCIRCENS)
-            lu.delete_data(cfg.BNDCIRS)
-            gp.buffer_analysis(cfg.BNDCIRCENS, cfg.BNDCIRS, "radius")
-            gp.deletefield (cfg.BNDCIRS, "BUFF_DIST")
-
-            gprint('Successfully created bounding circles around '
-                              'potential corridors using \na buffer of ' +
-                              str(float(cfg.BUFFERDIST)) + ' map units.')
+            boundingCirclePointArray = lu.get_bounding_circles_data(
+                extentBoxList, get_corridor_core_pairs(linkTable),
+                cfg.BUFFERDIST)
+
+            # Circles set the array window read for each core, and with the
+            # native engine mask resistance within it
+            cfg.BNDCIRCLES = boundingCirclePointArray
+            if cfg.CALCENGINE <> 'native':
+                gprint('\nCreating bounding circles using buffer '
+                                  'analysis.')
+
+                dir, BNDCIRCENS = path.split(cfg.BNDCIRCENS)
+                lu.make_points(cfg.SCRATCHDIR, boundingCirclePointArray,
+                               BNDCIRCENS)
+                lu.delete_data(cfg.BNDCIRS)
+                gp.buffer_analysis(cfg.BNDCIRCENS, cfg.BNDCIRS, "radius")
+                gp.deletefield (cfg.BNDCIRS, "BUFF_DIST")
+
+                gprint('Successfully created bounding circles around '
+                                  'potential corridors using \na buffer of ' +
+                                  str(float(cfg.BUFFERDIST)) + ' map units.')
             start_time = lu.elapsed_time(start_time)
 
             gprint('Reducing global processing area using bounding '
@@ -298,15 +264,24 @@ def STEP3_calc_cwds():
             gp.cellSize = gp.Describe(cfg.BOUNDRESIS).MeanCellHeight
             gp.extent = gp.Describe(cfg.BOUNDRESIS).extent
 
+        # Results for each core pair.  A pair is handled by its lower-numbered
+        # core, so A-B work is never repeated as B-A.
+        pairs = lm_pairs.PairStore()
+        lcpLoop = 0
         if rerun:
-            # saved linktable replaces the one now in memory
-            linkTable = lu.load_link_table(savedLinkTableFile)
-            coresToMapSaved = npy.loadtxt(coreListFile, dtype='Float64',
-                                          comments='#', delimiter=',')
-            startIndex = coresToMapSaved[0] # Index of core where we left off
-            del coresToMapSaved
-            gprint ('\n****** Re-starting run at core area number '
-                    + str(int(coresToMap[startIndex]))+ ' ******\n')
+            # Replay results for cores finished before the run stopped
+            startIndex = 0
+            numLcpLines = 0
+            for (x, rows, rowValues, pairResults,
+                 numLcpLines) in journal[1]:
+                linkTable[rows] = rowValues
+                pairs.pairs.update(pairResults)
+                startIndex = x + 1
+            del journal
+            lcpLoop = restore_lcp_shapefile(linkTable, pairs, numLcpLines)
+            if startIndex < len(coresToMap):
+                gprint ('\n****** Re-starting run at core area number '
+                        + str(int(coresToMap[startIndex]))+ ' ******\n')
             lu.dashline(0)
 
         if arcpy:
@@ -314,51 +289,59 @@ def STEP3_calc_cwds():
         else:
             gp.extent = "MINOF"
 
+        if cfg.TOOL <> cfg.TOOL_CC and arcpy:
+            # Arrays are read a core's window at a time from this grid
+            cfg.BNDGRID = lu.get_raster_grid(cfg.BOUNDRESIS)
+
+        cwdStore = None
+        if cfg.CALCENGINE == 'native':
+            # Keep windowed cwds in one store rather than a grid per core
+            if rerun:
+                cwdStore = lm_cwdstore.load_cwd_store()
+            if cwdStore is None:
+                cwdStore = lm_cwdstore.CwdStore(cfg.BNDGRID)
+
         #----------------------------------------------------------------------
         # Loop through cores, do cwd calcs for each
         if cfg.TOOL == cfg.TOOL_CC:
             gprint("\nMapping least-cost paths.\n")
         else:
             gprint("\nStarting cost distance calculations.\n")
-        lcpLoop = 0
         failures = 0
         x = startIndex
         endIndex = len(coresToMap)
-        linkTableMod = linkTable.copy()
-        while x < endIndex:
-            startTime1 = time.clock()
-            # Modification of linkTable in function was causing problems. so
-            # make a copy:
-            linkTablePassed = linkTableMod.copy()
-
-            (linkTableReturned, failures, lcpLoop) = do_cwd_calcs(x,
-                        linkTablePassed, coresToMap, lcpLoop, failures)
-            if failures == 0:
-                # If iteration was successful, continue with next core
-                linkTableMod = linkTableReturned
+        if cfg.NUMWORKERS > 1 and endIndex - startIndex > 1:
+            linkTable = run_cwd_pool(linkTable, coresToMap, startIndex, pairs,
+                                     lcpLoop)
+        else:
+            while x < endIndex:
+                startTime1 = time.clock()
                 sourceCore = int(coresToMap[x])
-                gprint('Done with all calculations for core ID #' +
-                        str(sourceCore) + '. ' + str(int(x + 1)) + ' of ' +
-                        str(endIndex) + ' cores have been processed.')
-                start_time = lu.elapsed_time(startTime1)
-
-                outlinkTableFile = path.join(cfg.DATAPASSDIR,
-                                             "temp_linkTable_s3_partial.csv")
-                lu.write_link_table(linkTableMod, outlinkTableFile)
-                # Increment  loop counter
-                x = x + 1
-            else:
-                # If iteration failed, try again after a wait period
-                delay_restart(failures)
+                # Pass just the links for this core.  They are copied, so a
+                # failed iteration leaves linkTable untouched.
+                coreRows = get_core_rows(linkTable, sourceCore)
+                corePairs = lm_pairs.PairStore()
+                (coreLinkTable, failures, lcpLoop) = do_cwd_calcs(x,
+                            linkTable[coreRows], coresToMap, lcpLoop,
+                            failures, corePairs)
+                if failures == 0:
+                    # If iteration was successful, continue with next core
+                    linkTable[coreRows] = coreLinkTable
+                    pairs.update(corePairs)
+                    gprint('Done with all calculations for core ID #' +
+                            str(sourceCore) + '. ' + str(int(x + 1)) + ' of ' +
+                            str(endIndex) + ' cores have been processed.')
+                    start_time = lu.elapsed_time(startTime1)
+
+                    add_to_journal(x, sourceCore, linkTable, corePairs,
+                                   lcpLoop)
+                    # Increment  loop counter
+                    x = x + 1
+                else:
+                    # If iteration failed, try again after a wait period
+                    delay_restart(failures)
         #----------------------------------------------------------------------
 
-        linkTable = linkTableMod
-
-        # reinstate temporarily disabled links
-        rows = npy.where(linkTable[:,cfg.LTB_LINKTYPE] > 1000)
-        linkTable[rows,cfg.LTB_LINKTYPE] = (linkTable[rows,cfg.LTB_LINKTYPE] -
-                                            1000)
-
         # Drop links that are too long
         DISABLE_LEAST_COST_NO_VAL = True
         linkTable,numDroppedLinks = lu.drop_links(linkTable, cfg.MAXEUCDIST,
@@ -381,16 +364,17 @@ def STEP3_calc_cwds():
             lu.write_link_maps(outlinkTableFile, step=3)
         start_time = lu.elapsed_time(start_time)
 
-        gprint('\nIndividual cost-weighted distance layers written '
-                          'to "cwd" directory. \n')
+        if cwdStore is not None:
+            gprint('\nCost-weighted distances written to store in "cwd" '
+                   'directory. \n')
+        else:
+            gprint('\nIndividual cost-weighted distance layers written '
+                              'to "cwd" directory. \n')
         gprint(outlinkTableFile +
                 '\n updated with cost-weighted distances between core areas.')
 
-        #Clean up temporary files for restart code
-        tempFile = path.join(cfg.DATAPASSDIR, "temp_cores_to_map.csv")
-        lu.delete_file(tempFile)
-        tempFile = path.join(cfg.DATAPASSDIR, "temp_linkTable_s3_partial.csv")
-        lu.delete_file(tempFile)
+        #Clean up journal for restart code
+        lm_journal.delete_journal()
 
         # Check if climate tool is calling linkage mapper
         if cfg.TOOL == cfg.TOOL_CC:
@@ -417,7 +401,293 @@ def STEP3_calc_cwds():
 
 
 
-def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
+def get_corridor_core_pairs(linkTable):
+    """Returns sorted, unique (corex, corey) pairs for corridor links"""
+    linkTypes = linkTable[:, cfg.LTB_LINKTYPE]
+    rows = npy.where((linkTypes == cfg.LT_CORR) | (linkTypes == cfg.LT_KEEP))
+    corePairs = npy.sort(linkTable[rows][:, cfg.LTB_CORE1:cfg.LTB_CORE2 + 1],
+                         axis=1).astype('int32')
+    if len(corePairs) == 0:
+        return corePairs
+    order = npy.lexsort((corePairs[:, 1], corePairs[:, 0]))
+    corePairs = corePairs[order]
+    unique = npy.ones(len(corePairs), dtype='bool')
+    unique[1:] = npy.any(corePairs[1:] != corePairs[:-1], axis=1)
+    return corePairs[unique]
+
+
+def get_core_rows(linkTable, core):
+    """Returns link table rows for links that connect to a core"""
+    return npy.where((linkTable[:, cfg.LTB_CORE1] == core) |
+                     (linkTable[:, cfg.LTB_CORE2] == core))[0]
+
+
+def add_to_journal(x, sourceCore, linkTable, corePairs, lcpLoop):
+    """Journals link table rows and pair results for a finished core, and
+    saves the cwd store index.
+
+    """
+    if cwdStore is not None:
+        cwdStore.save()
+    rows = get_core_rows(linkTable, sourceCore)
+    firstCores = npy.minimum(linkTable[rows, cfg.LTB_CORE1],
+                             linkTable[rows, cfg.LTB_CORE2])
+    rows = rows[firstCores == sourceCore]
+    if lcpLoop == 0:
+        numLcpLines = 0
+    else:
+        lcpShapefile = path.join(cfg.DATAPASSDIR, "lcpLines_s3.shp")
+        if arcpy:
+            numLcpLines = arcpy.GetCount_management(lcpShapefile).getOutput(0)
+        else:
+            numLcpLines = gp.GetCount_management(lcpShapefile).GetOutput(0)
+    lm_journal.add_to_journal(x, rows, linkTable[rows], corePairs.pairs,
+                              numLcpLines)
+
+
+def restore_lcp_shapefile(linkTable, pairs, numLcpLines):
+    """Carries on the LCP shapefile from a stopped run.
+
+    Lines added after the last journaled core are removed.  If the shapefile
+    is gone, lines traced by the native engine are rewritten from the pair
+    store.  Returns lcpLoop to continue with.
+
+    """
+    lcpShapefile = path.join(cfg.DATAPASSDIR, "lcpLines_s3.shp")
+    if numLcpLines == 0:
+        return 0
+    if gp.Exists(lcpShapefile):
+        gp.MakeFeatureLayer(lcpShapefile, "fLcpLines",
+                            '"FID" >= ' + str(int(numLcpLines)))
+        gp.DeleteFeatures_management("fLcpLines")
+        gp.Delete_management("fLcpLines")
+        return 1
+    lcpLines = []
+    linkRows = get_link_rows(linkTable)
+    for corex, corey in pairs.keys():
+        lcpVerts = pairs.get(corex, corey, lm_pairs.LCPVERTS)
+        if lcpVerts is not None:
+            link = linkRows[(min(corex, corey), max(corex, corey))]
+            lcpLines.append((link, corex, corey, lcpVerts,
+                             pairs.get(corex, corey, lm_pairs.LCPLENGTH)))
+    if lcpLines:
+        return lu.write_lcp_lines(lcpLines, linkTable, lcpShapefile, 0)
+    lu.warn('LCP shapefile from the stopped run was not found. LCPs '
+            'already created will be missing from it.')
+    return 0
+
+
+def run_cwd_pool(linkTable, coresToMap, startIndex, pairs, lcpLoop=0):
+    """Runs cwd calcs for cores in parallel worker processes.
+
+    Each worker maps one core area at a time in its own core scratch
+    directory.  A link is handled by the worker for the lower-numbered core
+    it connects, as in the one-at-a-time loop.  A core is started only when
+    the lower-numbered cores it shares links with are done, and gets its
+    link table rows as they stand then, so its targets and bounding circles
+    match the one-at-a-time loop.  Pair results and LCP lines are merged
+    back in core order.
+
+    """
+    endIndex = len(coresToMap)
+    numWorkers = min(cfg.NUMWORKERS, endIndex - startIndex)
+    gprint('Mapping core areas using ' + str(numWorkers) +
+           ' worker processes.\n')
+    waitingOn, dependents = get_core_dependencies(linkTable, coresToMap,
+                                                  startIndex)
+    pool = lu.create_worker_pool(numWorkers, init_cwd_worker,
+                                 (lu.get_worker_settings(),
+                                  getattr(cfg, 'BNDCIRCLES', None),
+                                  coresToMap, cwdStore))
+    lcpShapefile = path.join(cfg.DATAPASSDIR, "lcpLines_s3.shp")
+    linkTable = linkTable.copy()
+    firstCores = npy.minimum(linkTable[:, cfg.LTB_CORE1],
+                             linkTable[:, cfg.LTB_CORE2])
+    try:
+        readyCores = [x for x in range(startIndex, endIndex)
+                      if not waitingOn[x]]
+        running = {}
+        finished = {}
+        nextIndex = startIndex
+        while nextIndex < endIndex:
+            for x in readyCores:
+                coreRows = get_core_rows(linkTable, int(coresToMap[x]))
+                running[x] = pool.apply_async(cwd_worker,
+                                              (x, linkTable[coreRows]))
+            readyCores = []
+
+            (x, coreLinkTable, corePairs, coreLcpShapefile, storeEntry,
+             errorText) = wait_for_core(running, coresToMap)
+            sourceCore = int(coresToMap[x])
+            if errorText is not None:
+                msg = ('ERROR: Worker process failed while mapping core '
+                       'area #' + str(sourceCore) + '. See the log file '
+                       'for details.\n' + errorText)
+                lu.raise_error(msg)
+
+            # Keep only links this core handled
+            coreRows = get_core_rows(linkTable, sourceCore)
+            owned = firstCores[coreRows] == sourceCore
+            linkTable[coreRows[owned]] = coreLinkTable[owned]
+            finished[x] = (corePairs, coreLcpShapefile, storeEntry)
+            for y in sorted(dependents[x]):
+                waitingOn[y].discard(x)
+                if not waitingOn[y]:
+                    readyCores.append(y)
+
+            # Journal finished cores in order, so a restart picks up after
+            # the last core with everything before it done
+            while nextIndex in finished:
+                x = nextIndex
+                sourceCore = int(coresToMap[x])
+                corePairs, coreLcpShapefile, storeEntry = finished.pop(x)
+                pairs.update(corePairs)
+                if storeEntry is not None:
+                    cwdStore.add_entry(sourceCore, storeEntry)
+                if coreLcpShapefile is not None:
+                    lcpLoop = lu.add_to_lcp_shapefile(coreLcpShapefile,
+                                                      lcpShapefile, lcpLoop)
+                    lu.delete_dir(path.dirname(coreLcpShapefile))
+
+                gprint('Done with all calculations for core ID #' +
+                        str(sourceCore) + '. ' + str(int(x + 1)) + ' of ' +
+                        str(endIndex) + ' cores have been processed.')
+                add_to_journal(x, sourceCore, linkTable, corePairs, lcpLoop)
+                nextIndex = nextIndex + 1
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return linkTable
+
+
+def wait_for_core(running, coresToMap):
+    """Waits for a worker to finish mapping a core area.
+
+    running holds the pending result of each core being mapped, by core
+    index.  Results are polled rather than waited on with callbacks, so a
+    task that dies with an exception the worker didn't catch is reported
+    instead of leaving step 3 waiting forever.  Returns the finished
+    core's results, removing it from running.
+
+    """
+    while True:
+        for x in sorted(running):
+            if not running[x].ready():
+                continue
+            result = running.pop(x)
+            if not result.successful():
+                try:
+                    result.get()
+                except:
+                    msg = ('ERROR: Worker process failed while mapping '
+                           'core area #' + str(int(coresToMap[x])) +
+                           '. See the log file for details.\n' +
+                           traceback.format_exc())
+                    lu.raise_error(msg)
+            return result.get()
+        time.sleep(0.1)
+
+
+def get_core_dependencies(linkTable, coresToMap, startIndex):
+    """Returns the cores each core from startIndex on has to wait for.
+
+    A core waits for an earlier core it shares a valid link with, since the
+    earlier core sets the link's cwd and may disable it.  Returns sets of
+    core indexes waited on, and sets of core indexes waiting, by core
+    index.
+
+    """
+    coreIndexes = dict([(int(core), x) for x, core in enumerate(coresToMap)])
+    waitingOn = dict([(x, set()) for x in range(startIndex,
+                                                len(coresToMap))])
+    dependents = dict([(x, set()) for x in waitingOn])
+    rows = npy.where(linkTable[:, cfg.LTB_LINKTYPE] > 0)
+    corePairs = npy.sort(linkTable[rows][:, cfg.LTB_CORE1:cfg.LTB_CORE2 + 1],
+                         axis=1).astype('int32')
+    for core1, core2 in corePairs.tolist():
+        x1 = coreIndexes.get(core1)
+        x2 = coreIndexes.get(core2)
+        if x1 is not None and x2 is not None and startIndex <= x1 < x2:
+            waitingOn[x2].add(x1)
+            dependents[x1].add(x2)
+    return waitingOn, dependents
+
+
+def init_cwd_worker(settings, circles, coresToMap, store):
+    """Sets up a worker process for cwd calcs"""
+    global workerCoresToMap, cwdStore
+    lu.set_worker_settings(settings)
+    if circles is not None:
+        cfg.BNDCIRCLES = circles
+    workerCoresToMap = coresToMap
+    cwdStore = store
+    if cwdStore is not None:
+        # Each worker appends cwds to its own data file
+        cwdStore.dataName = 'cwd_data_' + str(os.getpid()) + '.dat'
+
+    # Separate ArcGIS scratch workspace so workers don't collide
+    cfg.ARCSCRATCHDIR = path.join(cfg.ARCSCRATCHDIR,
+                                  'worker' + str(os.getpid()))
+    lu.create_dir(cfg.ARCSCRATCHDIR)
+    if arcpy:
+        arcpy.env.cellSize = cfg.BOUNDRESIS
+        arcpy.env.extent = "MINOF"
+        arcpy.env.overwriteOutput = True
+    else:
+        gp.cellSize = gp.Describe(cfg.BOUNDRESIS).MeanCellHeight
+        gp.Extent = "MINOF"
+        gp.OverwriteOutput = True
+    gp.mask = cfg.RESRAST
+
+
+def cwd_worker(x, linkTable):
+    """Maps core area x in a worker process.
+
+    linkTable holds the core's link table rows.  Returns the core index,
+    the updated rows, its pair results, its LCP shapefile (None if no LCPs
+    were mapped), its cwd store index entry (None without a store) and
+    error text (None on success).
+
+    """
+    try:
+        sourceCore = int(workerCoresToMap[x])
+
+        lcpDir = path.join(cfg.SCRATCHDIR, 'lcp' + str(sourceCore))
+        lu.delete_dir(lcpDir)
+        lu.create_dir(lcpDir)
+        lcpShapefile = path.join(lcpDir, "lcpLines.shp")
+
+        failures = 0
+        while True:
+            corePairs = lm_pairs.PairStore()
+            (coreLinkTable, failures, lcpLoop) = do_cwd_calcs(x,
+                linkTable.copy(), workerCoresToMap, 0, failures, corePairs,
+                lcpShapefile)
+            if failures == 0:
+                break
+            delay_restart(failures)
+        if lcpLoop == 0:
+            lcpShapefile = None
+        storeEntry = None
+        if cwdStore is not None:
+            storeEntry = cwdStore.get_entry(sourceCore)
+        return x, coreLinkTable, corePairs, lcpShapefile, storeEntry, None
+
+    # exit_with_python_error raises SystemExit, so catch everything and
+    # hand the error back to the main process
+    except:
+        return x, None, None, None, None, traceback.format_exc()
+
+
+def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures, pairs,
+                 lcpShapefile=None):
+    """Maps cwds and LCPs from one core area.
+
+    linkTable holds the links for the core.  Results for pairs it shares
+    with higher-numbered cores are added to linkTable and to pairs.
+
+    """
     try:
         # This is the focal core area we're running cwd out from
         sourceCore = int(coresToMap[x])
@@ -440,23 +710,10 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
             gp.OverwriteOutput = True
             gp.Extent = "MINOF"
 
-        write_cores_to_map(x, coresToMap)
-
-        # Get target cores based on linktable with reinstated links
-        # (we temporarily disable them below by adding 1000)
-        linkTableTemp = linkTable.copy()
-        # reinstate temporarily disabled links
-        rows = npy.where(linkTableTemp[:,cfg.LTB_LINKTYPE] > 1000)
-        linkTableTemp[rows,cfg.LTB_LINKTYPE] = (
-            linkTableTemp[rows,cfg.LTB_LINKTYPE] - 1000)
-        del rows
-
         # get core areas to be connected to focal core
-        targetCores = lu.get_core_targets(sourceCore, linkTableTemp)
+        targetCores = lu.get_core_targets(sourceCore, linkTable)
         # gprint( str(sourceCore))
-        # gprint(str(linkTableTemp.astype('int32')))
         # gprint('targets'+str(targetCores))
-        del linkTableTemp
 
         if len(targetCores)==0:
             # Nothing to do, so reset failure count and return.
@@ -471,7 +728,18 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
         # Create BOUNDING FEATURE to limit extent of cost distance
         # calculations-This is a set of circles encompassing core areas
         # we'll be connecting each core area to.
-        if cfg.BUFFERDIST is not None:
+        window = None
+        bndMask = None
+        if cfg.TOOL <> cfg.TOOL_CC and arcpy:
+            if cfg.BUFFERDIST is not None:
+                window, bndMask = get_core_window(sourceCore, targetCores)
+            else:
+                window = lm_raster.full_window(cfg.BNDGRID)
+        if cfg.BUFFERDIST is not None and cfg.CALCENGINE == 'native':
+            # Mask the resistance array window with the circles instead
+            # of clipping the resistance raster
+            bResistance = cfg.BOUNDRESIS
+        elif cfg.BUFFERDIST is not None:
             # fixme: move outside of loop   # new circle
             gp.MakeFeatureLayer(cfg.BNDCIRS,"fGlobalBoundingFeat")
 
@@ -523,9 +791,17 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
 
         else:
             bResistance = cfg.BOUNDRESIS
+        coreZones = None
+        if window is not None:
+            # Grid and core IDs for the cells we're working with
+            winGrid = lm_raster.window_grid(cfg.BNDGRID, window)
+            if cfg.CALCENGINE == 'native' or cfg.S3DROPLCCSic:
+                coreZones = read_core_zones(winGrid)
         # ---------------------------------------------------------
         # CWD Calculations
         outDistanceRaster = lu.get_cwd_path(sourceCore)
+        cwdArray = None
+        backArray = None
         # Check if climate tool is calling linkage mapper
         if cfg.TOOL == cfg.TOOL_CC:
             back_rast = outDistanceRaster.replace("cwd_", "back_")
@@ -535,233 +811,163 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
             lu.delete_data(outDistanceRaster)
             start_time = time.clock()
 
-            # Create raster that just has source core in it
-            # Note: this seems faster than setnull with LI grid.
-            SRCRASTER = 'source' + tif
-            lu.delete_data(path.join(coreDir,SRCRASTER))
-            if arcpy:
-                statement = ('conRaster = '
-                             'Con(Raster(cfg.CORERAS) == int(sourceCore), 1);'
-                             'conRaster.save(SRCRASTER)')
+            if cfg.CALCENGINE == 'native':
+                # Cost distance and back-link rasters from numpy engine
+                statement = ('cwdArray, backArray = calc_cwd_native('
+                             'sourceCore, targetCores, window, bndMask, '
+                             'coreZones, outDistanceRaster, '
+                             'path.join(coreDir, back_rast))')
+                try:
+                    exec statement
+                    randomerror()
+                except:
+                    failures = lu.print_arcgis_failures(statement, failures)
+                    if failures < 20:
+                        return None, failures, lcpLoop
+                    else:
+                        exec statement
             else:
-                expression = ("con(" + cfg.CORERAS + " == " +
-                               str(int(sourceCore)) + ", 1)")
-                statement = ('gp.SingleOutputMapAlgebra_sa'
-                            '(expression, SRCRASTER)')
+                # Create raster that just has source core in it
+                # Note: this seems faster than setnull with LI grid.
+                SRCRASTER = 'source' + tif
+                lu.delete_data(path.join(coreDir,SRCRASTER))
+                if arcpy:
+                    statement = ('conRaster = '
+                                 'Con(Raster(cfg.CORERAS) == int(sourceCore), 1);'
+                                 'conRaster.save(SRCRASTER)')
+                else:
+                    expression = ("con(" + cfg.CORERAS + " == " +
+                                   str(int(sourceCore)) + ", 1)")
+                    statement = ('gp.SingleOutputMapAlgebra_sa'
+                                '(expression, SRCRASTER)')
 
-            try:
-                exec statement
-                randomerror()
-            except:
-                failures = lu.print_arcgis_failures(statement, failures)
-                if failures < 20:
-                    return None, failures, lcpLoop
-                else: exec statement
+                try:
+                    exec statement
+                    randomerror()
+                except:
+                    failures = lu.print_arcgis_failures(statement, failures)
+                    if failures < 20:
+                        return None, failures, lcpLoop
+                    else: exec statement
 
-            # Cost distance raster creation
-            if arcpy:
-                arcpy.env.extent = "MINOF"
-            else:
-                gp.Extent = "MINOF"
+                # Cost distance raster creation
+                if arcpy:
+                    arcpy.env.extent = "MINOF"
+                else:
+                    gp.Extent = "MINOF"
 
-            lu.delete_data(path.join(coreDir,"BACK"))
+                lu.delete_data(path.join(coreDir,"BACK"))
             
+                if arcpy:
+                    statement = ('outCostDist = CostDistance(SRCRASTER, '
+                                 'bResistance, cfg.TMAXCWDIST, back_rast);'
+                                 'outCostDist.save(outDistanceRaster)')
+                else:
+                    statement = ('gp.CostDistance_sa(SRCRASTER, bResistance, '
+                                 'outDistanceRaster, cfg.TMAXCWDIST, back_rast)')
+                try:
+                    exec statement
+                    randomerror()
+                except:
+                    failures = lu.print_arcgis_failures(statement, failures)
+                    if failures < 20:
+                        return None, failures, lcpLoop
+                    else:
+                        exec statement
+
+        start_time = time.clock()
+        # Extract cost distances from source core to target cores.  Pairs
+        # with lower-numbered cores were done when those cores were mapped.
+        if cfg.CALCENGINE == 'native':
+            # Float minimum cwd for every core in one pass over the arrays
+            coreMins = lm_cwd.zonal_minimum(cwdArray, coreZones)
+            floatMins = True
+        else:
+            ZNSTATS = path.join(coreDir, "zonestats.dbf")
+            lu.delete_data(ZNSTATS)
+            #Fixme: zonalstatistics is returning integer values for minimum.
+            #Why??? Extra zonalstatistics code implemented later in script to
+            #correct values.
             if arcpy:
-                statement = ('outCostDist = CostDistance(SRCRASTER, '
-                             'bResistance, cfg.TMAXCWDIST, back_rast);'
-                             'outCostDist.save(outDistanceRaster)')
+                statement = ('outZSaT = ZonalStatisticsAsTable(cfg.CORERAS, '
+                        '"VALUE", outDistanceRaster,ZNSTATS, "DATA", '
+                        '"MINIMUM")')
             else:
-                statement = ('gp.CostDistance_sa(SRCRASTER, bResistance, '
-                             'outDistanceRaster, cfg.TMAXCWDIST, back_rast)')
+                statement = ('gp.zonalstatisticsastable_sa('
+                          'cfg.CORERAS, "VALUE", outDistanceRaster, ZNSTATS)')
+
             try:
                 exec statement
                 randomerror()
             except:
                 failures = lu.print_arcgis_failures(statement, failures)
                 if failures < 20:
-                    return None, failures, lcpLoop
-                else:
-                    exec statement
-
-        start_time = time.clock()
-        # Extract cost distances from source core to target cores
-        # Fixme: there will be redundant calls to b-a when already
-        # done a-b
-        ZNSTATS = path.join(coreDir, "zonestats.dbf")
-        lu.delete_data(ZNSTATS)
-        #Fixme: zonalstatistics is returning integer values for minimum. Why???
-        #Extra zonalstatistics code implemented later in script to correct
-        #values.
-        if arcpy:
-            statement = ('outZSaT = ZonalStatisticsAsTable(cfg.CORERAS, '
-                    '"VALUE", outDistanceRaster,ZNSTATS, "DATA", "MINIMUM")')
-        else:
-            statement = ('gp.zonalstatisticsastable_sa('
-                      'cfg.CORERAS, "VALUE", outDistanceRaster, ZNSTATS)')
-                      
-        try:
-            exec statement
-            randomerror()
-        except:
-            failures = lu.print_arcgis_failures(statement, failures)
-            if failures < 20:
-                return None,failures,lcpLoop
-            else:
-                if cfg.TOOL == cfg.TOOL_CC:
-                    msg = ('ERROR in Zonal Stats. Please restart ArcMap '
-                        'and try again.')                
+                    return None,failures,lcpLoop
                 else:
-                    msg = ('ERROR in Zonal Stats. Restarting ArcMap '
-                        'then restarting Linkage Mapper at step 3 usually\n'
-                        'solves this one so please restart and try again.')
-
-                lu.raise_error(msg)
-        tableRows = gp.searchcursor(ZNSTATS)
-        tableRow = tableRows.Next()
-        while tableRow:
-            if tableRow.Value > sourceCore:
-                link = lu.get_links_from_core_pairs(linkTable,
-                                                    sourceCore,
-                                                    tableRow.Value)
-                if linkTable[link,cfg.LTB_LINKTYPE] > 0: # valid link
-                    linkTable[link,cfg.LTB_CWDIST] = tableRow.Min
-                    if cfg.MAXCOSTDIST is not None:
-                        if ((tableRow.Min > cfg.MAXCOSTDIST) and
-                           (linkTable[link,cfg.LTB_LINKTYPE] != cfg.LT_KEEP)):
-                             # Disable link, it's too long
-                            linkTable[link,cfg.LTB_LINKTYPE] = cfg.LT_TLLC
-                    if cfg.MINCOSTDIST is not None:
-                        if (tableRow.Min < cfg.MINCOSTDIST and
-                           (linkTable[link,cfg.LTB_LINKTYPE] != cfg.LT_KEEP)):
-                            # Disable link, it's too short
-                            linkTable[link,cfg.LTB_LINKTYPE] = cfg.LT_TSLC
-            tableRow = tableRows.next()
-        del tableRow, tableRows
+                    if cfg.TOOL == cfg.TOOL_CC:
+                        msg = ('ERROR in Zonal Stats. Please restart ArcMap '
+                            'and try again.')
+                    else:
+                        msg = ('ERROR in Zonal Stats. Restarting ArcMap '
+                            'then restarting Linkage Mapper at step 3 '
+                            'usually\nsolves this one so please restart and '
+                            'try again.')
+
+                    lu.raise_error(msg)
+            coreMins = {}
+            tableRows = gp.searchcursor(ZNSTATS)
+            tableRow = tableRows.Next()
+            while tableRow:
+                coreMins[tableRow.Value] = tableRow.Min
+                tableRow = tableRows.next()
+            del tableRow, tableRows
+            floatMins = False
+
+        linkRows = get_link_rows(linkTable)
+        set_link_cwds(linkTable, linkRows, sourceCore, coreMins)
         #start_time = lu.elapsed_time(start_time)
 
         # ---------------------------------------------------------
         # Check for intermediate cores AND map LCP lines
+        lcpLines = []
         for y in range(0,len(targetCores)):
             targetCore = targetCores[y]
-            rows = lu.get_links_from_core_pairs(linkTable, sourceCore,
-                                                targetCore)
             # Map all links for which we successfully extracted
             #  cwds in above code
-            link = rows[0]
-            if (linkTable[link,cfg.LTB_LINKTYPE] > 0 and
-                linkTable[link,cfg.LTB_LINKTYPE] < 1000 and
+            link = linkRows[(min(sourceCore, int(targetCore)),
+                             max(sourceCore, int(targetCore)))]
+            if (targetCore > sourceCore and
+                linkTable[link,cfg.LTB_LINKTYPE] > 0 and
                 linkTable[link,cfg.LTB_CWDIST] != -1):
-                # Flag so that we only evaluate this pair once
-                linkTable[rows,cfg.LTB_LINKTYPE] = (linkTable
-                                               [rows,cfg.LTB_LINKTYPE]
-                                               + 1000)
-
-                # Create raster that just has target core in it
-                TARGETRASTER = 'targ' + tif
-                lu.delete_data(path.join(coreDir,TARGETRASTER))
-                try:
-                    if arcpy:
-                        # For climate corridors, errors occur when core raster
-                        # overlaps null values in cwd rasters
-                        statement = ('conRaster = Con(IsNull(outDistanceRaster'
-                            '), Int(outDistanceRaster), Con(Raster'
-                            '(cfg.CORERAS) == int(targetCore), 1));'
-                            'conRaster.save(TARGETRASTER)') 
-                        # statement = ('conRaster = Con(Raster('
-                                    # 'cfg.CORERAS) == int(targetCore), 1);'
-                                    # 'conRaster.save(TARGETRASTER)')
-
-                    else:
-                        expression = ("con(" + cfg.CORERAS + " == " +
-                        str(int(targetCore)) + ",1)")
-                        statement = ('gp.SingleOutputMapAlgebra_sa(expression,'
-                                     ' TARGETRASTER)')
-                    exec statement
-                    randomerror()
-                except:
-                    failures = lu.print_arcgis_failures(statement, failures)
-                    if failures < 20:
-                        return None,failures,lcpLoop
-                    else: exec statement
-                # Execute ZonalStatistics to get more precise cw distance if
-                # arc rounded it earlier (not critical, hence the try/pass)
-                if (linkTable[link,cfg.LTB_CWDIST] ==
-                                int(linkTable[link,cfg.LTB_CWDIST])):
-                    try:
-                        zonalRas = path.join(coreDir,'zonal')
-                        gp.ZonalStatistics_sa(TARGETRASTER, "VALUE",
-                            outDistanceRaster, zonalRas, "MINIMUM", "DATA")
-                        minObject = gp.GetRasterProperties_management(zonalRas,
-                                                                "MINIMUM")
-                        rasterMin = float(str(minObject.getOutput(0)))
-                        linkTable[link,cfg.LTB_CWDIST] = rasterMin
-                        lu.delete_data(zonalRas)
-                    except:
-                        pass
-                # Cost path maps the least cost path
-                # between source and target
+                intCore = None
                 lcpRas = path.join(coreDir,"lcp" + tif)
-                lu.delete_data(lcpRas)
-
-                # Note: costpath (both gp and arcpy versions) uses GDAL.               
-                if arcpy:
-                    statement = ('outCostPath = CostPath(TARGETRASTER,'
-                          'outDistanceRaster, back_rast, "BEST_SINGLE", ""); '
-                          'outCostPath.save(lcpRas)')
+                if cfg.CALCENGINE == 'native':
+                    # Trace least cost path through back-link array.  No
+                    # ArcGIS calls, so nothing to retry.
+                    lcpCells, lcpLength = trace_lcp_native(cwdArray,
+                        backArray, coreZones, sourceCore, targetCore,
+                        winGrid[2])
                 else:
-                    statement = ('gp.CostPath_sa(TARGETRASTER, '
-                                 'outDistanceRaster, back_rast, '
-                                 'lcpRas, "BEST_SINGLE", "")')
-                try:
-                    exec statement                    
-                    randomerror()
-                except:
-                    failures = lu.print_arcgis_failures(statement, failures)
-                    if failures < 20:
-                        return None,failures,lcpLoop
-                    else:
-                        lu.dashline(1)
-                        gprint('\nCost path is failing for Link #'
-                           + str(int(link)) + ' connecting core areas ' +
-                            str(int(sourceCore)) + ' and ' +
-                            str(int(targetCore)) + '\n.'
-                            'Retrying one more time in 5 minutes.')
-                        lu.snooze(300)
-                        exec statement
-                
-                # fixme: may be fastest to not do selection, do
-                # EXTRACTBYMASK, getvaluelist, use code snippet at end
-                # of file to discard src and target values. Still this
-                # is fast- 13 sec for LI data...But I'm not very
-                # comfortable using failed coreMin as our test....
-                if (cfg.S3DROPLCCSic and
-                    (linkTable[link,cfg.LTB_LINKTYPE] != cfg.LT_KEEP) and
-                    (linkTable[link,cfg.LTB_LINKTYPE] != cfg.LT_KEEP + 1000)):
-                    # -------------------------------------------------
-                    # Drop links where lcp passes through intermediate
-                    # core area. Method below is faster than valuelist
-                    # method because of soma in valuelist method.
-                    # make a feature layer for input cores to select from
-                    gp.MakeFeatureLayer(cfg.COREFC, cfg.FCORES)
-
-                    gp.SelectLayerByAttribute(cfg.FCORES,
-                                              "NEW_SELECTION",
-                                              cfg.COREFN + ' <> ' +
-                                              str(int(targetCore)) +
-                                              ' AND ' + cfg.COREFN +
-                                              ' <> ' +
-                                              str(int(sourceCore)))
-
-                    corePairRas = path.join(coreDir,"s3corepair"+ tif)
-                    if arcpy:
-                        arcpy.env.extent = cfg.BOUNDRESIS
-                    else:
-                        gp.extent = gp.Describe(cfg.BOUNDRESIS).extent
-
-
-                    statement = ('gp.FeatureToRaster_conversion(cfg.FCORES, '
-                                'cfg.COREFN, corePairRas, gp.cellSize)')
+                    # Create raster that just has target core in it
+                    TARGETRASTER = 'targ' + tif
+                    lu.delete_data(path.join(coreDir,TARGETRASTER))
                     try:
+                        if arcpy:
+                            # For climate corridors, errors occur when core
+                            # raster overlaps null values in cwd rasters
+                            statement = ('conRaster = Con(IsNull('
+                                'outDistanceRaster), Int(outDistanceRaster), '
+                                'Con(Raster(cfg.CORERAS) == int(targetCore), '
+                                '1)); conRaster.save(TARGETRASTER)')
+                            # statement = ('conRaster = Con(Raster('
+                                    # 'cfg.CORERAS) == int(targetCore), 1);'
+                                    # 'conRaster.save(TARGETRASTER)')
+
+                        else:
+                            expression = ("con(" + cfg.CORERAS + " == " +
+                            str(int(targetCore)) + ",1)")
+                            statement = ('gp.SingleOutputMapAlgebra_sa('
+                                         'expression, TARGETRASTER)')
                         exec statement
                         randomerror()
                     except:
@@ -770,24 +976,123 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
                         if failures < 20:
                             return None,failures,lcpLoop
                         else: exec statement
-
-                    #------------------------------------------
-                    # Intermediate core test
+                    # Execute ZonalStatistics to get more precise cw distance
+                    # if arc rounded it earlier (not critical, hence the
+                    # try/pass)
+                    if (not floatMins and linkTable[link,cfg.LTB_CWDIST] ==
+                                    int(linkTable[link,cfg.LTB_CWDIST])):
+                        try:
+                            zonalRas = path.join(coreDir,'zonal')
+                            gp.ZonalStatistics_sa(TARGETRASTER, "VALUE",
+                                outDistanceRaster, zonalRas, "MINIMUM", "DATA")
+                            minObject = gp.GetRasterProperties_management(
+                                zonalRas, "MINIMUM")
+                            rasterMin = float(str(minObject.getOutput(0)))
+                            linkTable[link,cfg.LTB_CWDIST] = rasterMin
+                            lu.delete_data(zonalRas)
+                        except:
+                            pass
+                    # Cost path maps the least cost path
+                    # between source and target
+                    lu.delete_data(lcpRas)
+
+                    # Note: costpath (both gp and arcpy versions) uses GDAL.
+                    if arcpy:
+                        statement = ('outCostPath = CostPath(TARGETRASTER,'
+                              'outDistanceRaster, back_rast, "BEST_SINGLE", '
+                              '""); outCostPath.save(lcpRas)')
+                    else:
+                        statement = ('gp.CostPath_sa(TARGETRASTER, '
+                                     'outDistanceRaster, back_rast, '
+                                     'lcpRas, "BEST_SINGLE", "")')
                     try:
-                        coreDetected = test_for_intermediate_core(coreDir,
-                                                lcpRas, corePairRas)
+                        exec statement
                         randomerror()
                     except:
-                        statement = 'test_for_intermediate_core'
                         failures = lu.print_arcgis_failures(statement,
                                                             failures)
                         if failures < 20:
                             return None,failures,lcpLoop
                         else:
+                            lu.dashline(1)
+                            gprint('\nCost path is failing for Link #'
+                               + str(int(linkTable[link,cfg.LTB_LINKID])) +
+                               ' connecting core areas ' +
+                                str(int(sourceCore)) + ' and ' +
+                                str(int(targetCore)) + '\n.'
+                                'Retrying one more time in 5 minutes.')
+                            lu.snooze(300)
+                            exec statement
+                
+                # fixme: may be fastest to not do selection, do
+                # EXTRACTBYMASK, getvaluelist, use code snippet at end
+                # of file to discard src and target values. Still this
+                # is fast- 13 sec for LI data...But I'm not very
+                # comfortable using failed coreMin as our test....
+                if (cfg.S3DROPLCCSic and
+                    (linkTable[link,cfg.LTB_LINKTYPE] != cfg.LT_KEEP)):
+                    if cfg.TOOL <> cfg.TOOL_CC and arcpy:
+                        # Look up core IDs along the path cells
+                        if cfg.CALCENGINE <> 'native':
+                            lcpCells = get_lcp_cells(lcpRas, window)
+                        intCore = lm_cwd.first_intruding_zone(lcpCells,
+                            coreZones, [sourceCore, targetCore])
+                        coreDetected = intCore is not None
+                    else:
+                        # -------------------------------------------------
+                        # Drop links where lcp passes through intermediate
+                        # core area. Method below is faster than valuelist
+                        # method because of soma in valuelist method.
+                        # make a feature layer for input cores to select from
+                        gp.MakeFeatureLayer(cfg.COREFC, cfg.FCORES)
+
+                        gp.SelectLayerByAttribute(cfg.FCORES,
+                                                  "NEW_SELECTION",
+                                                  cfg.COREFN + ' <> ' +
+                                                  str(int(targetCore)) +
+                                                  ' AND ' + cfg.COREFN +
+                                                  ' <> ' +
+                                                  str(int(sourceCore)))
+
+                        corePairRas = path.join(coreDir,"s3corepair"+ tif)
+                        if arcpy:
+                            arcpy.env.extent = cfg.BOUNDRESIS
+                        else:
+                            gp.extent = gp.Describe(cfg.BOUNDRESIS).extent
+
+
+                        statement = ('gp.FeatureToRaster_conversion('
+                                     'cfg.FCORES, cfg.COREFN, corePairRas, '
+                                     'gp.cellSize)')
+                        try:
+                            exec statement
+                            randomerror()
+                        except:
+                            failures = lu.print_arcgis_failures(statement,
+                                                                failures)
+                            if failures < 20:
+                                return None,failures,lcpLoop
+                            else: exec statement
+
+                        #------------------------------------------
+                        # Intermediate core test
+                        try:
                             coreDetected = test_for_intermediate_core(
-                                        coreDir, lcpRas, corePairRas)
+                                            coreDir, lcpRas, corePairRas)
+                            randomerror()
+                        except:
+                            statement = 'test_for_intermediate_core'
+                            failures = lu.print_arcgis_failures(statement,
+                                                                failures)
+                            if failures < 20:
+                                return None,failures,lcpLoop
+                            else:
+                                coreDetected = test_for_intermediate_core(
+                                            coreDir, lcpRas, corePairRas)
 
                     if coreDetected:
+                        if intCore is None:
+                            intCore = -1  # Found by raster test, ID unknown
                         # lu.dashline()
                         gprint(
                             "Found an intermediate core in the "
@@ -796,17 +1101,29 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
                             str(int(targetCore)) + ".  The corridor "
                             "will be removed.")
                         # disable link
-                        rows = lu.get_links_from_core_pairs(linkTable,
-                                                    sourceCore,
-                                                    targetCore)
-                        linkTable[rows,cfg.LTB_LINKTYPE] = cfg.LT_INT
+                        linkTable[link,cfg.LTB_LINKTYPE] = cfg.LT_INT
                     #------------------------------------------
 
                 # Create lcp shapefile.  lcploop just keeps track of
                 # whether this is first time function is called.
-                lcpLoop = lu.create_lcp_shapefile(coreDir, linkTable,
-                                                  sourceCore, targetCore,
-                                                  lcpLoop)
+                if cfg.CALCENGINE == 'native':
+                    # Traced paths are written together below
+                    lcpVerts = lm_cwd.path_vertices(lcpCells, winGrid)
+                    lcpLines.append((link, sourceCore, targetCore, lcpVerts,
+                                     lcpLength))
+                    pairs.put(sourceCore, targetCore, lcpLength=lcpLength,
+                              lcpVerts=lcpVerts)
+                else:
+                    lcpLoop = lu.create_lcp_shapefile(coreDir, linkTable,
+                                                      sourceCore, targetCore,
+                                                      lcpLoop, lcpShapefile)
+                pairs.put(sourceCore, targetCore, intCore=intCore)
+
+        if lcpLines:
+            if lcpShapefile is None:
+                lcpShapefile = path.join(cfg.DATAPASSDIR, "lcpLines_s3.shp")
+            lcpLoop = lu.write_lcp_lines(lcpLines, linkTable, lcpShapefile,
+                                         lcpLoop)
 
         # Made it through, so reset failure count and return.
         failures = 0
@@ -828,6 +1145,183 @@ def do_cwd_calcs(x, linkTable, coresToMap, lcpLoop, failures):
         lu.exit_with_python_error(_SCRIPT_NAME)
 
 
+def get_link_rows(linkTable):
+    """Returns {(corex, corey): link table row}, lower core ID first"""
+    corePairs = npy.sort(linkTable[:, cfg.LTB_CORE1:cfg.LTB_CORE2 + 1],
+                         axis=1).astype('int32').tolist()
+    linkRows = {}
+    for row in range(len(corePairs) - 1, -1, -1):  # First row wins
+        linkRows[tuple(corePairs[row])] = row
+    return linkRows
+
+
+def set_link_cwds(linkTable, linkRows, sourceCore, coreMins):
+    """Sets cwds of valid links from sourceCore to higher-numbered cores.
+
+    coreMins holds minimum cwds by core ID.  Links beyond the cost distance
+    limits are disabled unless they are kept links.
+
+    """
+    rows = []
+    mins = []
+    for core, coreMin in coreMins.items():
+        if core > sourceCore and (sourceCore, core) in linkRows:
+            rows.append(linkRows[(sourceCore, core)])
+            mins.append(coreMin)
+    rows = npy.array(rows, dtype='int32')
+    mins = npy.array(mins, dtype='float64')
+    valid = linkTable[rows, cfg.LTB_LINKTYPE] > 0
+    rows = rows[valid]
+    mins = mins[valid]
+    linkTable[rows, cfg.LTB_CWDIST] = mins
+    notKept = linkTable[rows, cfg.LTB_LINKTYPE] != cfg.LT_KEEP
+    if cfg.MAXCOSTDIST is not None:
+        # Disable links that are too long
+        linkTable[rows[notKept & (mins > cfg.MAXCOSTDIST)],
+                  cfg.LTB_LINKTYPE] = cfg.LT_TLLC
+    if cfg.MINCOSTDIST is not None:
+        # Disable links that are too short
+        linkTable[rows[notKept & (mins < cfg.MINCOSTDIST)],
+                  cfg.LTB_LINKTYPE] = cfg.LT_TSLC
+
+
+def read_core_zones(grid):
+    """Returns core area IDs of cells on grid, 0 outside cores"""
+    coreArray = lu.raster_to_array(cfg.CORERAS, grid, dtype='float32')
+    return npy.where(npy.isnan(coreArray), 0, coreArray).astype('int32')
+
+
+def get_core_window(sourceCore, targetCores):
+    """Returns array window and mask covering the bounding circles of a
+    core's links.
+
+    Falls back on the whole grid, unmasked, if no circle touches it.
+
+    """
+    circles = cfg.BNDCIRCLES
+    selected = npy.zeros(len(circles), dtype='bool')
+    for targetCore in targetCores:
+        corex = min(sourceCore, targetCore)
+        corey = max(sourceCore, targetCore)
+        selected |= (circles[:, 2] == corex) & (circles[:, 3] == corey)
+    # Circle rows are x, y, corex, corey, radius
+    window, bndMask = lm_raster.disk_mask(circles[selected][:, [0, 1, 4]],
+                                          cfg.BNDGRID)
+    if window is None:
+        return lm_raster.full_window(cfg.BNDGRID), None
+    return window, bndMask
+
+
+def calc_cwd_native(sourceCore, targetCores, window, bndMask, coreZones,
+                    outDistanceRaster, backRaster):
+    """Writes cwd and back-link rasters for a core using the numpy engine
+    and returns the cwd and back-link arrays.
+
+    Only cells in window are read, and of those only cells in bndMask if
+    given are used.  coreZones holds core IDs over the window.  With
+    STOPATTARGETS, spreading stops once all target cores are reached and
+    cells are farther than the farthest target plus the cutoff from
+    get_target_cutoff.
+
+    With a cwd store, the cwd window goes to the store and no rasters are
+    written, since LCPs are traced from the arrays.
+
+    """
+    winGrid = lm_raster.window_grid(cfg.BNDGRID, window)
+    resistance = lu.raster_to_array(cfg.BOUNDRESIS, winGrid, dtype='float32')
+    if bndMask is not None:
+        resistance[~bndMask] = npy.nan
+    sources = coreZones == int(sourceCore)
+    targets = None
+    cutoff = 0
+    if cfg.STOPATTARGETS:
+        targets = npy.zeros(coreZones.shape, dtype='int32')
+        for targetCore in targetCores:
+            targetCells = coreZones == int(targetCore)
+            targets[targetCells] = int(targetCore)
+        cutoff = get_target_cutoff()
+    cwd, back = lm_cwd.cost_distance(resistance, sources, winGrid[2],
+                                     cfg.TMAXCWDIST, targets, cutoff)
+    if cwdStore is not None:
+        cwdStore.put(sourceCore, window, cwd)
+    else:
+        lu.array_to_raster(cwd, winGrid, outDistanceRaster)
+        lu.array_to_raster(back, winGrid, backRaster)
+    return cwd, back
+
+
+def check_stop_at_targets():
+    """Checks that native cwd calcs can stop at target cores.
+
+    Stopping leaves out cells past the cutoff, so it is only allowed when
+    corridors are truncated.  Otherwise STOPATTARGETS is turned off with
+    a warning.  Also warns when a step 6 or step 8 cutoff is bigger than
+    CWDTHRESH, since that cutoff is used instead.
+
+    """
+    if not cfg.WRITETRUNCRASTER or cfg.CWDTHRESH is None:
+        lu.warn('STOPATTARGETS only works with a truncated corridor raster '
+                '(WRITETRUNCRASTER and CWDTHRESH).\nMapping cost-weighted '
+                'distances without stopping at target cores.')
+        cfg.STOPATTARGETS = False
+        return
+    cutoff = get_target_cutoff()
+    if cutoff > cfg.CWDTHRESH:
+        lu.warn('A later step uses a cwd cutoff of ' + str(cutoff) +
+                ', more than CWDTHRESH.\nStopping cost-weighted distance '
+                'calcs at the farthest target core plus ' + str(cutoff) +
+                ' instead.')
+
+
+def get_target_cutoff():
+    """Returns how far past the farthest target core native cwd calcs go
+    with STOPATTARGETS.
+
+    This is the largest of CWDTHRESH, the step 6 barrier cwd cutoff and
+    the step 8 pinch point cwd cutoff, of those that are set.
+
+    """
+    cutoffs = [float(cfg.CWDTHRESH)]
+    for name in ['BARRIER_CWD_THRESH', 'CWDCUTOFF']:
+        cutoff = getattr(cfg, name, None)
+        if cutoff:
+            cutoffs.append(abs(float(cutoff)))
+    return max(cutoffs)
+
+
+def trace_lcp_native(cwdArray, backArray, coreZones, sourceCore, targetCore,
+                     cellSize):
+    """Traces least cost path from target core back to the source core.
+
+    Returns path cells and path length in map units.
+
+    """
+    targets = coreZones == int(targetCore)
+    startCell = lm_cwd.best_start_cell(cwdArray, targets)
+    if startCell is None:
+        msg = ('ERROR: No cells in core area #' + str(int(targetCore)) +
+               ' were reached from core area #' + str(int(sourceCore)) +
+               ', so no least-cost path could be traced between them.')
+        lu.raise_error(msg)
+    return lm_cwd.trace_path(backArray, startCell, cellSize)
+
+
+def get_lcp_cells(lcpRas, window):
+    """Returns (row, col) within window of least cost path raster cells.
+
+    Only the part of window covered by the LCP raster is read.
+
+    """
+    lcpWindow = lm_raster.intersect_windows(window, lm_raster.grid_window(
+        lu.get_raster_grid(lcpRas), cfg.BNDGRID))
+    if lcpWindow is None:
+        return npy.zeros((0, 2), dtype='int64')
+    lcpArray = lu.raster_to_array(lcpRas, lm_raster.window_grid(cfg.BNDGRID,
+                                  lcpWindow), dtype='float32')
+    cells = npy.transpose(npy.nonzero(npy.isfinite(lcpArray)))
+    return cells + [lcpWindow[0] - window[0], lcpWindow[2] - window[2]]
+
+
 def test_for_intermediate_core(workspace,lcpRas,corePairRas):
     """ Test if there is an intermediate core by seeing if least-cost
         path and remaining cores intersect
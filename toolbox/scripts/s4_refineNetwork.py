@@ -75,21 +75,11 @@ def STEP4_refine_network():
                           str(cfg.S4MAXNN) + ' nearest neighbors.')
 
         # Code written assuming NO duplicate core pairs
-        for core in coresToProcess:
-            rows,cols = npy.where(
-                corridorLinks[:,cfg.LTB_CORE1:cfg.LTB_CORE2+1] == core)
-            distsFromCore = corridorLinks[rows,:]
-
-            # Sort by distance from target core
-            ind = npy.argsort(distsFromCore[:,distCol])
-            distsFromCore = distsFromCore[ind]
-
-            # Set N nearest neighbor connections to Nearest Neighbor (NNCT)
-            maxRange = min(len(rows), cfg.S4MAXNN)
-            for link in range (0, maxRange):
-                linkId = distsFromCore[link, cfg.LTB_LINKID]
-                # assumes linktable sequentially numbered with no gaps
-                linkTable[linkId - 1, cfg.LTB_LINKTYPE] = cfg.LT_NNCT
+        # Set N nearest neighbor connections to Nearest Neighbor (NNCT)
+        rows = get_nearest_links(corridorLinks, distCol, cfg.S4MAXNN)
+        linkIds = corridorLinks[rows, cfg.LTB_LINKID].astype('int32')
+        # assumes linktable sequentially numbered with no gaps
+        linkTable[linkIds - 1, cfg.LTB_LINKTYPE] = cfg.LT_NNCT
 
         # Connect constellations (aka compoments or clusters)
         # Fixme: needs testing.  Move to function.
@@ -105,15 +95,10 @@ def STEP4_refine_network():
             del compCols
 
             # renumber cores to save memory for this next step.  Place in
-            # columns 10 and 11
-            for coreInd in range(0, len(coresToProcess)):
-                # here, cols are 0 for cfg.LTB_CORE1 and 1 for cfg.LTB_CORE2
-                rows, cols = npy.where(
-                    linkTableComp[:,cfg.LTB_CORE1:cfg.LTB_CORE2+1] ==
-                    coresToProcess[coreInd])
-                # want results in cols 10 and 11- These are NEW core numbers
-                # (0 - numcores)
-                linkTableComp[rows, cols + 10] = coreInd
+            # columns 10 and 11.  These are NEW core numbers (0 - numcores),
+            # left at 0 for cores of links that aren't corridors.
+            linkTableComp[:, 10:12] = get_core_indexes(
+                coresToProcess, linkTableComp[:,cfg.LTB_CORE1:cfg.LTB_CORE2+1])
 
             rows, cols = npy.where(
                 linkTableComp[:, cfg.LTB_LINKTYPE:cfg.LTB_LINKTYPE + 1] ==
@@ -123,29 +108,17 @@ def STEP4_refine_network():
             # These are NEW core numbers (range from 0 to numcores)
             coresToProcess = npy.unique(linkTableComp[:, 10:12])
 
-            #Create graph describing connected cores.
-            Graph = npy.zeros((len(coresToProcess), len(coresToProcess)),
-                          dtype="int32")
+            # Use NN links (graph edges) to identify components (disconnected
+            # sub-groups) in core area network
             rows = corridorLinksComp[:,10].astype('int32')
             cols = corridorLinksComp[:,11].astype('int32')
-            vals = npy.where(corridorLinksComp[:,cfg.LTB_LINKTYPE] ==
-                         cfg.LT_NNCT, cfg.LT_CORR, 0)
-
-            Graph[rows,cols] = vals
-            Graph = Graph + Graph.T
-
-            # Use graph to identify components (disconnected sub-groups) in
-            # core area network
-            components = lu.components_no_sparse(Graph)
-
-            for coreInd in range(0,len(coresToProcess)):
-                # In resulting cols, cols are 0 for LTB_CORE1 and 1 for
-                # LTB_CORE2
-                rows, cols = (npy.where(linkTableComp[:,10:12] ==
-                              coresToProcess[coreInd]))
-                # want results in cols 12 and 13  Note: we've replaced new core
-                # numbers with COMPONENT numbers.
-                linkTableComp[rows,cols+12] = components[coreInd]
+            components = lu.components_from_edges(len(coresToProcess), rows,
+                                                  cols)
+
+            # want results in cols 12 and 13  Note: we've replaced new core
+            # numbers with COMPONENT numbers.
+            coreInds = get_core_indexes(coresToProcess, linkTableComp[:,10:12])
+            linkTableComp[:,12:14] = components[coreInds]
             # Additional column indexes for linkTableComp
             component1Col = 12
             component2Col = 13
@@ -158,24 +131,10 @@ def STEP4_refine_network():
 
             # Connect constellations via shortest inter-constellation links,
             # until all constellations connected.
-            for row in range(0,numLinks):
-                if ((linkTableComp[row,distCol] > 0) and
-                    ((linkTableComp[row,cfg.LTB_LINKTYPE] == cfg.LT_CORR) or
-                    (linkTableComp[row,cfg.LTB_LINKTYPE] == cfg.LT_KEEP)) and
-                    (linkTableComp[row,component1Col] !=
-                     linkTableComp[row,component2Col])):
-                    # Make this an inter-component link
-                    linkTableComp[row,cfg.LTB_LINKTYPE] = cfg.LT_CLU
-                    newComp = min(linkTableComp
-                                  [row,component1Col:component2Col + 1])
-                    oldComp = max(linkTableComp
-                                  [row,component1Col:component2Col + 1])
-                    # cols are 0 and 1
-                    rows, cols = npy.where(linkTableComp
-                                       [:,component1Col:component2Col + 1]
-                                       == oldComp)
-                    # want results in cols 12 and 13
-                    linkTableComp[rows,cols + 12] = newComp
+            cluRows = get_component_links(linkTableComp, distCol,
+                                          component1Col, component2Col)
+            # Make these inter-component links
+            linkTableComp[cluRows,cfg.LTB_LINKTYPE] = cfg.LT_CLU
 
             # Remove extra columns from link table
             linkTable = lu.delete_col(linkTableComp,[10, 11, 12, 13])
@@ -223,4 +182,70 @@ def STEP4_refine_network():
         gprint('****Failed in step 4. Details follow.****')
         lu.exit_with_python_error(_SCRIPT_NAME)
 
-    return
\ No newline at end of file
+    return
+
+
+def get_nearest_links(links, distCol, maxNN):
+    """Returns rows of links that are among each core's maxNN shortest.
+
+    Each link is listed once for each of its cores, and the list is sorted
+    by core then distance in one lexsort.  A link's rank for a core is its
+    place within that core's run.  Ties go to the link earlier in links.
+
+    """
+    numLinks = links.shape[0]
+    cores = npy.concatenate((links[:, cfg.LTB_CORE1], links[:, cfg.LTB_CORE2]))
+    dists = npy.concatenate((links[:, distCol], links[:, distCol]))
+    rows = npy.concatenate((npy.arange(numLinks), npy.arange(numLinks)))
+    ind = npy.lexsort((rows, dists, cores))
+    cores = cores[ind]
+    rows = rows[ind]
+
+    # Rank is position less the position where the core's run starts
+    positions = npy.arange(len(cores))
+    runStarts = npy.zeros(len(cores), dtype=positions.dtype)
+    if len(cores) > 0:
+        newCore = npy.ones(len(cores), dtype='bool')
+        newCore[1:] = cores[1:] != cores[:-1]
+        runStarts[newCore] = positions[newCore]
+        runStarts = npy.maximum.accumulate(runStarts)
+    return npy.unique(rows[positions - runStarts < maxNN])
+
+
+def get_core_indexes(cores, coreCols):
+    """Returns index of each core in coreCols within sorted array cores.
+
+    Cores that aren't in cores get 0.
+
+    """
+    ind = npy.searchsorted(cores, coreCols)
+    ind[ind == len(cores)] = 0
+    ind[cores[ind] != coreCols] = 0
+    return ind
+
+
+def get_component_links(links, distCol, comp1Col, comp2Col):
+    """Returns rows of the links that connect components, shortest first.
+
+    links is sorted by distance, with component IDs of the cores each link
+    connects in comp1Col and comp2Col.  Corridor and kept links with a
+    distance are taken in order when they join two constellations not
+    connected yet (Kruskal's algorithm, with union-find sets of
+    components).
+
+    """
+    linkTypes = links[:, cfg.LTB_LINKTYPE]
+    rows = npy.where((links[:, distCol] > 0) &
+                     ((linkTypes == cfg.LT_CORR) |
+                      (linkTypes == cfg.LT_KEEP)) &
+                     (links[:, comp1Col] != links[:, comp2Col]))[0]
+    parent = {}
+    for comp in npy.unique(links[:, [comp1Col, comp2Col]]).tolist():
+        parent[int(comp)] = int(comp)
+    comps1 = links[rows, comp1Col].astype('int32').tolist()
+    comps2 = links[rows, comp2Col].astype('int32').tolist()
+    cluRows = []
+    for x in range(len(rows)):
+        if lu.join_sets(parent, comps1[x], comps2[x]):
+            cluRows.append(rows[x])
+    return cluRows
@@ -8,16 +8,25 @@ pairs specified in linkTable and cwd layers
 
 """
 
+import math
 import os.path as path
 import time
+import traceback
 
 import numpy as npy
 
 from lm_config import tool_env as cfg
 import lm_util as lu
+import lm_cwdstore
+import lm_pairs
+import lm_raster
 
 _SCRIPT_NAME = "s5_calcLccs.py"
 
+# Set in worker processes by init_mosaic_worker
+workerStore = None
+workerGroups = None
+
 # try:
     # import arcpy
     # gp = arcpy.gp
@@ -122,6 +131,7 @@ def calc_lccs(normalize):
             gp.snapraster = cfg.RESRAST
 
         linkTable = lu.load_link_table(linkTableFile)
+        cwdStore = lm_cwdstore.load_cwd_store()
         numLinks = linkTable.shape[0]
         numCorridorLinks = lu.report_links(linkTable)
         if numCorridorLinks == 0:
@@ -165,13 +175,31 @@ def calc_lccs(normalize):
         coreList = linkTable[:,cfg.LTB_CORE1:cfg.LTB_CORE2+1]
         coreList = npy.sort(coreList)
 
+        # With cwds kept by native step 3, corridors are mosaicked in memory
+        if cwdStore is not None and arcpyAvailable:
+            gprint('Mosaicking corridors in memory.\n')
+            mosaicArray = npy.empty(cwdStore.grid[3:5], dtype='float32')
+            mosaicArray.fill(npy.inf)
+        else:
+            mosaicArray = None
+        # Links are queued and mosaicked by workers once all are known
+        if (mosaicArray is not None and cfg.NUMWORKERS > 1 and
+            not SAVENORMLCCS):
+            corridorJobs = []
+        else:
+            corridorJobs = None
+
         x = 0
         linkCount = 0
         endIndex = numLinks
+        mosaicked = lm_pairs.PairStore()  # Don't mosaic core pairs twice
         while x < endIndex:
             if (linkTable[x, cfg.LTB_LINKTYPE] < 1): # If not a valid link
                 x = x + 1
                 continue
+            if mosaicked.has(coreList[x, 0], coreList[x, 1]):
+                x = x + 1
+                continue
                 
             linkCount = linkCount + 1
             start_time = time.clock() 
@@ -182,135 +210,153 @@ def calc_lccs(normalize):
             corex=int(coreList[x,0])
             corey=int(coreList[x,1])
 
-            # Get cwd rasters for source and target cores
-            cwdRaster1 = lu.get_cwd_path(corex)
-            cwdRaster2 = lu.get_cwd_path(corey)
-
-            if not gp.Exists(cwdRaster1):
-                msg =('\nError: cannot find cwd raster:\n' + cwdRaster1) 
-            if not gp.Exists(cwdRaster2):
-                msg =('\nError: cannot find cwd raster:\n' + cwdRaster2) 
-                lu.raise_error(msg)
-
-            
-            lccNormRaster = path.join(clccdir, str(corex) + "_" +
-                                      str(corey))# + ".tif")
-            if cfg.useArcpy: 
-                arcpy.env.Extent = "MINOF"
-            else:
-                gp.Extent = "MINOF"
-
-            # FIXME: need to check for this?:
-            # if exists already, don't re-create
-            #if not gp.Exists(lccRaster):
-
             link = lu.get_links_from_core_pairs(linkTable, corex, corey)
 
-            offset = 10000 
+            offset = 10000
 
-            # Normalized lcc rasters are created by adding cwd rasters and
-            # subtracting the least cost distance between them.
-            count = 0
-            if arcpyAvailable:
-                cfg.useArcpy = True # Fixes Canran Liu's bug with lcDist
-            if cfg.useArcpy:
-                
-                lcDist = (float(linkTable[link,cfg.LTB_CWDIST]) - offset) 
-                
+            if mosaicArray is not None:
                 if normalize:
-                    statement = ('outras = Raster(cwdRaster1) + Raster('
-                        'cwdRaster2) - lcDist; outras.save(lccNormRaster)') 
-                                                
+                    lcDist = float(linkTable[link,cfg.LTB_CWDIST]) - offset
                 else:
-                    statement = ('outras =Raster(cwdRaster1) + Raster('
-                                'cwdRaster2); outras.save(lccNormRaster)')
-            else:
-                if normalize:
-                    lcDist = str(linkTable[link,cfg.LTB_CWDIST] - offset)  
-                    expression = (cwdRaster1 + " + " + cwdRaster2 + " - " 
-                                  + lcDist)
+                    lcDist = None
+                if SAVENORMLCCS:
+                    lccNormRaster = path.join(clccdir, str(corex) + "_" +
+                                              str(corey))
                 else:
-                    expression = (cwdRaster1 + " + " + cwdRaster2) 
-                statement = ('gp.SingleOutputMapAlgebra_sa(expression, '
-                     'lccNormRaster)')
-            count = 0
-            while True:
-                try: 
-                    exec statement                    
-                    randomerror()
-                except:
-                    count,tryAgain = lu.retry_arc_error(count,statement)
-                    if not tryAgain:    
-                        exec statement
-                else: break
-            cfg.useArcpy = False # End fix for Conran Liu's bug with lcDist
-            
-            if normalize and cfg.useArcpy: 
-                try: 
-                    minObject = gp.GetRasterProperties(lccNormRaster, "MINIMUM") 
-                    rasterMin = float(str(minObject.getoutput(0)))
-                except:
-                    lu.warn('\n------------------------------------------------')
-                    lu.warn('WARNING: Raster minimum check failed in step 5. \n'
-                        'This may mean the output rasters are corrupted. Please \n'
-                        'be sure to check for valid rasters in '+ outputGDB)
-                    rasterMin = 0
-                if rasterMin < tolerance:
-                    lu.dashline(1)
-                    msg = ('WARNING: Minimum value of a corridor #' + str(x+1) 
-                           + ' is much less than zero ('+str(rasterMin)+').'
-                           '\nThis could mean that BOUNDING CIRCLE BUFFER DISTANCES '
-                           'were too small and a corridor passed outside of a '
-                           'bounding circle, or that a corridor passed outside of the '
-                           'resistance map. \n')
-                    lu.warn(msg)
+                    lccNormRaster = None
+                if corridorJobs is not None:
+                    corridorJobs.append((corex, corey, lcDist))
+                else:
+                    mosaic_corridor(mosaicArray, cwdStore, corex, corey,
+                                    lcDist, lccNormRaster)
+            else:
+                # Get cwd rasters for source and target cores
+                cwdRaster1 = lm_cwdstore.get_cwd_raster(cwdStore, corex)
+                cwdRaster2 = lm_cwdstore.get_cwd_raster(cwdStore, corey)
+
+                if not gp.Exists(cwdRaster1):
+                    msg =('\nError: cannot find cwd raster:\n' + cwdRaster1) 
+                if not gp.Exists(cwdRaster2):
+                    msg =('\nError: cannot find cwd raster:\n' + cwdRaster2) 
+                    lu.raise_error(msg)
 
             
-            if cfg.useArcpy: 
-                arcpy.env.Extent = cfg.RESRAST
-            else:
-                gp.Extent = (gp.Describe(cfg.RESRAST)).Extent
+                lccNormRaster = path.join(clccdir, str(corex) + "_" +
+                                          str(corey))# + ".tif")
+                if cfg.useArcpy: 
+                    arcpy.env.Extent = "MINOF"
+                else:
+                    gp.Extent = "MINOF"
 
-            mosaicDir = path.join(cfg.LCCBASEDIR,'mos'+str(x+1))  
-            lu.create_dir(mosaicDir) 
-            mosFN = 'mos'#.tif' change and move
-            mosaicRaster = path.join(mosaicDir,mosFN) 
-                       
-            if numGridsWritten == 0 and dirCount == 0:
-                #If this is the first grid then copy rather than mosaic
-                arcObj.CopyRaster_management(lccNormRaster, mosaicRaster) 
-            else:
+                # FIXME: need to check for this?:
+                # if exists already, don't re-create
+                #if not gp.Exists(lccRaster):
+
+                # Normalized lcc rasters are created by adding cwd rasters and
+                # subtracting the least cost distance between them.
+                count = 0
+                if arcpyAvailable:
+                    cfg.useArcpy = True # Fixes Canran Liu's bug with lcDist
+                if cfg.useArcpy:
                 
-                rasterString = '"'+lccNormRaster+";"+lastMosaicRaster+'"'
-                statement = ('arcObj.MosaicToNewRaster_management('
-                            'rasterString,mosaicDir,mosFN, "", '
-                            '"32_BIT_FLOAT", gp.cellSize, "1", "MINIMUM", '
-                            '"MATCH")') 
-                # statement = ('arcpy.Mosaic_management(lccNormRaster, '
-                                 # 'mosaicRaster, "MINIMUM", "MATCH")') 
+                    lcDist = (float(linkTable[link,cfg.LTB_CWDIST]) - offset)
                 
+                    if normalize:
+                        statement = ('outras = Raster(cwdRaster1) + Raster('
+                            'cwdRaster2) - lcDist; outras.save(lccNormRaster)') 
+                                                
+                    else:
+                        statement = ('outras =Raster(cwdRaster1) + Raster('
+                                    'cwdRaster2); outras.save(lccNormRaster)')
+                else:
+                    if normalize:
+                        lcDist = str(linkTable[link,cfg.LTB_CWDIST] - offset)
+                        expression = (cwdRaster1 + " + " + cwdRaster2 + " - " 
+                                      + lcDist)
+                    else:
+                        expression = (cwdRaster1 + " + " + cwdRaster2) 
+                    statement = ('gp.SingleOutputMapAlgebra_sa(expression, '
+                         'lccNormRaster)')
                 count = 0
                 while True:
-                    try:
-                        lu.write_log('Executing mosaic for link #'+str(linkId))
-                        exec statement
-                        lu.write_log('Done with mosaic.')
+                    try: 
+                        exec statement                    
                         randomerror()
                     except:
                         count,tryAgain = lu.retry_arc_error(count,statement)
-                        lu.delete_data(mosaicRaster)
-                        lu.delete_dir(mosaicDir)
-                        # Try a new directory
-                        mosaicDir = path.join(cfg.LCCBASEDIR,'mos'+str(x+1)+ '_' + str(count))
-                        lu.create_dir(mosaicDir)
-                        mosaicRaster = path.join(mosaicDir,mosFN)                        
                         if not tryAgain:    
                             exec statement
                     else: break
+                cfg.useArcpy = False # End fix for Conran Liu's bug with lcDist
+            
+                if normalize and cfg.useArcpy: 
+                    try: 
+                        minObject = gp.GetRasterProperties(lccNormRaster, "MINIMUM") 
+                        rasterMin = float(str(minObject.getoutput(0)))
+                    except:
+                        lu.warn('\n------------------------------------------------')
+                        lu.warn('WARNING: Raster minimum check failed in step 5. \n'
+                            'This may mean the output rasters are corrupted. Please \n'
+                            'be sure to check for valid rasters in '+ outputGDB)
+                        rasterMin = 0
+                    if rasterMin < tolerance:
+                        lu.dashline(1)
+                        msg = ('WARNING: Minimum value of a corridor #' + str(x+1) 
+                               + ' is much less than zero ('+str(rasterMin)+').'
+                               '\nThis could mean that BOUNDING CIRCLE BUFFER DISTANCES '
+                               'were too small and a corridor passed outside of a '
+                               'bounding circle, or that a corridor passed outside of the '
+                               'resistance map. \n')
+                        lu.warn(msg)
+
+            
+                if cfg.useArcpy: 
+                    arcpy.env.Extent = cfg.RESRAST
+                else:
+                    gp.Extent = (gp.Describe(cfg.RESRAST)).Extent
+
+                mosaicDir = path.join(cfg.LCCBASEDIR,'mos'+str(x+1))  
+                lu.create_dir(mosaicDir) 
+                mosFN = 'mos'#.tif' change and move
+                mosaicRaster = path.join(mosaicDir,mosFN) 
+                       
+                if numGridsWritten == 0 and dirCount == 0:
+                    #If this is the first grid then copy rather than mosaic
+                    arcObj.CopyRaster_management(lccNormRaster, mosaicRaster) 
+                else:
+                
+                    rasterString = '"'+lccNormRaster+";"+lastMosaicRaster+'"'
+                    statement = ('arcObj.MosaicToNewRaster_management('
+                                'rasterString,mosaicDir,mosFN, "", '
+                                '"32_BIT_FLOAT", gp.cellSize, "1", "MINIMUM", '
+                                '"MATCH")') 
+                    # statement = ('arcpy.Mosaic_management(lccNormRaster, '
+                                     # 'mosaicRaster, "MINIMUM", "MATCH")') 
+                
+                    count = 0
+                    while True:
+                        try:
+                            lu.write_log('Executing mosaic for link #'+str(linkId))
+                            exec statement
+                            lu.write_log('Done with mosaic.')
+                            randomerror()
+                        except:
+                            count,tryAgain = lu.retry_arc_error(count,statement)
+                            lu.delete_data(mosaicRaster)
+                            lu.delete_dir(mosaicDir)
+                            # Try a new directory
+                            mosaicDir = path.join(cfg.LCCBASEDIR,'mos'+str(x+1)+ '_' + str(count))
+                            lu.create_dir(mosaicDir)
+                            mosaicRaster = path.join(mosaicDir,mosFN)                        
+                            if not tryAgain:    
+                                exec statement
+                        else: break
             endTime = time.clock()
             processTime = round((endTime - start_time), 2)
 
-            if normalize == True:
+            if corridorJobs is not None:
+                printText = "Queued "
+            elif normalize == True:
                 printText = "Normalized and mosaicked "
             else:
                 printText = "Mosaicked NON-normalized "
@@ -321,23 +367,14 @@ def calc_lccs(normalize):
                     " out of " + str(int(numCorridorLinks)) + " links have been "
                     "processed.")
 
-            # temporarily disable links in linktable - don't want to mosaic
-            # them twice
-            for y in range (x+1,numLinks):
-                corex1 = int(coreList[y,0])
-                corey1 = int(coreList[y,1])
-                if corex1 == corex and corey1 == corey:
-                    linkTable[y,cfg.LTB_LINKTYPE] = (
-                        linkTable[y,cfg.LTB_LINKTYPE] + 1000)
-                elif corex1==corey and corey1==corex:
-                    linkTable[y,cfg.LTB_LINKTYPE] = (
-                            linkTable[y,cfg.LTB_LINKTYPE] + 1000)
+            mosaicked.put(corex, corey)
 
             numGridsWritten = numGridsWritten + 1
             if not SAVENORMLCCS:
-                lu.delete_data(lccNormRaster)
-                lu.delete_dir(clccdir)
-                lu.create_dir(clccdir)  
+                if mosaicArray is None:
+                    lu.delete_data(lccNormRaster)
+                    lu.delete_dir(clccdir)
+                    lu.create_dir(clccdir)
             else:
                 if numGridsWritten == 100:
                     # We only write up to 100 grids to any one folder
@@ -350,17 +387,27 @@ def calc_lccs(normalize):
                     gp.CreateFolder_management(cfg.LCCBASEDIR,
                                                path.basename(clccdir))
 
-            if numGridsWritten > 1 or dirCount > 0:                                       
-                lu.delete_data(lastMosaicRaster)
-                lu.delete_dir(path.dirname(lastMosaicRaster))
+            if mosaicArray is None:
+                if numGridsWritten > 1 or dirCount > 0:
+                    lu.delete_data(lastMosaicRaster)
+                    lu.delete_dir(path.dirname(lastMosaicRaster))
 
-            lastMosaicRaster = mosaicRaster
+                lastMosaicRaster = mosaicRaster
             x = x + 1
             
-        #rows that were temporarily disabled
-        rows = npy.where(linkTable[:,cfg.LTB_LINKTYPE]>1000)
-        linkTable[rows,cfg.LTB_LINKTYPE] = (
-            linkTable[rows,cfg.LTB_LINKTYPE] - 1000)
+        if corridorJobs:
+            start_time = time.clock()
+            run_mosaic_pool(mosaicArray, cwdStore, corridorJobs)
+            start_time = lu.elapsed_time(start_time)
+
+        if mosaicArray is not None:
+            # Write mosaic once, with the same offset as mosaicked rasters
+            mosaicDir = path.join(cfg.LCCBASEDIR, 'mos_native')
+            lu.create_dir(mosaicDir)
+            mosaicRaster = path.join(mosaicDir, 'mos')
+            lu.array_to_raster(mosaicArray, cwdStore.grid, mosaicRaster)
+            del mosaicArray
+
         # ---------------------------------------------------------------------
 
         # Create output geodatabase
@@ -538,6 +585,154 @@ def calc_lccs(normalize):
     return
        
     
+def mosaic_corridor(mosaicArray, cwdStore, corex, corey, lcDist,
+                    lccNormRaster=None):
+    """Adds a link's corridor to an in-memory mosaic, keeping the minimum.
+
+    Only the corridor's window of the mosaic is touched.  With
+    lccNormRaster the corridor is also saved as a raster.
+
+    """
+    window = get_corridor_window(cwdStore, corex, corey)
+    if window is None:  # Cores' cwds don't overlap, so there's no corridor
+        return
+    corridor = get_corridor(cwdStore, corex, corey, lcDist, window)
+    mosaicWindow = mosaicArray[lm_raster.window_slices(window)]
+    npy.minimum(mosaicWindow, corridor, out=mosaicWindow)
+    if lccNormRaster is not None:
+        lu.array_to_raster(corridor,
+                           lm_raster.window_grid(cwdStore.grid, window),
+                           lccNormRaster)
+
+
+def get_corridor_window(cwdStore, corex, corey):
+    """Returns window where both cores' stored cwds overlap, or None"""
+    return lm_raster.intersect_windows(cwdStore.get_entry(corex)[2],
+                                       cwdStore.get_entry(corey)[2])
+
+
+def get_corridor(cwdStore, corex, corey, lcDist, window):
+    """Returns a link's corridor over window.
+
+    The corridor is cwd1 + cwd2 - lcDist, or just cwd1 + cwd2 if lcDist is
+    None.  window must be within get_corridor_window.
+
+    """
+    cwd1, window = cwdStore.get(corex, window)
+    cwd2, window = cwdStore.get(corey, window)
+    corridor = cwd1 + cwd2
+    if lcDist is not None:
+        corridor -= lcDist
+    return corridor
+
+
+def run_mosaic_pool(mosaicArray, cwdStore, jobs):
+    """Mosaics queued corridors in worker processes.
+
+    Links are split into one run of consecutive links per worker, and the
+    grid into row tiles of about STRIPCELLS cells.  Each task mosaics one
+    run's corridors within one tile into a partial minimum, so no process
+    holds more than a tile per task.  A tile's partials are combined by
+    pairwise minimums.  Minimums are exact whatever the order, so the
+    result is bit-identical to mosaicking links one at a time.
+
+    """
+    jobs = [(corex, corey, lcDist,
+             get_corridor_window(cwdStore, corex, corey))
+            for corex, corey, lcDist in jobs]
+    numWorkers = min(cfg.NUMWORKERS, len(jobs))
+    groupSize = int(math.ceil(len(jobs) / float(numWorkers)))
+    groups = [jobs[i:i + groupSize] for i in range(0, len(jobs), groupSize)]
+
+    nrows, ncols = cwdStore.grid[3:5]
+    tileRows = max(1, int(cfg.STRIPCELLS / ncols))
+    tasks = []
+    numTasks = {}
+    for row0 in range(0, nrows, tileRows):
+        tile = (row0, min(row0 + tileRows, nrows), 0, ncols)
+        for groupIndex in range(len(groups)):
+            for corex, corey, lcDist, window in groups[groupIndex]:
+                if (window is not None and
+                    lm_raster.intersect_windows(window, tile) is not None):
+                    tasks.append((tile, groupIndex))
+                    numTasks[tile] = numTasks.get(tile, 0) + 1
+                    break
+
+    gprint('\nMosaicking ' + str(len(jobs)) + ' corridors in ' +
+           str(numWorkers) + ' worker processes.')
+    # Workers only read the cwd store, so no tool settings are passed
+    pool = lu.create_worker_pool(numWorkers, init_mosaic_worker,
+                                 (cwdStore, groups))
+    try:
+        partials = {}
+        for tile, partial, errorText in pool.imap(mosaic_worker, tasks):
+            if errorText is not None:
+                msg = ('ERROR: Worker process failed while mosaicking '
+                       'corridors. See the log file for details.\n' +
+                       errorText)
+                lu.raise_error(msg)
+            partials.setdefault(tile, []).append(partial)
+            if len(partials[tile]) == numTasks[tile]:
+                mosaicArray[lm_raster.window_slices(tile)] = (
+                    reduce_minimum(partials.pop(tile)))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def reduce_minimum(arrays):
+    """Combines arrays by pairwise minimums, a level at a time"""
+    while len(arrays) > 1:
+        reduced = []
+        for i in range(0, len(arrays) - 1, 2):
+            reduced.append(npy.minimum(arrays[i], arrays[i + 1],
+                                       out=arrays[i]))
+        if len(arrays) % 2 == 1:
+            reduced.append(arrays[-1])
+        arrays = reduced
+    return arrays[0]
+
+
+def init_mosaic_worker(store, groups):
+    """Sets up a worker process for corridor mosaicking"""
+    global workerStore
+    global workerGroups
+    workerStore = store
+    workerGroups = groups
+
+
+def mosaic_worker(task):
+    """Mosaics one run of corridors within a tile in a worker process.
+
+    Returns the tile, its partial minimum array and error text (None on
+    success).
+
+    """
+    tile, groupIndex = task
+    try:
+        partial = npy.empty((tile[1] - tile[0], tile[3] - tile[2]),
+                            dtype='float32')
+        partial.fill(npy.inf)
+        for corex, corey, lcDist, window in workerGroups[groupIndex]:
+            if window is None:
+                continue
+            overlap = lm_raster.intersect_windows(window, tile)
+            if overlap is None:
+                continue
+            corridor = get_corridor(workerStore, corex, corey, lcDist,
+                                    overlap)
+            partialWindow = partial[lm_raster.window_slices(
+                lm_raster.relative_window(overlap, tile))]
+            npy.minimum(partialWindow, corridor, out=partialWindow)
+        return tile, partial, None
+
+    # exit_with_python_error raises SystemExit, so catch everything and
+    # hand the error back to the main process
+    except:
+        return tile, None, traceback.format_exc()
+
+
 def randomerror():
     """ Used to test error recovery.
 
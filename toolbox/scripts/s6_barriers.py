@@ -18,6 +18,8 @@ from lm_retry_decorator import retry
 
 from lm_config import tool_env as cfg
 import lm_util as lu
+import lm_cwdstore
+import lm_pairs
 
 # Writing to tifs allows long filenames, needed for large radius values.
 # Virtually no speed penalty in this case based on tests with large dataset.
@@ -96,6 +98,7 @@ def STEP6_calc_barriers():
             lu.raise_error(msg)
 
         linkTable = lu.load_link_table(linkTableFile)
+        cwdStore = lm_cwdstore.load_cwd_store()
         numLinks = linkTable.shape[0]
         numCorridorLinks = lu.report_links(linkTable)
         if numCorridorLinks == 0:
@@ -180,20 +183,22 @@ def STEP6_calc_barriers():
                     gprint('0 percent done')
                 lastMosaicRaster = None
                 lastMosaicRasterPct = None
+                # Don't mosaic core pairs twice
+                mosaicked = lm_pairs.PairStore()
                 for x in range(0,numLinks):
                     pctDone = lu.report_pct_done(linkLoop, numCorridorLinks,
                                                 pctDone)
                     linkId = str(int(linkTable[x,cfg.LTB_LINKID]))
                     if ((linkTable[x,cfg.LTB_LINKTYPE] > 0) and
-                       (linkTable[x,cfg.LTB_LINKTYPE] < 1000)):
+                        not mosaicked.has(coreList[x,0], coreList[x,1])):
                         linkLoop = linkLoop + 1
                         # source and target cores
                         corex=int(coreList[x,0])
                         corey=int(coreList[x,1])
 
                         # Get cwd rasters for source and target cores
-                        cwdRaster1 = lu.get_cwd_path(corex)
-                        cwdRaster2 = lu.get_cwd_path(corey)
+                        cwdRaster1 = lm_cwdstore.get_cwd_raster(cwdStore, corex)
+                        cwdRaster2 = lm_cwdstore.get_cwd_raster(cwdStore, corey)
                         
                         # Mask out areas above CWD threshold
                         cwdTemp1 = None
@@ -421,25 +426,11 @@ def STEP6_calc_barriers():
                                 lu.delete_data(trmRaster)                            
                             
                             
-                        # Temporarily disable links in linktable -
-                        # don't want to mosaic them twice
-                        for y in range (x+1,numLinks):
-                            corex1 = int(coreList[y,0])
-                            corey1 = int(coreList[y,1])
-                            if corex1 == corex and corey1 == corey:
-                                linkTable[y,cfg.LTB_LINKTYPE] = (
-                                    linkTable[y,cfg.LTB_LINKTYPE] + 1000)
-                            elif corex1==corey and corey1==corex:
-                                linkTable[y,cfg.LTB_LINKTYPE] = (
-                                    linkTable[y,cfg.LTB_LINKTYPE] + 1000)               
+                        mosaicked.put(corex, corey)
 
                 if numCorridorLinks > 1 and pctDone < 100:
                     gprint('100 percent done')
                 gprint('Summarizing barrier data for search radius.')
-                #rows that were temporarily disabled
-                rows = npy.where(linkTable[:,cfg.LTB_LINKTYPE]>1000)
-                linkTable[rows,cfg.LTB_LINKTYPE] = (
-                    linkTable[rows,cfg.LTB_LINKTYPE] - 1000)
 
                 # -----------------------------------------------------------------
                 
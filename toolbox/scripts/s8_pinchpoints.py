@@ -22,6 +22,7 @@ from arcpy.sa import *
 
 from lm_config import tool_env as cfg
 import lm_util as lu
+import lm_cwdstore
 
 _SCRIPT_NAME = "s8_pinchpoints.py"
 
@@ -87,6 +88,7 @@ def STEP8_calc_pinchpoints():
 
         inLinkTableFile = lu.get_prev_step_link_table(step=8)
         linkTable = lu.load_link_table(inLinkTableFile)
+        cwdStore = lm_cwdstore.load_cwd_store()
         numLinks = linkTable.shape[0]
         numCorridorLinks = lu.report_links(linkTable)
         if numCorridorLinks == 0:
@@ -174,8 +176,8 @@ def STEP8_calc_pinchpoints():
                 corey=int(coreList[x,1])
 
                 # Get cwd rasters for source and target cores
-                cwdRaster1 = lu.get_cwd_path(corex)
-                cwdRaster2 = lu.get_cwd_path(corey)
+                cwdRaster1 = lm_cwdstore.get_cwd_raster(cwdStore, corex)
+                cwdRaster2 = lm_cwdstore.get_cwd_raster(cwdStore, corey)
 
                 lccNormRaster = path.join(linkDir, 'lcc_norm')
                 arcpy.env.extent = "MINOF"
@@ -0,0 +1,13 @@
+import pytest
+
+import stubs
+
+
+@pytest.fixture
+def cfg(tmpdir):
+    """Tool settings with a datapass directory in tmpdir"""
+    stubs.reset_settings()
+    stubs.cfg.DATAPASSDIR = str(tmpdir.mkdir('datapass'))
+    stubs.cfg.CWDBASEDIR = str(tmpdir.mkdir('cwd'))
+    yield stubs.cfg
+    stubs.reset_settings()
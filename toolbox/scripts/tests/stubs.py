@@ -0,0 +1,83 @@
+"""Stand-ins for the ArcGIS parts of Linkage Mapper.
+
+lm_config and lm_util load ArcGIS when imported, so tests use a bare
+settings object for cfg and an lm_util module holding only the functions
+copied into it.  Functions are copied from scripts by their source text,
+since the scripts themselves can't be imported without ArcGIS.
+
+"""
+
+import os.path as path
+import re
+import sys
+import types
+
+import numpy as npy
+
+SCRIPT_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+
+
+class Settings(object):
+    """Tool settings, set as attributes as lm_config does"""
+
+
+cfg = Settings()
+
+lm_config = types.ModuleType('lm_config')
+lm_config.tool_env = cfg
+sys.modules['lm_config'] = lm_config
+
+
+def exit_with_python_error(scriptName):
+    raise
+
+
+lm_util = types.ModuleType('lm_util')
+lm_util.npy = npy
+lm_util.cfg = cfg
+lm_util._SCRIPT_NAME = 'lm_util.py'
+lm_util.exit_with_python_error = exit_with_python_error
+sys.modules['lm_util'] = lm_util
+
+
+def reset_settings():
+    """Clears all tool settings"""
+    for name in list(vars(cfg).keys()):
+        delattr(cfg, name)
+
+
+def get_source(scriptName, funcName):
+    """Returns source of a top-level function in a script"""
+    inFile = open(path.join(SCRIPT_DIR, scriptName), 'rb')
+    try:
+        text = inFile.read().decode('latin-1').replace('\r\n', '\n')
+    finally:
+        inFile.close()
+    # A function runs until the next line starting in column 0
+    match = re.search(r'^def ' + funcName + r'\b.*?(?=^[^\s#]|\Z)', text,
+                      re.MULTILINE | re.DOTALL)
+    if match is None:
+        raise ValueError(funcName + ' not found in ' + scriptName)
+    # Blank lines in front keep line numbers in tracebacks right
+    return '\n' * text.count('\n', 0, match.start()) + match.group(0)
+
+
+def load_functions(scriptName, funcNames, module=None):
+    """Copies functions from a script into a module and returns it.
+
+    Functions find each other and the script's usual names (npy, cfg,
+    lu) in the module.
+
+    """
+    if module is None:
+        module = types.ModuleType(path.splitext(scriptName)[0])
+        module.npy = npy
+        module.cfg = cfg
+        module.lu = lm_util
+    for funcName in funcNames:
+        code = compile(get_source(scriptName, funcName), scriptName, 'exec')
+        exec(code, vars(module))
+    return module
+
@@ -0,0 +1,75 @@
+import numpy as npy
+
+import lm_adj
+
+
+def brute_adjacent_pairs(alloc):
+    nrows, ncols = alloc.shape
+    pairs = set()
+    for row in range(nrows):
+        for col in range(ncols):
+            for dr in (-1, 0, 1):
+                for dc in (-1, 0, 1):
+                    r, c = row + dr, col + dc
+                    if r < 0 or r >= nrows or c < 0 or c >= ncols:
+                        continue
+                    zone1, zone2 = alloc[row, col], alloc[r, c]
+                    if zone1 > 0 and zone2 > 0 and zone1 != zone2:
+                        pairs.add((min(zone1, zone2), max(zone1, zone2)))
+    return sorted(pairs)
+
+
+def random_alloc(seed, shape=(15, 18)):
+    rand = npy.random.RandomState(seed)
+    # Blocky zones, like allocation, with some NoData
+    alloc = rand.randint(0, 9, (shape[0] // 3 + 1, shape[1] // 3 + 1))
+    alloc = alloc.repeat(3, axis=0).repeat(3, axis=1)[:shape[0], :shape[1]]
+    noise = rand.uniform(size=shape) < 0.1
+    alloc[noise] = rand.randint(-1, 12, noise.sum())
+    return alloc.astype('int32') * 1000
+
+
+def test_adjacent_pairs_match_brute_force():
+    for seed in range(5):
+        alloc = random_alloc(seed)
+        pairs = lm_adj.get_adjacent_pairs(alloc)
+        assert pairs.dtype == npy.int32
+        assert [tuple(pair) for pair in pairs.tolist()] == (
+            brute_adjacent_pairs(alloc))
+
+
+def test_pair_keys_round_trip():
+    zones1 = npy.array([5, 2, 70000, 3])
+    zones2 = npy.array([2, 5, 1, 2 ** 31 - 1])
+    table = lm_adj.keys_to_table(lm_adj.pair_keys(zones1, zones2))
+    assert table.tolist() == [[2, 5], [2, 5], [1, 70000], [3, 2 ** 31 - 1]]
+
+
+def test_adjacent_keys_in_strips():
+    for seed in range(5):
+        alloc = random_alloc(seed, (23, 11))
+        expected = lm_adj.get_adjacent_keys(alloc)
+        for stripRows in (0, 1, 2, 5, 100):
+            keys = lm_adj.get_adjacent_keys_in_strips(
+                lambda row0, row1: alloc[row0:row1], alloc.shape[0],
+                stripRows)
+            assert (keys == expected).all()
+
+
+def test_keys_in():
+    rand = npy.random.RandomState(0)
+    sortedKeys = npy.unique(rand.randint(0, 50, 20)).astype('int64')
+    keys = rand.randint(-5, 60, 100).astype('int64')
+    expected = [key in set(sortedKeys.tolist()) for key in keys.tolist()]
+    assert lm_adj.keys_in(keys, sortedKeys).tolist() == expected
+    assert not lm_adj.keys_in(keys, sortedKeys[:0]).any()
+
+
+def test_min_by_key():
+    rand = npy.random.RandomState(1)
+    keys = rand.randint(0, 10, 60)
+    values = rand.uniform(size=60)
+    ind = lm_adj.min_by_key(keys, values)
+    assert keys[ind].tolist() == sorted(set(keys.tolist()))
+    for i in ind:
+        assert values[i] == values[keys == keys[i]].min()
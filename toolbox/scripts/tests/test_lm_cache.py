@@ -0,0 +1,103 @@
+import os
+import os.path as path
+import time
+
+import numpy as npy
+
+import stubs
+import lm_cache
+
+
+def write_text(fileName, text, mtime=None):
+    outFile = open(fileName, 'w')
+    outFile.write(text)
+    outFile.close()
+    if mtime is not None:
+        os.utime(fileName, (mtime, mtime))
+
+
+def count_calls(monkeypatch, name):
+    calls = []
+    func = getattr(lm_cache, name)
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return func(*args, **kwargs)
+    monkeypatch.setattr(lm_cache, name, counted)
+    return calls
+
+
+def test_cache_hit_and_invalidation(cfg, tmpdir, monkeypatch):
+    fileName = str(tmpdir.join('links.csv'))
+    write_text(fileName, '1,2,3\n4,5,6\n')
+    parses = []
+    loadtxt = npy.loadtxt
+    monkeypatch.setattr(lm_cache.npy, 'loadtxt',
+                        lambda *args, **kwargs: parses.append(args) or
+                        loadtxt(*args, **kwargs))
+
+    first = lm_cache.loadtxt(fileName, delimiter=',')
+    assert (first == loadtxt(fileName, delimiter=',')).all()
+    assert len(parses) == 1
+    # Nothing is written beside the input
+    assert sorted(os.listdir(str(tmpdir))) == ['cwd', 'datapass',
+                                               'links.csv']
+
+    assert (lm_cache.loadtxt(fileName, delimiter=',') == first).all()
+    assert len(parses) == 1
+
+    # New contents with the same size and time stamp, which a file
+    # changed just after caching can have
+    mtime = path.getmtime(fileName)
+    write_text(fileName, '7,8,9\n1,2,3\n', mtime)
+    assert lm_cache.loadtxt(fileName, delimiter=',')[0, 0] == 7
+    assert len(parses) == 2
+
+    # Other loadtxt arguments are parsed again
+    assert lm_cache.loadtxt(fileName, delimiter=',',
+                            dtype='int32').dtype == npy.int32
+    assert len(parses) == 3
+
+    lm_cache.delete_cache(fileName)
+    assert lm_cache.loadtxt(fileName, delimiter=',')[0, 0] == 7
+    assert len(parses) == 4
+
+
+def test_unchanged_old_file_not_hashed(cfg, tmpdir, monkeypatch):
+    fileName = str(tmpdir.join('dists.txt'))
+    oldTime = time.time() - 100
+    write_text(fileName, '1 2 3.5\n', oldTime)
+    hashes = count_calls(monkeypatch, '_file_hash')
+    lm_cache.loadtxt(fileName)
+    assert len(hashes) == 1
+    lm_cache.loadtxt(fileName)
+    lm_cache.loadtxt(fileName)
+    assert len(hashes) == 1
+
+    # A new time stamp is checked by hash once, then trusted
+    os.utime(fileName, (oldTime + 10, oldTime + 10))
+    lm_cache.loadtxt(fileName)
+    lm_cache.loadtxt(fileName)
+    assert len(hashes) == 2
+
+
+def test_same_name_in_two_folders(cfg, tmpdir):
+    fileName1 = str(tmpdir.mkdir('a').join('adj.csv'))
+    fileName2 = str(tmpdir.mkdir('b').join('adj.csv'))
+    write_text(fileName1, '1,2\n')
+    write_text(fileName2, '3,4\n')
+    assert lm_cache.loadtxt(fileName1, delimiter=',').tolist() == [1, 2]
+    assert lm_cache.loadtxt(fileName2, delimiter=',').tolist() == [3, 4]
+    assert lm_cache.loadtxt(fileName1, delimiter=',').tolist() == [1, 2]
+
+
+def test_no_cache_without_settings(cfg, tmpdir):
+    fileName = str(tmpdir.join('adj.csv'))
+    write_text(fileName, '1,2\n')
+    cfg.CACHEINPUTS = False
+    lm_cache.loadtxt(fileName, delimiter=',')
+    del cfg.CACHEINPUTS
+    del cfg.DATAPASSDIR
+    lm_cache.loadtxt(fileName, delimiter=',')
+    cacheDir = path.join(str(tmpdir.join('datapass')), lm_cache.CACHE_DIR)
+    assert not path.exists(cacheDir)
@@ -0,0 +1,250 @@
+import math
+
+import numpy as npy
+import pytest
+
+import lm_cwd
+
+NEIGHBORS = [(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)
+             if (dr, dc) != (0, 0)]
+
+
+def step_cost(resistance, cell1, cell2, cellSize):
+    factor = 1.0
+    if cell1[0] != cell2[0] and cell1[1] != cell2[1]:
+        factor = math.sqrt(2)
+    return (resistance[cell1] + resistance[cell2]) / 2.0 * cellSize * factor
+
+
+def brute_cwd(resistance, sources, cellSize=1.0):
+    """Cwd by relaxing every edge until nothing changes"""
+    nrows, ncols = resistance.shape
+    valid = npy.isfinite(resistance)
+    dist = npy.where(sources & valid, 0.0, npy.inf)
+    changed = True
+    while changed:
+        changed = False
+        for row in range(nrows):
+            for col in range(ncols):
+                if not valid[row, col]:
+                    continue
+                for dr, dc in NEIGHBORS:
+                    r, c = row + dr, col + dc
+                    if (r < 0 or r >= nrows or c < 0 or c >= ncols or
+                        not valid[r, c] or not npy.isfinite(dist[r, c])):
+                        continue
+                    d = dist[r, c] + step_cost(resistance, (r, c),
+                                               (row, col), cellSize)
+                    if d < dist[row, col] - 1e-9:
+                        dist[row, col] = d
+                        changed = True
+    return dist
+
+
+def make_grid(seed, nrows=12, ncols=15):
+    rand = npy.random.RandomState(seed)
+    resistance = rand.uniform(1, 10, (nrows, ncols))
+    resistance[rand.uniform(size=(nrows, ncols)) < 0.1] = npy.nan
+    seeds = npy.zeros((nrows, ncols), dtype='int32')
+    for label in (1, 2, 3):
+        row = rand.randint(nrows)
+        col = rand.randint(ncols)
+        seeds[row, col] = label
+        resistance[row, col] = rand.uniform(1, 10)
+    return resistance, seeds
+
+
+# Priority queue search, array sweeps, and array sweeps over narrow strips
+SPREADS = [{}, {'heapCells': 0}, {'heapCells': 0, 'stripCells': 20}]
+
+
+@pytest.mark.parametrize('options', SPREADS)
+def test_spread_matches_brute_force(options):
+    for seed in range(5):
+        resistance, seeds = make_grid(seed)
+        cellSize = 30.0
+        cwd, back, alloc = lm_cwd.spread(resistance, seeds, cellSize,
+                                         **options)
+        assert npy.allclose(cwd, brute_cwd(resistance, seeds > 0, cellSize))
+
+        # Each cell goes to the nearest source
+        labelCwds = dict((label, brute_cwd(resistance, seeds == label,
+                                           cellSize))
+                         for label in (1, 2, 3))
+        reached = npy.isfinite(cwd)
+        assert (alloc[~reached] == 0).all()
+        for row, col in zip(*npy.nonzero(reached)):
+            assert abs(labelCwds[alloc[row, col]][row, col] -
+                       cwd[row, col]) < 1e-9
+
+        # Back-links point to the neighbor each cell was reached from
+        assert (back[~reached] == lm_cwd.BACK_NODATA).all()
+        for row, col in zip(*npy.nonzero(reached)):
+            code = back[row, col]
+            if code == 0:
+                assert seeds[row, col] > 0
+                continue
+            dr, dc = lm_cwd.BACK_OFFSETS[code]
+            fromCell = (row + dr, col + dc)
+            assert abs(cwd[fromCell] + step_cost(resistance, fromCell,
+                                                 (row, col), cellSize) -
+                       cwd[row, col]) < 1e-9
+
+
+@pytest.mark.parametrize('options', SPREADS)
+def test_spread_max_dist(options):
+    resistance, seeds = make_grid(7)
+    fullCwd = lm_cwd.spread(resistance, seeds, **options)[0]
+    cwd, back, alloc = lm_cwd.spread(resistance, seeds, maxDist=20,
+                                     **options)
+    within = fullCwd <= 20
+    assert npy.allclose(cwd[within], fullCwd[within])
+    assert npy.isinf(cwd[~within]).all()
+    assert (back[~within] == lm_cwd.BACK_NODATA).all()
+    assert (alloc[~within] == 0).all()
+
+
+def test_cost_distance_stops_at_targets():
+    resistance, seeds = make_grid(3, 20, 20)
+    resistance[npy.isnan(resistance)] = 5
+    sources = seeds == 1
+    targets = npy.zeros(seeds.shape, dtype='int32')
+    targets[15:18, 2:5] = 7
+    targets[1:3, 16:19] = 8
+    fullCwd = lm_cwd.cost_distance(resistance, sources)[0]
+    cwd, back = lm_cwd.cost_distance(resistance, sources, targets=targets,
+                                     cutoff=3)
+    fullMins = lm_cwd.zonal_minimum(fullCwd, targets)
+    assert lm_cwd.zonal_minimum(cwd, targets) == fullMins
+    limit = max(fullMins.values()) + 3
+    assert npy.allclose(cwd[fullCwd <= limit], fullCwd[fullCwd <= limit])
+    assert npy.isinf(cwd[fullCwd > limit]).all()
+
+    # Sweeps can't stop early, but cut off at the same distance
+    sweepCwd = lm_cwd.spread(resistance, sources.astype('int32'),
+                             targets=targets, cutoff=3, heapCells=0)[0]
+    assert npy.array_equal(npy.isinf(sweepCwd), npy.isinf(cwd))
+    assert npy.allclose(sweepCwd[npy.isfinite(cwd)], cwd[npy.isfinite(cwd)])
+
+
+def test_sweep_matches_heap_on_winding_paths():
+    # Walls with alternating gaps force paths that double back
+    resistance = npy.ones((30, 31))
+    for row in range(3, 30, 6):
+        resistance[row, :] = npy.nan
+        if row % 12 == 3:
+            resistance[row, -1] = 1
+        else:
+            resistance[row, 0] = 1
+    seeds = npy.zeros((30, 31), dtype='int32')
+    seeds[0, 0] = 1
+    seeds[29, 30] = 2
+    heapCwd, heapBack, heapAlloc = lm_cwd.spread(resistance, seeds, 10.0)
+    cwd, back, alloc = lm_cwd.spread(resistance, seeds, 10.0, heapCells=0,
+                                     stripCells=100)
+    assert npy.isinf(cwd[3, 1:-1]).all()
+    assert npy.array_equal(npy.isinf(cwd), npy.isinf(heapCwd))
+    assert npy.allclose(cwd[npy.isfinite(cwd)],
+                        heapCwd[npy.isfinite(heapCwd)])
+
+
+def test_zonal_minimum():
+    rand = npy.random.RandomState(0)
+    values = rand.uniform(size=(10, 10))
+    values[rand.uniform(size=(10, 10)) < 0.2] = npy.inf
+    zones = rand.randint(-1, 6, (10, 10))
+    expected = {}
+    for value, zone in zip(values.ravel(), zones.ravel()):
+        if zone > 0 and npy.isfinite(value):
+            expected[zone] = min(expected.get(zone, npy.inf), value)
+    assert lm_cwd.zonal_minimum(values, zones) == expected
+    assert lm_cwd.zonal_minimum(values, npy.zeros((10, 10), 'int32')) == {}
+
+
+def test_trace_path_follows_least_cost_path():
+    for seed in range(5):
+        resistance, seeds = make_grid(seed, 15, 15)
+        cellSize = 10.0
+        sources = seeds == 1
+        targets = seeds == 2
+        cwd, back = lm_cwd.cost_distance(resistance, sources, cellSize)
+        start = lm_cwd.best_start_cell(cwd, targets)
+        if not npy.isfinite(cwd[targets]).any():
+            assert start is None
+            continue
+        assert cwd[start] == cwd[targets].min()
+        cells, length = lm_cwd.trace_path(back, start, cellSize)
+        assert tuple(cells[0]) == tuple(start)
+        assert sources[tuple(cells[-1])]
+        cost = 0
+        geometric = 0
+        for cell1, cell2 in zip(cells[:-1], cells[1:]):
+            assert npy.abs(cell1 - cell2).max() == 1
+            cost += step_cost(resistance, tuple(cell1), tuple(cell2),
+                              cellSize)
+            geometric += math.sqrt(((cell1 - cell2) ** 2).sum()) * cellSize
+        assert abs(cost - cwd[start]) < 1e-9
+        assert abs(length - geometric) < 1e-9
+
+
+def test_best_start_cell_unreached():
+    cwd = npy.array([[0, 1], [npy.inf, npy.inf]])
+    targets = npy.array([[False, False], [True, True]])
+    assert lm_cwd.best_start_cell(cwd, targets) is None
+
+
+def test_path_vertices():
+    grid = (100.0, 200.0, 10.0, 4, 5)
+    cells = npy.array([[0, 0], [3, 4], [1, 2]])
+    vertices = lm_cwd.path_vertices(cells, grid)
+    for (row, col), (x, y) in zip(cells, vertices):
+        assert x == 100 + col * 10 + 5
+        assert y == 200 + 40 - row * 10 - 5
+
+
+def test_first_intruding_zone():
+    rand = npy.random.RandomState(1)
+    zones = rand.randint(0, 5, (10, 10))
+    cells = rand.randint(0, 10, (30, 2))
+    for allowed in ([1, 2], [1, 2, 3, 4], []):
+        expected = None
+        for row, col in cells:
+            if zones[row, col] > 0 and zones[row, col] not in allowed:
+                expected = zones[row, col]
+                break
+        assert lm_cwd.first_intruding_zone(cells, zones, allowed) == expected
+
+
+def brute_nearest_dist2(seeds):
+    seedCells = npy.transpose(npy.nonzero(seeds > 0))
+    rows, cols = npy.indices(seeds.shape)
+    dist2 = ((rows[..., npy.newaxis] - seedCells[:, 0]) ** 2 +
+             (cols[..., npy.newaxis] - seedCells[:, 1]) ** 2)
+    return dist2.min(axis=2), seedCells
+
+
+def test_euclidean_allocation_nearest_seed():
+    for seed, shape in enumerate([(20, 23), (1, 17), (17, 1), (9, 40)]):
+        rand = npy.random.RandomState(seed)
+        seeds = npy.zeros(shape, dtype='int32')
+        numSeeds = max(2, seeds.size // 15)
+        cells = rand.choice(seeds.size, numSeeds, replace=False)
+        seeds.flat[cells] = rand.randint(1, 6, numSeeds)
+        nearestDist2, seedCells = brute_nearest_dist2(seeds)
+        for stripCells in (10000000, shape[1] * 3, 1):
+            labels = lm_cwd.euclidean_allocation(seeds, stripCells)
+            assert labels.dtype == npy.int32
+            # Ties may go to either seed, so check the label's nearest
+            # seed is as near as any
+            for row in range(shape[0]):
+                for col in range(shape[1]):
+                    sameLabel = seedCells[seeds[tuple(seedCells.T)] ==
+                                          labels[row, col]]
+                    dist2 = ((sameLabel[:, 0] - row) ** 2 +
+                             (sameLabel[:, 1] - col) ** 2).min()
+                    assert dist2 == nearestDist2[row, col]
+
+
+def test_euclidean_allocation_no_seeds():
+    labels = lm_cwd.euclidean_allocation(npy.zeros((4, 5), dtype='int32'))
+    assert (labels == 0).all()
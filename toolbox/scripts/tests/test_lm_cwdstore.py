@@ -0,0 +1,62 @@
+import pickle
+
+import numpy as npy
+
+import stubs
+import lm_cwdstore
+
+GRID = (0.0, 0.0, 10.0, 30, 40)
+
+
+def random_windows(rand, count):
+    windows = []
+    for i in range(count):
+        rows = npy.sort(rand.choice(31, 2, replace=False)).tolist()
+        cols = npy.sort(rand.choice(41, 2, replace=False)).tolist()
+        windows.append(tuple(rows + cols))
+    return windows
+
+
+def test_store_matches_full_arrays(cfg):
+    rand = npy.random.RandomState(0)
+    store = lm_cwdstore.CwdStore(GRID)
+    full = {}
+    for core, window in zip([3, 8, 12], random_windows(rand, 3)):
+        cwd = npy.empty(GRID[3:5], dtype='float32')
+        cwd.fill(npy.inf)
+        cwd[window[0]:window[1], window[2]:window[3]] = rand.uniform(
+            size=(window[1] - window[0], window[3] - window[2]))
+        store.put(core, window, cwd[window[0]:window[1],
+                                    window[2]:window[3]])
+        full[core] = cwd
+    store.save()
+
+    loaded = lm_cwdstore.load_cwd_store()
+    assert loaded.grid == GRID
+    assert loaded.cores() == [3, 8, 12]
+    assert not loaded.has(5)
+    for window in random_windows(rand, 20):
+        for core in full:
+            expected = full[core][window[0]:window[1], window[2]:window[3]]
+            assert (loaded.read(core, window) == expected).all()
+            cwd, overlap = loaded.get(core, window)
+            if overlap is None:
+                assert npy.isinf(expected).all()
+            else:
+                assert (cwd == full[core][overlap[0]:overlap[1],
+                                          overlap[2]:overlap[3]]).all()
+
+
+def test_entries_from_other_stores(cfg):
+    store = lm_cwdstore.CwdStore(GRID)
+    workerStore = lm_cwdstore.CwdStore(GRID, dataName='cwd_data_1.dat')
+    workerStore.put(4, (0, 2, 0, 3), npy.arange(6).reshape(2, 3))
+    workerStore.rasters[4] = 'cwd_4'
+    copied = pickle.loads(pickle.dumps(workerStore, 2))
+    assert copied.rasters == {}
+    store.add_entry(4, copied.get_entry(4))
+    assert store.get(4)[0].tolist() == [[0, 1, 2], [3, 4, 5]]
+
+
+def test_no_saved_store(cfg):
+    assert lm_cwdstore.load_cwd_store() is None
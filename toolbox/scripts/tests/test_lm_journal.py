@@ -0,0 +1,51 @@
+import os.path as path
+
+import numpy as npy
+
+import stubs
+import lm_journal
+
+
+def test_journal_round_trip(cfg):
+    lm_journal.start_journal([5, 7, 9])
+    records = []
+    for x in range(3):
+        rows = [x, x + 3]
+        rowValues = npy.arange(8, dtype='float64').reshape(2, 4) + x
+        pairResults = {(5, 7 + x): {'intCore': None}}
+        lm_journal.add_to_journal(x, rows, rowValues, pairResults, x * 2)
+        records.append((x, rows, rowValues, pairResults, x * 2))
+
+    coresToMap, saved = lm_journal.read_journal()
+    assert coresToMap == [5, 7, 9]
+    assert len(saved) == 3
+    for record, expected in zip(saved, records):
+        assert record[0] == expected[0]
+        assert record[1] == expected[1]
+        assert (record[2] == expected[2]).all()
+        assert record[3:] == expected[3:]
+
+    lm_journal.delete_journal()
+    assert lm_journal.read_journal() is None
+
+
+def test_cut_short_record_dropped(cfg):
+    lm_journal.start_journal([1, 2])
+    lm_journal.add_to_journal(0, [0], None, {}, 1)
+    fileName = lm_journal.get_journal_path()
+    size = path.getsize(fileName)
+    lm_journal.add_to_journal(1, [1], None, {}, 2)
+    # Crash partway through writing the last record
+    for cut in (size + 3, path.getsize(fileName) - 1):
+        data = open(fileName, 'rb').read()[:cut]
+        open(fileName, 'wb').write(data)
+        coresToMap, saved = lm_journal.read_journal()
+        assert coresToMap == [1, 2]
+        assert saved == [(0, [0], None, {}, 1)]
+
+
+def test_start_replaces_old_journal(cfg):
+    lm_journal.start_journal([1, 2])
+    lm_journal.add_to_journal(0, [0], None, {}, 1)
+    lm_journal.start_journal([3])
+    assert lm_journal.read_journal() == ([3], [])
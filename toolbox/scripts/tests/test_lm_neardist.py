@@ -0,0 +1,181 @@
+import math
+
+import numpy as npy
+
+import lm_neardist
+
+
+def point_segment_dist(p, a, b):
+    ax, ay = a
+    bx, by = b
+    dx, dy = bx - ax, by - ay
+    len2 = dx * dx + dy * dy
+    t = 0.0
+    if len2 > 0:
+        t = max(0.0, min(1.0, ((p[0] - ax) * dx + (p[1] - ay) * dy) / len2))
+    return math.hypot(ax + t * dx - p[0], ay + t * dy - p[1])
+
+
+def orientation(a, b, c):
+    value = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+    return int(value > 1e-12) - int(value < -1e-12)
+
+
+def segments_touch(a, b, c, d):
+    """True if segments ab and cd share any point"""
+    o1, o2 = orientation(a, b, c), orientation(a, b, d)
+    o3, o4 = orientation(c, d, a), orientation(c, d, b)
+    if o1 * o2 < 0 and o3 * o4 < 0:
+        return True
+    return min(point_segment_dist(c, a, b), point_segment_dist(d, a, b),
+               point_segment_dist(a, c, d), point_segment_dist(b, c, d)) < 1e-9
+
+
+def segment_dist(a, b, c, d):
+    if segments_touch(a, b, c, d):
+        return 0.0
+    return min(point_segment_dist(c, a, b), point_segment_dist(d, a, b),
+               point_segment_dist(a, c, d), point_segment_dist(b, c, d))
+
+
+def segments(rings):
+    for ring in rings:
+        for i in range(len(ring) - 1):
+            yield tuple(ring[i]), tuple(ring[i + 1])
+
+
+def inside(point, rings):
+    """Even-odd ray cast over all rings"""
+    x, y = point
+    count = 0
+    for (x1, y1), (x2, y2) in segments(rings):
+        if (y1 > y) != (y2 > y):
+            if x1 + (y - y1) * (x2 - x1) / (y2 - y1) > x:
+                count += 1
+    return count % 2 == 1
+
+
+def brute_distance(rings1, rings2):
+    dist = min(segment_dist(a, b, c, d) for a, b in segments(rings1)
+               for c, d in segments(rings2))
+    if dist == 0:
+        return 0.0
+    if inside(rings1[0][0], rings2) or inside(rings2[0][0], rings1):
+        return 0.0
+    return dist
+
+
+def star_ring(rand, centX, centY, radius, numVertices):
+    angles = npy.sort(rand.uniform(0, 2 * math.pi, numVertices))
+    radii = rand.uniform(radius / 2.0, radius, numVertices)
+    ring = npy.column_stack((centX + radii * npy.cos(angles),
+                             centY + radii * npy.sin(angles)))
+    return npy.vstack((ring, ring[:1]))
+
+
+def random_cores(seed, numCores=12):
+    rand = npy.random.RandomState(seed)
+    cores = {}
+    for core in range(1, numCores + 1):
+        centX, centY = rand.uniform(0, 100, 2)
+        radius = rand.uniform(5, 15)
+        rings = [star_ring(rand, centX, centY, radius, rand.randint(3, 12))]
+        if rand.uniform() < 0.3:  # A hole within the star's inner radius
+            rings.append(star_ring(rand, centX, centY, radius / 5.0, 5))
+        if rand.uniform() < 0.3:  # A second, separate part
+            rings.append(star_ring(rand, centX + 3 * radius, centY,
+                                   radius / 2.0, rand.randint(3, 8)))
+        cores[core * 3] = rings
+    return cores
+
+
+def rectangle(xMin, yMin, xMax, yMax):
+    return npy.array([[xMin, yMin], [xMin, yMax], [xMax, yMax],
+                      [xMax, yMin], [xMin, yMin]], dtype='float64')
+
+
+def test_core_distance_matches_brute_force():
+    for seed in range(4):
+        rings = random_cores(seed)
+        geometries = dict((core, lm_neardist.CoreGeometry(coreRings))
+                          for core, coreRings in rings.items())
+        cores = sorted(rings)
+        pairs = npy.array([(core1, core2) for core1 in cores
+                           for core2 in cores if core1 < core2])
+        dists = lm_neardist.get_core_distances(geometries, pairs)
+        for (core1, core2), dist in zip(pairs.tolist(), dists):
+            expected = brute_distance(rings[core1], rings[core2])
+            assert abs(dist - expected) < 1e-9, (core1, core2)
+
+
+def test_overlapping_and_nested_cores():
+    outer = [rectangle(0, 0, 10, 10), rectangle(3, 3, 7, 7)]  # With hole
+    cases = [
+        # In the hole, so 1 from the hole's edge
+        ([rectangle(4, 4, 6, 6)], 1.0),
+        # Inside the outer ring, clear of the hole
+        ([rectangle(1, 1, 2, 2)], 0.0),
+        # Surrounding the whole core
+        ([rectangle(-5, -5, 15, 15)], 0.0),
+        # Crossing like a plus sign, with no vertex inside the other
+        ([rectangle(-2, 1, 12, 2)], 0.0),
+        # Touching at an edge
+        ([rectangle(10, 2, 12, 4)], 0.0),
+        # Apart, nearest point on an edge rather than a vertex
+        ([npy.array([[13, 5], [20, 4], [20, 6], [13, 5]])], 3.0),
+    ]
+    core1 = lm_neardist.CoreGeometry(outer)
+    for rings, expected in cases:
+        core2 = lm_neardist.CoreGeometry(rings)
+        assert abs(lm_neardist.core_distance(core1, core2) - expected) < 1e-9
+        assert abs(lm_neardist.core_distance(core2, core1) - expected) < 1e-9
+        assert abs(brute_distance(outer, rings) - expected) < 1e-9
+
+
+def test_get_core_distances_missing_core():
+    cores = {1: lm_neardist.CoreGeometry([rectangle(0, 0, 1, 1)]),
+             2: lm_neardist.CoreGeometry([rectangle(3, 0, 4, 1)])}
+    dists = lm_neardist.get_core_distances(cores, npy.array([[1, 2], [1, 5]]))
+    assert dists == [2.0, None]
+
+
+def test_nearest_vertex_dists():
+    rand = npy.random.RandomState(2)
+    core = lm_neardist.CoreGeometry([star_ring(rand, 0, 0, 10, 9)])
+    points = rand.uniform(-20, 20, (50, 2))
+    expected = [min(math.hypot(*(point - vertex))
+                    for vertex in core.vertices) for point in points]
+    assert npy.allclose(core.nearest_vertex_dists(points), expected)
+
+
+def test_bbox_distance():
+    assert lm_neardist.bbox_distance((0, 0, 1, 1), (4, 5, 6, 6)) == 5.0
+    assert lm_neardist.bbox_distance((0, 0, 4, 4), (1, 1, 2, 2)) == 0
+    assert lm_neardist.bbox_distance((0, 0, 1, 1), (3, 0, 4, 1)) == 2.0
+
+
+def test_candidate_pairs_matches_brute_force():
+    rand = npy.random.RandomState(0)
+    cores = rand.permutation(npy.arange(1, 60) * 2)
+    corners = rand.uniform(0, 1000, (len(cores), 2))
+    sizes = rand.uniform(0, 80, (len(cores), 2))
+    boxes = npy.hstack((corners, corners + sizes))
+    for maxDist in (None, 0, 50, 200, 5000):
+        expected = set()
+        for i in range(len(cores)):
+            for j in range(len(cores)):
+                if cores[i] < cores[j] and (
+                    maxDist is None or
+                    lm_neardist.bbox_distance(boxes[i], boxes[j]) <= maxDist):
+                    expected.add((cores[i], cores[j]))
+        for chunkSize in (7, lm_neardist.PAIRCHUNK):
+            chunks = list(lm_neardist.candidate_pairs(cores, boxes, maxDist,
+                                                      chunkSize))
+            if chunks:
+                pairs = npy.concatenate(chunks)
+            else:
+                pairs = npy.zeros((0, 2), dtype='int32')
+            assert pairs.dtype == npy.int32
+            found = [tuple(pair) for pair in pairs.tolist()]
+            assert len(found) == len(set(found))
+            assert set(found) == expected
@@ -0,0 +1,28 @@
+import numpy as npy
+
+import lm_pairs
+
+
+def test_pairs_are_symmetric():
+    store = lm_pairs.PairStore()
+    store.put(7, 3, intCore=None)
+    store.put(3, 7, lcpLength=12.5)
+    store.put(npy.int32(2), npy.float64(9), intCore=5)
+    assert len(store) == 2
+    assert store.keys() == [(2, 9), (3, 7)]
+    assert store.has(9, 2)
+    assert store.get(7, 3) == {'intCore': None, 'lcpLength': 12.5}
+    assert store.get(9, 2, lm_pairs.INTCORE) == 5
+    assert store.get(9, 2, lm_pairs.LCPLENGTH, -1) == -1
+    assert store.get(1, 2) is None
+
+
+def test_update():
+    store = lm_pairs.PairStore()
+    store.put(1, 2, intCore=3)
+    other = lm_pairs.PairStore()
+    other.put(2, 1, lcpLength=4.0)
+    other.put(5, 6, intCore=None)
+    store.update(other)
+    assert store.pairs == {(1, 2): {'intCore': 3, 'lcpLength': 4.0},
+                           (5, 6): {'intCore': None}}
@@ -0,0 +1,91 @@
+import numpy as npy
+
+import lm_raster
+
+GRID = (1000.0, 2000.0, 30.0, 40, 50)  # xMin, yMin, cellSize, nrows, ncols
+
+
+def cell_bounds(grid, row, col):
+    xMin, yMin, cellSize, nrows, ncols = grid
+    x0 = xMin + col * cellSize
+    y0 = yMin + (nrows - row - 1) * cellSize
+    return x0, y0, x0 + cellSize, y0 + cellSize
+
+
+def test_disk_mask_matches_brute_force():
+    rand = npy.random.RandomState(1)
+    for numCircles in (1, 3):
+        # centX, centY, radius, as in the first columns of circle arrays
+        circles = npy.column_stack((rand.uniform(900, 2600, numCircles),
+                                    rand.uniform(1900, 3300, numCircles),
+                                    rand.uniform(20, 300, numCircles)))
+        window, mask = lm_raster.disk_mask(circles, GRID)
+        full = npy.zeros(GRID[3:5], dtype='bool')
+        for row in range(GRID[3]):
+            for col in range(GRID[4]):
+                cx0, cy0, cx1, cy1 = cell_bounds(GRID, row, col)
+                centX, centY = (cx0 + cx1) / 2, (cy0 + cy1) / 2
+                full[row, col] = (((centX - circles[:, 0]) ** 2 +
+                                   (centY - circles[:, 1]) ** 2) <=
+                                  circles[:, 2] ** 2).any()
+        if window is None:
+            assert not full.any()
+            continue
+        assert (full[lm_raster.window_slices(window)] == mask).all()
+        assert full.sum() == mask.sum()
+
+
+def test_disk_mask_off_grid():
+    circles = npy.array([[0.0, 0.0, 10.0]])
+    assert lm_raster.disk_mask(circles, GRID) == (None, None)
+
+
+def test_window_grid_round_trip():
+    window = (5, 17, 8, 30)
+    subGrid = lm_raster.window_grid(GRID, window)
+    assert subGrid[2:] == (30.0, 12, 22)
+    assert lm_raster.grid_window(subGrid, GRID) == window
+    # The window's top left cell is the same cell of both grids
+    assert cell_bounds(subGrid, 0, 0) == cell_bounds(GRID, 5, 8)
+    assert lm_raster.full_window(GRID) == (0, 40, 0, 50)
+
+
+def test_intersect_and_relative_windows():
+    rand = npy.random.RandomState(2)
+    for i in range(100):
+        window1 = tuple(npy.sort(rand.randint(0, 20, 2)).tolist() +
+                        npy.sort(rand.randint(0, 20, 2)).tolist())
+        window2 = tuple(npy.sort(rand.randint(0, 20, 2)).tolist() +
+                        npy.sort(rand.randint(0, 20, 2)).tolist())
+        cells1 = npy.zeros((20, 20), dtype='bool')
+        cells1[lm_raster.window_slices(window1)] = True
+        cells2 = npy.zeros((20, 20), dtype='bool')
+        cells2[lm_raster.window_slices(window2)] = True
+        overlap = lm_raster.intersect_windows(window1, window2)
+        if overlap is None:
+            assert not (cells1 & cells2).any()
+            continue
+        both = npy.zeros((20, 20), dtype='bool')
+        both[lm_raster.window_slices(overlap)] = True
+        assert (both == (cells1 & cells2)).all()
+        values = npy.arange(400).reshape(20, 20)
+        inner = values[lm_raster.window_slices(window1)]
+        relative = lm_raster.relative_window(overlap, window1)
+        assert (inner[lm_raster.window_slices(relative)] ==
+                values[lm_raster.window_slices(overlap)]).all()
+
+
+def test_extent_window_matches_brute_force():
+    rand = npy.random.RandomState(0)
+    for i in range(50):
+        x = npy.sort(rand.uniform(700, 2800, 2))
+        y = npy.sort(rand.uniform(1700, 3500, 2))
+        row0, row1, col0, col1 = lm_raster.extent_window(x[0], y[0], x[1],
+                                                         y[1], GRID)
+        for row in range(GRID[3]):
+            for col in range(GRID[4]):
+                cx0, cy0, cx1, cy1 = cell_bounds(GRID, row, col)
+                overlaps = (cx0 < x[1] and cx1 > x[0] and
+                            cy0 < y[1] and cy1 > y[0])
+                inWindow = row0 <= row < row1 and col0 <= col < col1
+                assert overlaps == inWindow
@@ -0,0 +1,74 @@
+import numpy as npy
+
+import stubs
+
+lu = stubs.load_functions('lm_util.py',
+                          ['find_root', 'join_sets', 'components_from_edges',
+                           'hook_components', 'check_stars',
+                           'conditional_hooking', 'unconditional_hooking',
+                           'relabel', 'components_no_sparse'],
+                          stubs.lm_util)
+
+
+def brute_components(numNodes, edges):
+    """Returns a component set for each node by search"""
+    neighbors = dict((node, set()) for node in range(numNodes))
+    for node1, node2 in edges:
+        neighbors[node1].add(node2)
+        neighbors[node2].add(node1)
+    components = {}
+    for node in range(numNodes):
+        if node in components:
+            continue
+        found = set([node])
+        stack = [node]
+        while stack:
+            for other in neighbors[stack.pop()]:
+                if other not in found:
+                    found.add(other)
+                    stack.append(other)
+        for other in found:
+            components[other] = frozenset(found)
+    return components
+
+
+def random_edges(rand, numNodes, numEdges):
+    nodes1 = rand.randint(0, numNodes, numEdges)
+    nodes2 = rand.randint(0, numNodes, numEdges)
+    return nodes1, nodes2
+
+
+def test_components_from_edges():
+    for seed in range(10):
+        rand = npy.random.RandomState(seed)
+        numNodes = rand.randint(1, 30)
+        nodes1, nodes2 = random_edges(rand, numNodes, rand.randint(0, 30))
+        labels = lu.components_from_edges(numNodes, nodes1, nodes2)
+        expected = brute_components(numNodes, zip(nodes1, nodes2))
+        for node in range(numNodes):
+            sameLabel = frozenset(npy.nonzero(labels == labels[node])[0])
+            assert sameLabel == expected[node]
+
+        # Same labels as from the adjacency matrix
+        G = npy.zeros((numNodes, numNodes), dtype='bool')
+        G[nodes1, nodes2] = True
+        G[nodes2, nodes1] = True
+        assert (lu.components_no_sparse(G) == labels).all()
+
+
+def test_union_find():
+    for seed in range(10):
+        rand = npy.random.RandomState(seed)
+        numNodes = 25
+        nodes1, nodes2 = random_edges(rand, numNodes, rand.randint(0, 30))
+        parent = dict((node, node) for node in range(numNodes))
+        joined = []
+        for node1, node2 in zip(nodes1.tolist(), nodes2.tolist()):
+            before = brute_components(numNodes, joined)
+            wasApart = node2 not in before[node1]
+            assert lu.join_sets(parent, node1, node2) == wasApart
+            joined.append((node1, node2))
+        expected = brute_components(numNodes, joined)
+        for node in range(numNodes):
+            # Each set is labeled by its lowest node
+            assert lu.find_root(parent, node) == min(expected[node])
@@ -0,0 +1,105 @@
+import numpy as npy
+import pytest
+
+import stubs
+import lm_adj
+
+stubs.load_functions('lm_util.py', ['find_root', 'join_sets'], stubs.lm_util)
+s2 = stubs.load_functions('s2_buildNetwork.py',
+                          ['make_link_table', 'get_clusters'])
+s2.lm_adj = lm_adj
+
+
+@pytest.fixture
+def ltb_cfg(cfg):
+    cfg.LTB_CORE1 = 1
+    cfg.LTB_CORE2 = 2
+    cfg.LTB_CLUST1 = 3
+    cfg.LTB_CLUST2 = 4
+    cfg.LTB_EUCDIST = 6
+    cfg.LTB_EUCADJ = 8
+    cfg.LTB_CWDADJ = 9
+    return cfg
+
+
+def random_dists(rand, numDists=200):
+    cores = rand.randint(1, 30, (numDists, 2))
+    cores = cores[cores[:, 0] != cores[:, 1]]
+    dists = rand.randint(0, 1000, len(cores))
+    return npy.column_stack((cores, dists)).astype('float64')
+
+
+def test_make_link_table_keeps_min_dists(ltb_cfg):
+    rand = npy.random.RandomState(0)
+    eucDists = random_dists(rand)
+    eucDists[0] = [70000, 5, 12]  # IDs past 16 bits
+    minDists = {}
+    for core1, core2, dist in eucDists.astype('int64').tolist():
+        pair = (min(core1, core2), max(core1, core2))
+        minDists[pair] = min(minDists.get(pair, dist), dist)
+
+    linkTable = s2.make_link_table(eucDists, None, None)
+    assert linkTable.shape == (len(minDists), 10)
+    assert [(row[1], row[2]) for row in linkTable.tolist()] == (
+        sorted(minDists))
+    for row in linkTable.tolist():
+        assert row[6] == minDists[(row[1], row[2])]
+    assert (linkTable[:, [8, 9]] == -1).all()
+
+
+def test_make_link_table_flags_adjacency(ltb_cfg):
+    rand = npy.random.RandomState(1)
+    eucDists = random_dists(rand)
+    cwdAdj = set([(1, 2), (3, 7), (5, 29)])
+    eucAdj = set([(3, 7), (10, 12)])
+    for pair in cwdAdj | eucAdj:
+        eucDists = npy.vstack((eucDists, [pair[1], pair[0], 1]))
+
+    def adj_keys(pairs):
+        pairs = npy.array(sorted(pairs))
+        return npy.unique(lm_adj.pair_keys(pairs[:, 0], pairs[:, 1]))
+
+    linkTable = s2.make_link_table(eucDists, adj_keys(cwdAdj), None)
+    for row in linkTable.tolist():
+        assert row[9] == int((row[1], row[2]) in cwdAdj)
+    assert (linkTable[:, 8] == 0).all()
+
+    linkTable = s2.make_link_table(eucDists, adj_keys(cwdAdj),
+                                   adj_keys(eucAdj))
+    for row in linkTable.tolist():
+        assert row[9] == int((row[1], row[2]) in cwdAdj)
+        assert row[8] == int((row[1], row[2]) in eucAdj)
+
+
+def relabel_clusters(linkTable, maxDist):
+    """Cluster IDs by relabeling the link table at each join"""
+    linkTable = linkTable.copy()
+    linkTable[:, 3] = linkTable[:, 1]
+    linkTable[:, 4] = linkTable[:, 2]
+    numJoins = 0
+    for x in range(linkTable.shape[0]):
+        frag1ID = linkTable[x, 3]
+        frag2ID = linkTable[x, 4]
+        if frag1ID == frag2ID or linkTable[x, 6] >= maxDist:
+            continue
+        linkTable[linkTable[:, 3] == frag2ID, 3] = frag1ID
+        linkTable[linkTable[:, 4] == frag2ID, 4] = frag1ID
+        numJoins = numJoins + 1
+    clusters = {}
+    for row in linkTable.tolist():
+        clusters[row[1]] = row[3]
+        clusters[row[2]] = row[4]
+    return clusters, numJoins
+
+
+def test_get_clusters_matches_relabeling(ltb_cfg):
+    rand = npy.random.RandomState(2)
+    for trial in range(20):
+        linkTable = s2.make_link_table(random_dists(rand, 60), None, None)
+        # Link table order isn't always core order
+        linkTable = linkTable[rand.permutation(len(linkTable))]
+        flip = rand.uniform(size=len(linkTable)) < 0.5
+        linkTable[flip, 1:3] = linkTable[flip, 2:0:-1]
+        ltb_cfg.MAXEUCDIST = rand.randint(50, 300)
+        assert s2.get_clusters(linkTable) == (
+            relabel_clusters(linkTable, ltb_cfg.MAXEUCDIST))
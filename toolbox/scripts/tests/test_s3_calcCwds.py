@@ -0,0 +1,216 @@
+import os.path as path
+import traceback
+
+import numpy as npy
+import pytest
+
+import stubs
+
+s3 = stubs.load_functions('s3_calcCwds.py',
+                          ['get_core_rows', 'get_core_dependencies',
+                           'run_cwd_pool', 'wait_for_core',
+                           'check_stop_at_targets', 'get_target_cutoff'])
+s3.path = path
+s3.traceback = traceback
+s3.gprint = lambda string: None
+s3.init_cwd_worker = None
+s3.cwdStore = None
+
+
+class Sleep(object):
+    """Stands in for the time module, so polling doesn't wait"""
+
+    def sleep(self, seconds):
+        pass
+
+
+s3.time = Sleep()
+
+
+class RandomResult(object):
+    """Pool result that becomes ready at random and runs when first asked"""
+
+    def __init__(self, rand, func, args):
+        self.rand = rand
+        self.func = func
+        self.args = args
+
+    def ready(self):
+        return self.rand.uniform() < 0.3
+
+    def successful(self):
+        return True
+
+    def get(self):
+        return self.func(*self.args)
+
+
+class FailedResult(object):
+    """Pool result for a task that raised in the worker"""
+
+    def ready(self):
+        return True
+
+    def successful(self):
+        return False
+
+    def get(self):
+        raise ValueError('worker blew up')
+
+
+class RandomPool(object):
+    """Finishes pool tasks in random order"""
+
+    def __init__(self, rand):
+        self.rand = rand
+
+    def apply_async(self, func, args):
+        return RandomResult(self.rand, func, args)
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class RaisedError(Exception):
+    pass
+
+
+def raise_error(msg):
+    raise RaisedError(msg)
+
+
+class UpdateOnly(object):
+    """Pair store that ignores updates"""
+
+    def update(self, pairs):
+        pass
+
+
+@pytest.fixture
+def pool_cfg(cfg, monkeypatch):
+    cfg.LTB_CORE1 = 1
+    cfg.LTB_CORE2 = 2
+    cfg.LTB_LINKTYPE = 3
+    cfg.NUMWORKERS = 4
+    monkeypatch.setattr(stubs.lm_util, 'get_worker_settings', lambda: {},
+                        raising=False)
+    monkeypatch.setattr(stubs.lm_util, 'raise_error', raise_error,
+                        raising=False)
+    return cfg
+
+
+def make_link_table(links, linkTypes):
+    linkTable = npy.zeros((len(links), 5))
+    linkTable[:, 0] = range(len(links))
+    linkTable[:, 1:3] = links
+    linkTable[:, 3] = linkTypes
+    return linkTable
+
+
+def fake_calcs(coresToMap, x, rows):
+    """Disables and sets values on links to higher cores, depending on the
+    valid links the core has when it is mapped, as cwd calcs do.
+
+    """
+    core = int(coresToMap[x])
+    rows = rows.copy()
+    valid = rows[rows[:, 3] > 0]
+    targets = set(valid[:, 1:3].ravel().astype(int).tolist()) - set([core])
+    for row in rows:
+        other = int(row[1] + row[2] - core)
+        if other > core:
+            if row[3] > 0 and (len(targets) + other) % 3 == 0:
+                row[3] = -1
+            row[4] = len(targets)
+    return rows
+
+
+def test_get_core_dependencies(pool_cfg):
+    linkTable = make_link_table([(1, 2), (2, 3), (1, 4), (3, 4), (2, 4)],
+                                [1, 1, 1, 1, -1])
+    coresToMap = npy.array([1, 2, 3, 4])
+    waitingOn, dependents = s3.get_core_dependencies(linkTable, coresToMap,
+                                                     0)
+    assert waitingOn == {0: set(), 1: set([0]), 2: set([1]),
+                         3: set([0, 2])}
+    assert dependents == {0: set([1, 3]), 1: set([2]), 2: set([3]),
+                          3: set()}
+
+    # Cores before the start index are already done
+    waitingOn, dependents = s3.get_core_dependencies(linkTable, coresToMap,
+                                                     2)
+    assert waitingOn == {2: set(), 3: set([2])}
+    assert dependents == {2: set([3]), 3: set()}
+
+
+def test_run_cwd_pool_matches_serial_order(pool_cfg, monkeypatch):
+    rand = npy.random.RandomState(0)
+    for trial in range(100):
+        numCores = rand.randint(2, 12)
+        links = [(core1, core2) for core1 in range(1, numCores + 1)
+                 for core2 in range(core1 + 1, numCores + 1)
+                 if rand.uniform() < 0.5]
+        if not links:
+            continue
+        linkTable = make_link_table(links,
+                                    rand.choice([1, 1, 1, -2], len(links)))
+        coresToMap = npy.unique(linkTable[:, 1:3])
+        startIndex = rand.randint(len(coresToMap))
+
+        serial = linkTable.copy()
+        for x in range(startIndex, len(coresToMap)):
+            rows = s3.get_core_rows(serial, coresToMap[x])
+            serial[rows] = fake_calcs(coresToMap, x, serial[rows])
+
+        journal = []
+        s3.cwd_worker = lambda x, rows: (x, fake_calcs(coresToMap, x, rows),
+                                         {}, None, None, None)
+        s3.add_to_journal = lambda x, *args: journal.append(x)
+        monkeypatch.setattr(stubs.lm_util, 'create_worker_pool',
+                            lambda *args: RandomPool(rand), raising=False)
+        result = s3.run_cwd_pool(linkTable, coresToMap, startIndex,
+                                 UpdateOnly())
+        assert npy.array_equal(result, serial)
+        assert journal == list(range(startIndex, len(coresToMap)))
+
+
+def test_wait_for_core_reports_failures(pool_cfg):
+    running = {0: FailedResult()}
+    with pytest.raises(RaisedError) as info:
+        s3.wait_for_core(running, npy.array([7]))
+    assert 'core area #7' in str(info.value)
+    assert 'worker blew up' in str(info.value)
+    assert running == {}
+
+
+def test_check_stop_at_targets(cfg, monkeypatch):
+    warnings = []
+    monkeypatch.setattr(stubs.lm_util, 'warn', warnings.append,
+                        raising=False)
+    cfg.STOPATTARGETS = True
+    cfg.WRITETRUNCRASTER = True
+    cfg.CWDTHRESH = 1000
+    s3.check_stop_at_targets()
+    assert cfg.STOPATTARGETS
+    assert warnings == []
+    assert s3.get_target_cutoff() == 1000
+
+    # Later steps that need more are warned about and given what they need
+    cfg.BARRIER_CWD_THRESH = '5000'
+    cfg.CWDCUTOFF = -3000
+    s3.check_stop_at_targets()
+    assert cfg.STOPATTARGETS
+    assert len(warnings) == 1
+    assert s3.get_target_cutoff() == 5000
+
+    # Cells past the cutoff would be missing from untruncated corridors
+    cfg.WRITETRUNCRASTER = False
+    s3.check_stop_at_targets()
+    assert not cfg.STOPATTARGETS
+    assert len(warnings) == 2
@@ -0,0 +1,77 @@
+import numpy as npy
+
+import stubs
+
+stubs.load_functions('lm_util.py', ['find_root', 'join_sets'], stubs.lm_util)
+s4 = stubs.load_functions('s4_refineNetwork.py',
+                          ['get_nearest_links', 'get_core_indexes',
+                           'get_component_links'])
+
+
+def brute_nearest_links(links, distCol, maxNN):
+    rows = set()
+    for core in set(links[:, 1].tolist() + links[:, 2].tolist()):
+        coreRows = [row for row in range(len(links))
+                    if core in links[row, 1:3].tolist()]
+        # Ties go to the link earlier in the table
+        coreRows.sort(key=lambda row: (links[row, distCol], row))
+        rows.update(coreRows[:maxNN])
+    return sorted(rows)
+
+
+def test_nearest_links_match_brute_force(cfg):
+    cfg.LTB_CORE1 = 1
+    cfg.LTB_CORE2 = 2
+    for seed in range(10):
+        rand = npy.random.RandomState(seed)
+        numLinks = rand.randint(1, 40)
+        links = npy.zeros((numLinks, 5))
+        links[:, 0] = npy.arange(numLinks) + 1
+        links[:, 1] = rand.randint(1, 10, numLinks)
+        links[:, 2] = links[:, 1] + rand.randint(1, 5, numLinks)
+        links[:, 4] = rand.randint(0, 6, numLinks)  # Many ties
+        for maxNN in (1, 2, 5):
+            rows = s4.get_nearest_links(links, 4, maxNN)
+            assert rows.tolist() == brute_nearest_links(links, 4, maxNN)
+
+
+def test_nearest_links_empty(cfg):
+    cfg.LTB_CORE1 = 1
+    cfg.LTB_CORE2 = 2
+    assert len(s4.get_nearest_links(npy.zeros((0, 5)), 4, 1)) == 0
+
+
+def test_core_indexes():
+    cores = npy.array([2, 5, 9, 14])
+    coreCols = npy.array([[5, 14], [9, 3], [20, 2]])
+    expected = [[1, 3], [2, 0], [0, 0]]
+    assert s4.get_core_indexes(cores, coreCols).tolist() == expected
+
+
+def relabel_component_links(links, distCol):
+    """Component links by relabeling components at each join"""
+    links = links.copy()
+    cluRows = []
+    for row in range(len(links)):
+        if (links[row, distCol] > 0 and links[row, 5] in (1, 100) and
+            links[row, 12] != links[row, 13]):
+            cluRows.append(row)
+            newComp = min(links[row, 12:14])
+            oldComp = max(links[row, 12:14])
+            links[:, 12:14][links[:, 12:14] == oldComp] = newComp
+    return cluRows
+
+
+def test_component_links_match_relabeling(cfg):
+    cfg.LTB_LINKTYPE = 5
+    cfg.LT_CORR = 1
+    cfg.LT_KEEP = 100
+    for seed in range(20):
+        rand = npy.random.RandomState(seed)
+        numLinks = rand.randint(1, 60)
+        links = npy.zeros((numLinks, 14))
+        links[:, 5] = rand.choice([1, 1, 1, 100, 30, -1], numLinks)
+        links[:, 6] = npy.sort(rand.randint(0, 50, numLinks))
+        links[:, 12:14] = rand.randint(0, 15, (numLinks, 2))
+        assert s4.get_component_links(links, 6, 12, 13) == (
+            relabel_component_links(links, 6))
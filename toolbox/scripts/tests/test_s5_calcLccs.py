@@ -0,0 +1,110 @@
+import math
+import traceback
+
+import numpy as npy
+
+import stubs
+import lm_cwdstore
+import lm_raster
+
+s5 = stubs.load_functions('s5_calcLccs.py',
+                          ['mosaic_corridor', 'get_corridor_window',
+                           'get_corridor', 'run_mosaic_pool',
+                           'reduce_minimum', 'init_mosaic_worker',
+                           'mosaic_worker'])
+s5.math = math
+s5.traceback = traceback
+s5.lm_raster = lm_raster
+s5.gprint = lambda string: None
+
+GRID = (0.0, 0.0, 10.0, 37, 29)
+
+
+class SerialPool(object):
+    """Runs pool tasks in this process"""
+
+    def __init__(self, numWorkers, initializer=None, initargs=()):
+        initializer(*initargs)
+
+    def imap(self, func, tasks):
+        for task in tasks:
+            yield func(task)
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+def make_store(rand):
+    """Returns a cwd store and the full-grid cwds it holds"""
+    store = lm_cwdstore.CwdStore(GRID)
+    full = {}
+    for core in range(1, 8):
+        rows = npy.sort(rand.choice(GRID[3] + 1, 2, replace=False))
+        cols = npy.sort(rand.choice(GRID[4] + 1, 2, replace=False))
+        window = (rows[0], rows[1], cols[0], cols[1])
+        cwd = npy.empty(GRID[3:5], dtype='float32')
+        cwd.fill(npy.inf)
+        cwd[lm_raster.window_slices(window)] = rand.uniform(
+            0, 100, (rows[1] - rows[0], cols[1] - cols[0]))
+        store.put(core, window, cwd[lm_raster.window_slices(window)])
+        full[core] = cwd
+    return store, full
+
+
+def brute_mosaic(full, jobs):
+    mosaic = npy.empty(GRID[3:5], dtype='float32')
+    mosaic.fill(npy.inf)
+    for corex, corey, lcDist in jobs:
+        corridor = full[corex] + full[corey]
+        if lcDist is not None:
+            corridor -= lcDist
+        mosaic = npy.minimum(mosaic, corridor)
+    return mosaic
+
+
+def test_mosaic_corridor_matches_brute_force(cfg):
+    for seed in range(5):
+        rand = npy.random.RandomState(seed)
+        store, full = make_store(rand)
+        jobs = [(corex, corey, rand.choice([None, float(rand.uniform(50))]))
+                for corex in range(1, 8) for corey in range(corex + 1, 8)]
+        expected = brute_mosaic(full, jobs)
+
+        serial = npy.empty(GRID[3:5], dtype='float32')
+        serial.fill(npy.inf)
+        for corex, corey, lcDist in jobs:
+            s5.mosaic_corridor(serial, store, corex, corey, lcDist)
+        assert (serial == expected).all()
+
+
+def test_mosaic_pool_matches_brute_force(cfg, monkeypatch):
+    monkeypatch.setattr(stubs.lm_util, 'create_worker_pool', SerialPool,
+                        raising=False)
+    for seed in range(5):
+        rand = npy.random.RandomState(seed)
+        store, full = make_store(rand)
+        jobs = [(corex, corey, rand.choice([None, float(rand.uniform(50))]))
+                for corex in range(1, 8) for corey in range(corex + 1, 8)]
+        expected = brute_mosaic(full, jobs)
+
+        for numWorkers, stripCells in ((1, 10000000), (3, 100), (4, 1)):
+            cfg.NUMWORKERS = numWorkers
+            cfg.STRIPCELLS = stripCells
+            pooled = npy.empty(GRID[3:5], dtype='float32')
+            pooled.fill(npy.inf)
+            s5.run_mosaic_pool(pooled, store, jobs)
+            assert (pooled == expected).all()
+
+
+def test_reduce_minimum():
+    rand = npy.random.RandomState(0)
+    for numArrays in range(1, 10):
+        arrays = [rand.uniform(size=(3, 4)) for i in range(numArrays)]
+        expected = npy.minimum.reduce(arrays)
+        assert (s5.reduce_minimum(list(arrays)) == expected).all()